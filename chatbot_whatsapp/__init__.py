@@ -1,3 +1,4 @@
-from . import models
-from . import utils
-from . import config
+from . import models
+from . import controllers
+from . import utils
+from . import config
@@ -1,15 +1,25 @@
-import yaml
-import os
-
-def load_config(file_name):
-    """Carga un archivo de configuración YAML desde la ruta del módulo."""
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    config_file = os.path.join(base_path, file_name)
-    
-    with open(config_file, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file)
-
-# Cargar todas las configuraciones en diccionarios separados
-general_config = load_config('general_config.yml')
-prompts_config = load_config('prompts.yml')
-messages_config = load_config('messages.yml')
\ No newline at end of file
+import hashlib
+import yaml
+import os
+
+def load_config(file_name):
+    """Carga un archivo de configuración YAML desde la ruta del módulo."""
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    config_file = os.path.join(base_path, file_name)
+    
+    with open(config_file, 'r', encoding='utf-8') as file:
+        return yaml.safe_load(file)
+
+def config_version(file_name):
+    """Hash corto del contenido de un archivo de configuración, para invalidar caches."""
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_path, file_name), 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()[:12]
+
+# Cargar todas las configuraciones en diccionarios separados
+general_config = load_config('general_config.yml')
+prompts_config = load_config('prompts.yml')
+messages_config = load_config('messages.yml')
+
+# Cambia cada vez que se edita prompts.yml
+prompts_version = config_version('prompts.yml')
\ No newline at end of file
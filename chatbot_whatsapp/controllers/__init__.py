@@ -0,0 +1 @@
+from . import metrics
\ No newline at end of file
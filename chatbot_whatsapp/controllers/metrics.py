@@ -0,0 +1,23 @@
+import hmac
+
+from odoo import SUPERUSER_ID, http
+from odoo.http import request
+
+
+class ChatbotMetricsController(http.Controller):
+
+    @http.route('/chatbot_whatsapp/metrics', type='http', auth='none', methods=['GET'], csrf=False, save_session=False)
+    def metrics(self, token=None, **kwargs):
+        """
+        Métricas del chatbot para Prometheus. Requiere el token configurado en
+        el parámetro chatbot_whatsapp.metrics_token, como ?token= o Bearer.
+        """
+        env = request.env(user=SUPERUSER_ID)
+        expected = env['ir.config_parameter'].get_param('chatbot_whatsapp.metrics_token')
+        auth_header = request.httprequest.headers.get('Authorization', '')
+        provided = token or (auth_header[7:] if auth_header.startswith('Bearer ') else '')
+        if not expected or not hmac.compare_digest(provided, expected):
+            return request.make_response('Forbidden\n', status=403, headers=[('Content-Type', 'text/plain')])
+
+        body = env['chatbot.metric.span'].render_prometheus()
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
\ No newline at end of file
@@ -0,0 +1,81 @@
+# post-migrate.py
+"""
+Pasa el carrito y el buffer de cada conversación, que hasta la versión 1.0
+se guardaban como JSON en chatbot.whatsapp.memory (pending_order_lines y
+data_buffer), a los modelos hijos cart.line, pending.product y candidate.
+"""
+import json
+import logging
+
+from odoo import api, SUPERUSER_ID
+from odoo.fields import Command
+
+_logger = logging.getLogger(__name__)
+
+# Claves del antiguo data_buffer que guardaban opciones ofrecidas al cliente.
+CANDIDATE_KEYS = {'products': 'product', 'addresses': 'address', 'invoice_ids': 'invoice'}
+
+
+def _column_exists(cr, table, column):
+    cr.execute("""
+        SELECT 1 FROM information_schema.columns
+         WHERE table_name = %s AND column_name = %s
+    """, (table, column))
+    return bool(cr.fetchone())
+
+
+def _loads(value, default):
+    try:
+        return json.loads(value) if value else default
+    except ValueError:
+        return default
+
+
+def migrate(cr, version):
+    if not (_column_exists(cr, 'chatbot_whatsapp_memory', 'pending_order_lines')
+            and _column_exists(cr, 'chatbot_whatsapp_memory', 'data_buffer')):
+        return
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Memory = env['chatbot.whatsapp.memory']
+    Candidate = env['chatbot.whatsapp.candidate']
+    valid_states = {state for state, _label in Memory._fields['flow_state'].selection}
+
+    cr.execute("""
+        UPDATE chatbot_whatsapp_memory SET flow_state = NULL
+         WHERE flow_state IS NOT NULL AND flow_state NOT IN %s
+    """, (tuple(valid_states),))
+
+    cr.execute("""
+        SELECT id, pending_order_lines, data_buffer FROM chatbot_whatsapp_memory
+         WHERE COALESCE(pending_order_lines, '[]') NOT IN ('', '[]')
+            OR COALESCE(data_buffer, '') NOT IN ('', '{}')
+    """)
+    rows = cr.fetchall()
+    existing_products = set(env['product.product'].with_context(active_test=False).search([]).ids)
+
+    for memory_id, order_lines, data_buffer in rows:
+        cart = _loads(order_lines, [])
+        data = _loads(data_buffer, {})
+        vals = {
+            'cart_line_ids': [
+                Command.create({'sequence': seq, 'product_id': item['product_id'], 'quantity': int(item['quantity'])})
+                for seq, item in enumerate(cart)
+                if item.get('product_id') in existing_products
+            ],
+            'pending_product_ids': [
+                Command.create({'sequence': seq, 'query': item.get('query'), 'quantity': item.get('quantity') or 0})
+                for seq, item in enumerate(data.get('pending_products') or data.get('original_queue') or [])
+                if item.get('query')
+            ],
+            'pending_qty': data.get('qty') or 0,
+        }
+        candidates = []
+        for key, kind in CANDIDATE_KEYS.items():
+            for seq, item in enumerate(data.get(key) or []):
+                candidates.append(Command.create(Candidate._from_dict(kind, seq, item if isinstance(item, dict) else {'id': item})))
+        vals['candidate_ids'] = candidates
+        Memory.browse(memory_id).write(vals)
+
+    cr.execute("ALTER TABLE chatbot_whatsapp_memory DROP COLUMN pending_order_lines, DROP COLUMN data_buffer")
+    _logger.info(f"🛒 Migradas {len(rows)} conversaciones a carrito y estado tipados.")
\ No newline at end of file
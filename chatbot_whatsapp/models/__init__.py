@@ -1,2 +1,14 @@
-from . import whatsapp_chatbot
-from . import chat_memory
+from . import whatsapp_chatbot
+from . import chat_memory
+from . import inbound_job
+from . import intent_cache
+from . import product_search_index
+from . import stock_snapshot
+from . import price_cache
+from . import partner_phone
+from . import outbound_message
+from . import metric_span
+from . import llm_call
+from . import partner_profile
+from . import product_embedding
+from . import partner_affinity
\ No newline at end of file
@@ -1,68 +1,269 @@
-from odoo import models, fields, api
-from datetime import timedelta, datetime # Importar datetime
-import logging
-
-_logger = logging.getLogger(__name__)
-
-
-class WhatsAppMemory(models.Model):
-    _name = 'chatbot.whatsapp.memory'
-    _description = 'Memoria del chatbot de WhatsApp'
-
-    phone = fields.Char(index=True)
-    partner_id = fields.Many2one('res.partner', string="Cliente")
-
-    # Estado y contexto
-    last_intent_detected = fields.Char(string="Última Intención Detectada")
-    flow_state = fields.Char(string="Estado del Flujo")
-    data_buffer = fields.Text(string="Buffer de Datos Temporales")
-    timestamp = fields.Datetime(string="Última Actividad", default=fields.Datetime.now, required=True)
-
-    # Contexto específico del pedido
-    last_variant_id = fields.Many2one('product.product', string="Última Variante Seleccionada")
-    last_qty_suggested = fields.Integer(string="Última Cantidad Sugerida")
-    
-    # Carrito de Compras
-    pending_order_lines = fields.Text(string="Líneas de Pedido Pendientes (JSON)", default='[]')
-    
-    # --- CAMPOS NUEVOS PARA HUMAN TAKEOVER ---
-    human_takeover = fields.Boolean(string="Toma de Control Humana", default=False)
-    takeover_until = fields.Datetime(string="Toma de Control Hasta")
-    # ----------------------------------------
-
-    _sql_constraints = [
-        ('partner_id_unique', 'unique(partner_id)', 'Solo puede existir un registro de memoria por cliente.')
-    ]
-
-    @api.model
-    def clean_old_memory(self):
-        # Limpia memorias inactivas por más de 30 minutos para evitar que queden carritos abandonados.
-        expired_time = fields.Datetime.now() - timedelta(minutes=30)
-        old_memory_records = self.sudo().search([('timestamp', '<', expired_time), ('human_takeover', '=', False)]) # No limpiar si un humano intervino
-        if old_memory_records:
-            _logger.info(f"🗑️ Limpiando {len(old_memory_records)} registros de memoria expirados.")
-            old_memory_records.unlink()
-
-    def write(self, vals):
-        # Actualiza el timestamp en cada escritura para mantener la sesión activa
-        if 'timestamp' not in vals:
-            vals['timestamp'] = fields.Datetime.now()
-        return super(WhatsAppMemory, self).write(vals)
-
-    @api.model
-    def reactivate_expired_takeovers(self):
-        """
-        Método para ser llamado por un cron job. Reactiva el chatbot para conversaciones
-        donde el humano no ha hablado por más de X tiempo.
-        """
-        now = datetime.now()
-        expired_sessions = self.search([
-            ('human_takeover', '=', True),
-            ('takeover_until', '<=', now)
-        ])
-        if expired_sessions:
-            _logger.info(f"🤖 Reactivando chatbot para {len(expired_sessions)} conversaciones inactivas.")
-            expired_sessions.write({
-                'human_takeover': False,
-                'takeover_until': False,
-            })
\ No newline at end of file
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+from datetime import timedelta, datetime # Importar datetime
+import logging
+import threading
+
+from ..config.config import general_config
+
+_logger = logging.getLogger(__name__)
+
+LIFECYCLE_CONFIG = general_config.get('memory_lifecycle', {})
+
+FLOW_STATES = [
+    ('esperando_nombre_nuevo_cliente', 'Onboarding: nombre'),
+    ('esperando_email_nuevo_cliente', 'Onboarding: email'),
+    ('esperando_tipo_cliente', 'Onboarding: tipo de cliente'),
+    ('esperando_seleccion_producto', 'Selección de producto'),
+    ('esperando_cantidad_producto', 'Cantidad de producto'),
+    ('esperando_confirmacion_stock', 'Confirmación de stock'),
+    ('esperando_confirmacion_pedido', 'Confirmación de pedido'),
+    ('esperando_seleccion_direccion', 'Dirección de entrega'),
+    ('esperando_seleccion_eliminar', 'Modificación del carrito'),
+    ('esperando_seleccion_o_numero_factura', 'Selección de factura'),
+    ('esperando_numero_factura', 'Número de factura'),
+]
+
+
+class WhatsAppMemory(models.Model):
+    _name = 'chatbot.whatsapp.memory'
+    _description = 'Memoria del chatbot de WhatsApp'
+
+    phone = fields.Char(index=True)
+    partner_id = fields.Many2one('res.partner', string="Cliente")
+
+    # Estado y contexto
+    last_intent_detected = fields.Char(string="Última Intención Detectada")
+    flow_state = fields.Selection(FLOW_STATES, string="Estado del Flujo", index=True)
+    timestamp = fields.Datetime(string="Última Actividad", default=fields.Datetime.now, required=True)
+
+    # Contexto específico del pedido
+    last_variant_id = fields.Many2one('product.product', string="Última Variante Seleccionada")
+    last_qty_suggested = fields.Integer(string="Última Cantidad Sugerida")
+    pending_qty = fields.Integer(string="Cantidad Pedida en Selección")
+    
+    # Carrito de Compras, productos por resolver y opciones ofrecidas al cliente
+    cart_line_ids = fields.One2many('chatbot.whatsapp.cart.line', 'memory_id', string="Carrito")
+    pending_product_ids = fields.One2many('chatbot.whatsapp.pending.product', 'memory_id', string="Productos por Procesar")
+    candidate_ids = fields.One2many('chatbot.whatsapp.candidate', 'memory_id', string="Opciones Ofrecidas")
+
+    # Últimos turnos de la conversación ya limpios: [{'role': 'user'|'assistant', 'content': ...}]
+    recent_turns = fields.Json(string="Turnos Recientes")
+    # Turnos más viejos que la ventana, compactados en una línea por turno (ver prompt_builder)
+    conversation_summary = fields.Text(string="Resumen de la Conversación")
+    
+    # --- CAMPOS NUEVOS PARA HUMAN TAKEOVER ---
+    human_takeover = fields.Boolean(string="Toma de Control Humana", default=False)
+    takeover_until = fields.Datetime(string="Toma de Control Hasta")
+    # ----------------------------------------
+
+    _sql_constraints = [
+        ('partner_id_unique', 'unique(partner_id)', 'Solo puede existir un registro de memoria por cliente.')
+    ]
+
+    def init(self):
+        # Índices parciales para las dos expiraciones: sesiones inactivas y pausas humanas.
+        create_index(
+            self.env.cr, 'chatbot_whatsapp_memory_idle_idx', self._table,
+            ['timestamp'], where="human_takeover IS NOT TRUE",
+        )
+        create_index(
+            self.env.cr, 'chatbot_whatsapp_memory_takeover_idx', self._table,
+            ['takeover_until'], where="human_takeover AND takeover_until IS NOT NULL",
+        )
+
+    @api.model
+    def clean_old_memory(self, auto_commit=None):
+        """
+        Expira las sesiones inactivas (sin intervención humana) en lotes,
+        confirmando cada lote. Los carritos con productos se archivan en
+        chatbot.whatsapp.cart.archive antes de borrar la sesión. Lo llama un cron.
+        """
+        if auto_commit is None:
+            auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        idle_minutes = LIFECYCLE_CONFIG.get('idle_minutes', 30)
+        batch_size = LIFECYCLE_CONFIG.get('batch_size', 500)
+        expired_time = fields.Datetime.now() - timedelta(minutes=idle_minutes)
+        total = archived = 0
+        while True:
+            # SKIP LOCKED: no se toca una sesión que un consumidor está procesando en este
+            # momento (ConversationContext.load la bloquea durante todo el turno).
+            self.env.cr.execute("""
+                SELECT id FROM chatbot_whatsapp_memory
+                 WHERE timestamp < %s AND human_takeover IS NOT TRUE
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            """, (expired_time, batch_size))
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            batch = self.sudo().browse(ids)
+            archived += self.env['chatbot.whatsapp.cart.archive'].sudo().archive_carts(batch)
+            batch.unlink()
+            if auto_commit:
+                self.env.cr.commit()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+        if total:
+            _logger.info(f"🗑️ Limpiados {total} registros de memoria expirados ({archived} carritos archivados).")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._schedule_takeover_reactivation()
+        return records
+
+    def write(self, vals):
+        # Actualiza el timestamp en cada escritura para mantener la sesión activa
+        if 'timestamp' not in vals:
+            vals['timestamp'] = fields.Datetime.now()
+        res = super(WhatsAppMemory, self).write(vals)
+        if vals.get('takeover_until'):
+            self._schedule_takeover_reactivation()
+        return res
+
+    def _schedule_takeover_reactivation(self):
+        """Programa el cron de reactivación para cuando vence la pausa más próxima."""
+        due_dates = [until for until in self.mapped('takeover_until') if until]
+        if due_dates:
+            self.env.ref('chatbot_whatsapp.ir_cron_chatbot_reactivate_takeover').sudo()._trigger(at=min(due_dates))
+
+    @api.model
+    def get_active_conversations_report(self, product_id=None):
+        """
+        Resumen de las conversaciones activas: cantidad por estado del flujo,
+        carritos abiertos y unidades en ellos. Con `product_id`, solo cuenta los
+        carritos que contienen esa variante.
+        """
+        product_filter = "AND l.product_id = %s" if product_id else ""
+        params = [product_id] if product_id else []
+        self.env.cr.execute(f"""
+            SELECT COALESCE(m.flow_state, 'sin_flujo'),
+                   COUNT(DISTINCT m.id),
+                   COUNT(DISTINCT l.memory_id),
+                   COALESCE(SUM(l.quantity), 0)
+              FROM chatbot_whatsapp_memory m
+         LEFT JOIN chatbot_whatsapp_cart_line l ON l.memory_id = m.id {product_filter}
+             WHERE m.human_takeover IS NOT TRUE
+          GROUP BY 1
+        """, params)
+        by_state = {
+            state: {'conversations': conversations, 'open_carts': carts, 'units': units}
+            for state, conversations, carts, units in self.env.cr.fetchall()
+        }
+        return {
+            'by_state': by_state,
+            'open_carts': sum(row['open_carts'] for row in by_state.values()),
+            'units': sum(row['units'] for row in by_state.values()),
+        }
+
+    @api.model
+    def reactivate_expired_takeovers(self):
+        """
+        Método para ser llamado por un cron job. Reactiva el chatbot para conversaciones
+        donde el humano no ha hablado por más de X tiempo. El cron se dispara en el
+        vencimiento de cada pausa (ver _schedule_takeover_reactivation).
+        """
+        now = datetime.now()
+        expired_sessions = self.search([
+            ('human_takeover', '=', True),
+            ('takeover_until', '<=', now)
+        ])
+        if expired_sessions:
+            _logger.info(f"🤖 Reactivando chatbot para {len(expired_sessions)} conversaciones inactivas.")
+            expired_sessions.write({
+                'human_takeover': False,
+                'takeover_until': False,
+            })
+
+
+class WhatsAppCartLine(models.Model):
+    _name = 'chatbot.whatsapp.cart.line'
+    _description = 'Línea del carrito del chatbot de WhatsApp'
+    _order = 'memory_id, sequence, id'
+
+    memory_id = fields.Many2one('chatbot.whatsapp.memory', string="Conversación", required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(default=0)
+    product_id = fields.Many2one('product.product', string="Variante", required=True, ondelete='cascade', index=True)
+    quantity = fields.Integer(string="Cantidad", required=True, default=1)
+
+
+class WhatsAppPendingProduct(models.Model):
+    _name = 'chatbot.whatsapp.pending.product'
+    _description = 'Producto pedido pendiente de resolver en el chatbot de WhatsApp'
+    _order = 'memory_id, sequence, id'
+
+    memory_id = fields.Many2one('chatbot.whatsapp.memory', string="Conversación", required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(default=0)
+    query = fields.Char(string="Búsqueda", required=True)
+    quantity = fields.Integer(string="Cantidad")
+
+
+class WhatsAppCandidate(models.Model):
+    _name = 'chatbot.whatsapp.candidate'
+    _description = 'Opción ofrecida al cliente en el chatbot de WhatsApp'
+    _order = 'memory_id, sequence, id'
+
+    memory_id = fields.Many2one('chatbot.whatsapp.memory', string="Conversación", required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(default=0)
+    kind = fields.Selection([
+        ('product', 'Producto'),
+        ('address', 'Dirección de Entrega'),
+        ('invoice', 'Factura'),
+    ], string="Tipo", required=True)
+    product_id = fields.Many2one('product.product', string="Variante", ondelete='cascade')
+    partner_id = fields.Many2one('res.partner', string="Dirección", ondelete='cascade')
+    move_id = fields.Many2one('account.move', string="Factura", ondelete='cascade')
+    name = fields.Char(string="Descripción")
+    price = fields.Float(string="Precio", digits='Product Price')
+    stock = fields.Float(string="Stock")
+
+    _KIND_FIELDS = {'product': 'product_id', 'address': 'partner_id', 'invoice': 'move_id'}
+
+    @api.model
+    def _from_dict(self, kind, sequence, item):
+        vals = {'kind': kind, 'sequence': sequence, self._KIND_FIELDS[kind]: item['id']}
+        if kind == 'product':
+            vals.update({'name': item.get('name'), 'price': item.get('price'), 'stock': item.get('stock')})
+        return vals
+
+    def _to_dict(self):
+        self.ensure_one()
+        item = {'id': self[self._KIND_FIELDS[self.kind]].id}
+        if self.kind == 'product':
+            item.update({'name': self.name, 'price': self.price, 'stock': self.stock})
+        return item
+
+
+class WhatsAppCartArchive(models.Model):
+    _name = 'chatbot.whatsapp.cart.archive'
+    _description = 'Historial de carritos abandonados del chatbot de WhatsApp'
+    _order = 'archived_at desc, id desc'
+
+    partner_id = fields.Many2one('res.partner', string="Cliente", ondelete='cascade', index=True)
+    archived_at = fields.Datetime(string="Archivado", default=fields.Datetime.now, required=True)
+    last_activity = fields.Datetime(string="Última Actividad")
+    flow_state = fields.Char(string="Último Estado del Flujo")
+    line_count = fields.Integer(string="Productos")
+    total_qty = fields.Integer(string="Unidades")
+    # Formato compacto: [[product_id, cantidad], ...]
+    lines = fields.Json(string="Líneas")
+
+    @api.model
+    def archive_carts(self, memories):
+        """Guarda los carritos no vacíos de las sesiones indicadas. Devuelve cuántos archivó."""
+        vals_list = []
+        for memory in memories.filtered('cart_line_ids'):
+            lines = [[line.product_id.id, line.quantity] for line in memory.cart_line_ids]
+            vals_list.append({
+                'partner_id': memory.partner_id.id,
+                'last_activity': memory.timestamp,
+                'flow_state': memory.flow_state,
+                'line_count': len(lines),
+                'total_qty': sum(qty for _product_id, qty in lines),
+                'lines': lines,
+            })
+        if vals_list:
+            self.create(vals_list)
+        return len(vals_list)
\ No newline at end of file
@@ -1,749 +1,737 @@
-import json
-import logging
-import re
-import openai
-from odoo.exceptions import UserError
-from ..utils.nlp import detect_intention
-from ..utils.utils import clean_html
-from ..config.config import prompts_config, messages_config, general_config
-from .intent_handlers.create_order import (
-    create_sale_order, handle_modificar_pedido,
-    format_cart_for_display, add_item_to_cart, lookup_product_variants
-)
-from .intent_handlers.intent_handlers import (
-    handle_solicitar_factura, handle_respuesta_faq, handle_saludo,
-    handle_agradecimiento_cierre, handle_consulta_producto,
-    find_invoice_by_number
-)
-
-_logger = logging.getLogger(__name__)
-
-class ChatbotProcessor:
-    def __init__(self, env, record, partner, memory):
-        self.env = env
-        self.record = record
-        self.partner = partner
-        self.memory = memory
-        self.plain_text = clean_html(record.body or "").strip()
-
-    def _is_b2c(self):
-        """
-        --- CORREGIDO ---
-        Verifica si el partner es un cliente B2C (Consumidor Final)
-        buscando la etiqueta correcta y su padre.
-        """
-        parent_category_name = "Tipo de Cliente"
-        b2c_tag_name = "Consumidor Final"
-        
-        for tag in self.partner.category_id:
-            if (tag.name == b2c_tag_name and 
-                tag.parent_id and 
-                tag.parent_id.name == parent_category_name):
-                return True
-        return False
-
-    def process_message(self):
-        """
-        Procesa el mensaje entrante, priorizando el flujo B2C si el cliente
-        está etiquetado como tal.
-        """
-        flow = self.memory.flow_state
-        _logger.info(f"➡️  Procesando flujo: {flow or 'N/A'} para {self.partner.name}")
-
-        if self._is_b2c() and not flow:
-            _logger.info("Cliente detectado como B2C. Iniciando manejador B2C.")
-            return self._handle_b2c_intent()
-
-        if flow:
-            flow_handler = getattr(self, f"_handle_flow_{flow}", None)
-            if flow_handler:
-                return flow_handler()
-
-        return self._handle_general_intent()
-
-    def _handle_b2c_intent(self):
-        """Maneja las intenciones específicas para clientes B2C con respuestas de IA."""
-        api_key = self.env['ir.config_parameter'].sudo().get_param('openai.api_key')
-        openai.api_key = api_key
-        system_prompt = prompts_config['general_intent_system']
-        history = self.env['whatsapp.message'].sudo().search([
-            ('mobile_number', '=', self.record.mobile_number), ('id', '<=', self.record.id),
-            ('state', 'in', ['received', 'inbound', 'outgoing', 'sent'])
-        ], order='id desc', limit=3)
-        conv = [{"role": "user" if msg.state in ("received", "inbound") else "assistant", "content": clean_html(msg.body or "").strip()} for msg in reversed(history)]
-        intent = detect_intention(conv, api_key, system_prompt)
-        self.memory.write({'last_intent_detected': intent})
-
-        _logger.info(f"👤 Intent B2C detectado: {intent} para {self.partner.name}")
-
-        # --- LÓGICA CORREGIDA PARA URLs ---
-        website_urls = {
-            "Consumidor Final": "https://www.quimicacristal.com.ar",
-            "EMPRESA": "https://www.cristalempresas.com.ar",
-            "Mayorista": "https://www.cristalmayorista.com.ar"
-        }
-        
-        customer_type_tag = None
-        parent_category_name = "Tipo de Cliente"
-        if self.partner.category_id:
-            # Filtra para encontrar la etiqueta que es hija de "Tipo de Cliente"
-            customer_type_tag = self.partner.category_id.filtered(
-                lambda t: t.parent_id and t.parent_id.name == parent_category_name
-            )
-        
-        partner_category_name = customer_type_tag[0].name if customer_type_tag else None
-        web_url = website_urls.get(partner_category_name, "https://www.quimicacristal.com.ar")
-
-        if intent == "consulta_producto":
-            try:
-                extraction_prompt = prompts_config['product_extraction_system_prompt']
-                resp_ext = openai.ChatCompletion.create(model="gpt-4o-mini", messages=[{"role": "system", "content": extraction_prompt}, {"role": "user", "content": self.plain_text}], temperature=0)
-                query = resp_ext.choices[0].message.content.strip()
-
-                try:
-                    variants = lookup_product_variants(self.env, self.partner, query)
-                except UserError as e:
-                    return self._send_text(str(e) + f"\n\nDe todas formas, podés ver todo nuestro catálogo en {web_url} 😉")
-
-                product_list_str = "\n".join([f"- {v['name']} - ${v['price']:.2f}" for v in variants])
-                
-                system_prompt_b2c = prompts_config['b2c_product_query_prompt']
-                user_prompt_b2c = f"Productos encontrados:\n{product_list_str}\n\nURL de la tienda: {web_url}"
-
-                resp_final = openai.ChatCompletion.create(
-                    model=general_config['openai']['model'],
-                    messages=[
-                        {"role": "system", "content": system_prompt_b2c},
-                        {"role": "user", "content": user_prompt_b2c}
-                    ],
-                    temperature=0.7
-                )
-                return self._send_text(resp_final.choices[0].message.content.strip())
-            except Exception as e:
-                _logger.error(f"❌ Error en consulta B2C con IA: {e}")
-                return self._send_text(messages_config['error_processing'])
-
-        if intent == "crear_pedido":
-            try:
-                system_prompt_b2c = prompts_config['b2c_create_order_prompt']
-                user_prompt_b2c = f"Mensaje del cliente: \"{self.plain_text}\"\nURL de la tienda: {web_url}"
-
-                resp = openai.ChatCompletion.create(
-                    model=general_config['openai']['model'],
-                    messages=[
-                        {"role": "system", "content": system_prompt_b2c},
-                        {"role": "user", "content": user_prompt_b2c}
-                    ],
-                    temperature=0.7
-                )
-                return self._send_text(resp.choices[0].message.content.strip())
-            except Exception as e:
-                _logger.error(f"❌ Error en crear_pedido B2C con IA: {e}")
-                return self._send_text(messages_config['error_processing'])
-
-        if intent == "solicitar_factura":
-            return self._send_text(messages_config['b2c_invoice_response'])
-
-        if intent == "saludo":
-            return self._send_text(handle_saludo(self.env, self.partner))
-
-        if intent == "agradecimiento_cierre":
-            return self._send_text(handle_agradecimiento_cierre(self.env, self.partner, self.plain_text))
-
-        if intent in ["consulta_horario_direccion", "consulta_informativa", "otro", ""]:
-            _logger.info(f"B2C Fallback/Info: Intención '{intent}' detectada. Enviando a handle_respuesta_faq.")
-            faq_response = handle_respuesta_faq(self.env, self.partner, self.plain_text, conv)
-            return self._send_text(faq_response)
-
-        return self._send_text(messages_config['error_default'])
-    
-    def _send_template(self, template_name_to_send, partner, invoice):
-        """
-        Envía una plantilla de WhatsApp para una factura con el número dinámico.
-        """
-        wa_account = self.record.wa_account_id
-        if not wa_account:
-            _logger.error("No se encontró una cuenta de WhatsApp activa.")
-            return
-
-        try:
-            wa_template = self.env['whatsapp.template'].sudo().search([
-                ('template_name', '=', template_name_to_send),
-                ('wa_account_id', '=', wa_account.id)
-            ], limit=1)
-
-            if not wa_template:
-                _logger.error(f"No se encontró la plantilla: {template_name_to_send}")
-                return
-
-            # --- CORRECCIÓN CLAVE ---
-            # Pasamos el diccionario de Python directamente, sin json.dumps()
-            free_text_data = {
-                'free_text_1': invoice.name
-            }
-
-            mail_message = self.env['mail.message'].sudo().create({
-                'model': 'account.move',
-                'res_id': invoice.id,
-                'body': wa_template.body,
-            })
-
-            vals = {
-                'mobile_number': partner.phone or partner.mobile,
-                'wa_account_id': wa_account.id,
-                'wa_template_id': wa_template.id,
-                'mail_message_id': mail_message.id,
-                'state': 'outgoing',
-                # Eliminamos json.dumps() y pasamos el diccionario directamente
-                'free_text_json': free_text_data,
-            }
-
-            outgoing_msg = self.env['whatsapp.message'].sudo().create(vals)
-            outgoing_msg._send_message()
-            _logger.info(f"✅ Plantilla {outgoing_msg.id} enviada para la factura {invoice.name}.")
-
-        except Exception as e:
-            _logger.error(f"❌ Error al enviar plantilla: {e}", exc_info=True)
-
-    def _send_response(self, response_data):
-        message = response_data.get('message')
-        if not message:
-            return
-        try:
-            mail_message = self.record.mail_message_id
-            if mail_message and mail_message.model == 'discuss.channel' and mail_message.res_id:
-                channel = self.env['discuss.channel'].sudo().browse(mail_message.res_id)
-                channel.with_context(from_wa_bot=True).message_post(
-                    body=message,
-                    message_type='comment',
-                    subtype_xmlid='mail.mt_comment'
-                )
-        except Exception as e:
-            _logger.error(f"⚠️ No se pudo registrar el mensaje de texto en el canal de Odoo: {e}", exc_info=True)
-        try:
-            vals = {
-                'mobile_number': self.record.mobile_number,
-                'body': message,
-                'state': 'outgoing',
-                'wa_account_id': self.record.wa_account_id.id,
-                'create_uid': self.env.ref('base.user_admin').id,
-            }
-            outgoing_msg = self.env['whatsapp.message'].sudo().create(vals)
-            outgoing_msg.sudo().write({'body': message})
-            if hasattr(outgoing_msg, '_send_message'):
-                outgoing_msg._send_message()
-        except Exception as e:
-            _logger.error(f"❌ Error al enviar el mensaje de texto por WhatsApp: {e}", exc_info=True)
-
-    def _send_text(self, text_to_send):
-        return self._send_response({'message': text_to_send})
-    
-    def _add_item_and_decide_next_step(self, pid, qty, name):
-        add_item_to_cart(self.memory, pid, qty)
-        buffer_data = json.loads(self.memory.data_buffer or '{}')
-        pending_products = buffer_data.get('pending_products', [])
-        if not pending_products:
-            _logger.info("🏁 Cola de productos vacía. Finalizando ciclo de agregación.")
-            cart_lines = json.loads(self.memory.pending_order_lines or '[]')
-            summary = format_cart_for_display(self.env, cart_lines)
-            response = messages_config['confirm_item_added'].format(qty=qty, name=name, summary=summary)
-            self.memory.write({'flow_state': 'esperando_confirmacion_pedido', 'data_buffer': ''})
-            return self._send_text(response)
-        else:
-            self._send_text(messages_config['item_added_processing_next'].format(qty=qty, name=name))
-            return self._process_next_product_in_queue()
-
-    def _process_next_product_in_queue(self):
-        buffer_data = json.loads(self.memory.data_buffer or '{}')
-        pending_products = buffer_data.get('pending_products', [])
-        if not pending_products:
-            _logger.info("🏁 Cola de productos ya estaba vacía. Pasando a confirmación final.")
-            self.memory.write({'flow_state': 'esperando_confirmacion_pedido', 'data_buffer': ''})
-            return self._send_text("¿Querés agregar algo más?")
-        current_product = pending_products.pop(0)
-        self.memory.write({'data_buffer': json.dumps({'pending_products': pending_products})})
-        query = current_product.get('query')
-        qty = current_product.get('quantity')
-        _logger.info(f"⚙️ Procesando siguiente en la cola: {query} (Cantidad: {qty})")
-        try:
-            variants = lookup_product_variants(self.env, self.partner, query)
-        except UserError as ue:
-            _logger.warning(f"⚠️ Error buscando variantes para '{query}': {str(ue)}")
-            self._send_text(messages_config['processing_next_item'].format(query=query))
-            return self._process_next_product_in_queue()
-        if len(variants) > 1:
-            buttons = "\n".join([f"{i+1}) {v['name']} - ${v['price']:.2f}" for i, v in enumerate(variants)])
-            self.memory.write({
-                'flow_state': 'esperando_seleccion_producto',
-                'data_buffer': json.dumps({'products': variants, 'qty': qty, 'original_queue': pending_products}),
-            })
-            return self._send_text(messages_config['ask_for_clarification'].format(query=query, buttons=buttons))
-        variant = variants[0]
-        pid, name, avail = variant['id'], variant['name'], int(variant['stock'])
-        if not qty:
-            self.memory.write({
-                'flow_state': 'esperando_cantidad_producto',
-                'last_variant_id': pid,
-                'data_buffer': json.dumps({'original_queue': pending_products}),
-            })
-            return self._send_text(messages_config['ask_for_quantity'].format(name=name))
-        if qty <= avail:
-            return self._add_item_and_decide_next_step(pid, qty, name)
-        else:
-            self.memory.write({
-                'flow_state': 'esperando_confirmacion_stock',
-                'last_variant_id': pid,
-                'last_qty_suggested': avail,
-                'data_buffer': json.dumps({'original_queue': pending_products}),
-            })
-            return self._send_text(messages_config['insufficient_stock'].format(avail=avail, name=name))
-
-    def _handle_flow_esperando_confirmacion_pedido(self):
-        system_prompt = prompts_config['order_confirmation_system']
-        api_key = self.env['ir.config_parameter'].sudo().get_param('openai.api_key')
-        specialized_intent = detect_intention([{"role": "user", "content": self.plain_text}], api_key, system_prompt)
-        
-        if specialized_intent == "finalizar_pedido":
-            _logger.info("✅ Intención detectada: finalizar_pedido")
-            order_lines_data = json.loads(self.memory.pending_order_lines or '[]')
-            if not order_lines_data:
-                self.memory.write({'flow_state': False, 'pending_order_lines': '[]'})
-                return self._send_text(messages_config['cart_is_empty'])
-
-            delivery_addresses = self.partner.child_ids.filtered(lambda c: c.type == 'delivery')
-            
-            if len(delivery_addresses) > 1:
-                _logger.info(f"🚚 Múltiples direcciones de entrega ({len(delivery_addresses)}) encontradas para {self.partner.name}.")
-                
-                address_lines = []
-                for i, addr in enumerate(delivery_addresses):
-                    parts = [
-                        addr.name,
-                        addr.street,
-                        addr.city,
-                        addr.state_id.name,
-                        addr.zip,
-                        addr.country_id.name
-                    ]
-                    formatted_address = ", ".join(filter(None, parts))
-                    address_lines.append(f"{i+1}) {formatted_address}")
-                
-                address_list_str = "\n".join(address_lines)
-                
-                self.memory.write({
-                    'flow_state': 'esperando_seleccion_direccion',
-                    'data_buffer': json.dumps({'addresses': delivery_addresses.ids})
-                })
-                
-                final_message = messages_config['ask_for_delivery_address'].format(addresses=address_list_str)
-                return self._send_text(final_message)
-            else:
-                shipping_id = delivery_addresses.id if delivery_addresses else self.partner.id
-                order = create_sale_order(self.env, self.partner.id, order_lines_data, partner_shipping_id=shipping_id)
-                summary = format_cart_for_display(self.env, order.order_line.mapped(lambda l: {'product_id': l.product_id.id, 'quantity': int(l.product_uom_qty)}))
-                response = messages_config['order_finalized'].format(order_name=order.name, summary=summary)
-                
-                self.memory.write({'flow_state': False, 'data_buffer': '', 'pending_order_lines': '[]'})
-                return self._send_text(response)
-        
-        elif specialized_intent == 'modificar_pedido':
-            _logger.info("✅ Intención detectada: modificar_pedido")
-            response = handle_modificar_pedido(self.env, self.memory)
-            return self._send_text(response)
-        
-        else:
-            _logger.info("✅ Intención detectada: continuar_pedido.")
-            self.memory.write({'flow_state': False})
-            return self._handle_general_intent()
-
-    def _handle_flow_esperando_seleccion_direccion(self):
-        """Maneja la selección de la dirección de entrega por parte del usuario."""
-        try:
-            data = json.loads(self.memory.data_buffer or '{}')
-            address_ids = data.get('addresses', [])
-            
-            if not (self.plain_text.isdigit() and 1 <= int(self.plain_text) <= len(address_ids)):
-                return self._send_text(messages_config['invalid_address_option'])
-
-            selected_address_id = address_ids[int(self.plain_text) - 1]
-            _logger.info(f"🚚 Dirección de entrega seleccionada: ID {selected_address_id}")
-
-            order_lines_data = json.loads(self.memory.pending_order_lines or '[]')
-            
-            order = create_sale_order(self.env, self.partner.id, order_lines_data, partner_shipping_id=selected_address_id)
-            
-            summary = format_cart_for_display(self.env, order.order_line.mapped(lambda l: {'product_id': l.product_id.id, 'quantity': int(l.product_uom_qty)}))
-            response = messages_config['order_finalized'].format(order_name=order.name, summary=summary)
-            
-            self.memory.write({'flow_state': False, 'data_buffer': '', 'pending_order_lines': '[]'})
-            
-            return self._send_text(response)
-            
-        except (ValueError, json.JSONDecodeError, IndexError) as e:
-            _logger.error(f"Error en el flujo de selección de dirección: {e}")
-            self.memory.write({'flow_state': False, 'data_buffer': ''})
-            return self._send_text(messages_config['error_processing'])
-
-    def _handle_flow_esperando_seleccion_producto(self):
-        """
-        Maneja la respuesta del usuario tras mostrar una lista. Puede entender selección
-        por nombre, número o contexto, y también preguntas de seguimiento o cancelaciones.
-        """
-        data = json.loads(self.memory.data_buffer or '{}')
-        variants = data.get('products', [])
-        selected_index = -1
-
-        # --- CORRECCIÓN: Manejo directo de selección numérica ---
-        if self.plain_text.isdigit():
-            try:
-                choice = int(self.plain_text)
-                if 1 <= choice <= len(variants):
-                    selected_index = choice - 1
-                    _logger.info(f"✅ Selección numérica directa detectada: índice {selected_index}")
-            except (ValueError, IndexError):
-                pass
-
-        if selected_index == -1:
-            _logger.info("La selección no fue numérica, usando IA para interpretar.")
-            api_key = self.env['ir.config_parameter'].sudo().get_param('openai.api_key')
-            system_prompt = prompts_config['product_selection_intent_system']
-            sub_intent = detect_intention([{"role": "user", "content": self.plain_text}], api_key, system_prompt)
-            
-            _logger.info(f"🔎 Sub-intención detectada en selección: '{sub_intent}'")
-
-            if sub_intent == 'seleccionar_producto':
-                disambiguation_prompt = prompts_config['product_disambiguation_prompt']
-                product_names = [v['name'] for v in variants]
-                
-                try:
-                    resp = openai.ChatCompletion.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": disambiguation_prompt},
-                            {"role": "user", "content": f"Lista: {product_names}\nRespuesta de usuario: \"{self.plain_text}\""}
-                        ],
-                        temperature=0,
-                    )
-                    selected_index = int(resp.choices[0].message.content.strip())
-                except (ValueError, openai.error.OpenAIError) as e:
-                    _logger.error(f"Error procesando desambiguación con IA: {e}")
-                    return self._send_text(messages_config['error_processing'])
-            
-            elif sub_intent == 'nueva_consulta':
-                _logger.info("El usuario hizo una nueva consulta sobre los productos mostrados.")
-                products_in_context = data.get('products', [])
-                context_for_ai = "Productos en contexto:\n" + "\n".join([f"- {p['name']} (${p['price']:.2f})" for p in products_in_context])
-                comparison_prompt = prompts_config['product_comparison_prompt']
-                try:
-                    resp = openai.ChatCompletion.create(
-                        model=general_config['openai']['model'],
-                        messages=[
-                            {"role": "system", "content": comparison_prompt},
-                            {"role": "user", "content": f"{context_for_ai}\n\nPregunta del cliente: '{self.plain_text}'"}
-                        ],
-                        temperature=0.7
-                    )
-                    return self._send_text(resp.choices[0].message.content)
-                except Exception as e:
-                    _logger.error(f"Error en la sub-consulta de producto: {e}")
-                    return self._send_text(messages_config['error_processing'])
-            
-            elif sub_intent == 'cancelar_seleccion':
-                _logger.info("El usuario canceló la selección de producto.")
-                self.memory.write({'flow_state': False, 'data_buffer': ''})
-                return self._send_text(messages_config['selection_cancelled'])
-            
-            else:
-                 return self._send_text(messages_config['invalid_option'])
-
-        if 0 <= selected_index < len(variants):
-            selected_variant = variants[selected_index]
-            qty = data.get('qty')
-            
-            self.memory.write({'data_buffer': json.dumps({'pending_products': data.get('original_queue', [])})})
-            pid, name, avail = selected_variant['id'], selected_variant['name'], int(selected_variant['stock'])
-
-            if not qty:
-                self.memory.write({
-                    'flow_state': 'esperando_cantidad_producto', 'last_variant_id': pid, 
-                    'data_buffer': self.memory.data_buffer
-                })
-                return self._send_text(messages_config['ask_for_quantity'].format(name=name))
-            
-            if qty <= avail:
-                return self._add_item_and_decide_next_step(pid, qty, name)
-            else:
-                self.memory.write({
-                    'flow_state': 'esperando_confirmacion_stock', 'last_variant_id': pid, 
-                    'last_qty_suggested': avail, 'data_buffer': self.memory.data_buffer
-                })
-                return self._send_text(messages_config['insufficient_stock'].format(avail=avail, name=name))
-        else:
-            return self._send_text(messages_config['invalid_option'])
-
-
-    def _handle_flow_esperando_cantidad_producto(self):
-        """
-        Maneja la entrada de cantidad del usuario, usando IA para interpretar
-        lenguaje natural (ej: "uno", "un par").
-        """
-        qty = 0
-        # Primero, intenta una conversión directa si el usuario escribe un número
-        if self.plain_text.isdigit():
-            qty = int(self.plain_text)
-        else:
-            # Si no es un dígito, usa IA para interpretar el texto
-            _logger.info(f"🔢 La cantidad '{self.plain_text}' no es un dígito. Usando IA para interpretar.")
-            try:
-                api_key = self.env['ir.config_parameter'].sudo().get_param('openai.api_key')
-                openai.api_key = api_key
-                extraction_prompt = prompts_config['quantity_extraction_prompt']
-                
-                resp = openai.ChatCompletion.create(
-                    model="gpt-4o-mini", # Usamos un modelo rápido para esta tarea simple
-                    messages=[
-                        {"role": "system", "content": extraction_prompt},
-                        {"role": "user", "content": self.plain_text}
-                    ],
-                    temperature=0
-                )
-                qty_str = resp.choices[0].message.content.strip()
-                qty = int(qty_str)
-            except (ValueError, openai.error.OpenAIError) as e:
-                _logger.error(f"❌ Error convirtiendo cantidad con IA: {e}")
-                return self._send_text(messages_config['invalid_quantity_format'])
-
-        if qty <= 0:
-            return self._send_text(messages_config['invalid_quantity'])
-
-        variant = self.env['product.product'].sudo().browse(self.memory.last_variant_id.id)
-        avail = variant.qty_available or 0
-
-        if qty > avail:
-            self.memory.write({'flow_state': 'esperando_confirmacion_stock', 'last_qty_suggested': int(avail)})
-            return self._send_text(messages_config['insufficient_stock'].format(avail=int(avail), name=variant.display_name))
-        else:
-            return self._add_item_and_decide_next_step(variant.id, qty, variant.display_name)
-
-    def _handle_flow_esperando_confirmacion_stock(self):
-        choice = self.plain_text.lower().strip()
-        if choice in ('1', 'sí', 'si', 'si, esa cantidad'):
-            var = self.env['product.product'].sudo().browse(self.memory.last_variant_id.id)
-            qty = self.memory.last_qty_suggested
-            return self._add_item_and_decide_next_step(var.id, qty, var.display_name)
-        
-        elif choice in ('2', 'no', 'cancelar'):
-            self.memory.write({'flow_state': False})
-            self._send_text(messages_config['confirm_stock_cancellation'])
-            return self._process_next_product_in_queue()
-        
-        else:
-            return self._send_text(messages_config['invalid_stock_confirmation'])
-    
-    def _handle_crear_pedido_intent(self):
-        """Inicia el proceso de creación de pedido, obteniendo y encolando productos."""
-        openai.api_key = self.env['ir.config_parameter'].sudo().get_param('openai.api_key')
-        system_prompt = prompts_config['create_order_system']
-        
-        try:
-            resp = openai.ChatCompletion.create(
-                model=general_config['openai']['model'],
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": self.plain_text}],
-                functions=prompts_config['create_order_function'],
-                function_call={"name": "lookup_product_variants"},
-                temperature=0,
-            )
-            msg = resp.choices[0].message
-        except Exception as e:
-            _logger.error(f"❌ Error en la llamada a OpenAI para extraer productos: {e}")
-            return self._send_text(messages_config['error_processing'])
-
-        if not msg.get('function_call'):
-            return self._send_text(messages_config['error_default'])
-
-        args = json.loads(msg.function_call.arguments)
-        products_to_add = args.get('products', [])
-
-        if not products_to_add:
-            _logger.info("🛒 Intención 'crear_pedido' sin productos. Usando IA para preguntar qué desea.")
-            try:
-                ask_prompt = prompts_config['ask_for_products_prompt']
-                
-                # Se obtiene el historial de la conversación para dar contexto
-                history = self.env['whatsapp.message'].sudo().search([
-                    ('mobile_number', '=', self.record.mobile_number), ('id', '<=', self.record.id)
-                ], order='id desc', limit=3)
-                
-                # Se arma el payload para OpenAI, incluyendo el historial
-                messages = [{"role": "system", "content": ask_prompt}]
-                for h_msg in reversed(history):
-                    role = "user" if h_msg.state in ("received", "inbound") else "assistant"
-                    messages.append({"role": role, "content": clean_html(h_msg.body or "")})
-
-                resp_ask = openai.ChatCompletion.create(
-                    model=general_config['openai']['model'],
-                    messages=messages, # Se envía el historial completo
-                    temperature=0.7
-                )
-                ai_response = resp_ask.choices[0].message.content.strip()
-                return self._send_text(ai_response)
-                
-            except Exception as e:
-                _logger.error(f"❌ Error generando la pregunta por productos con IA: {e}")
-                return self._send_text(messages_config['product_not_found_gpt'])
-
-        _logger.info(f"🛒 Productos detectados por IA para encolar: {products_to_add}")
-        self.memory.write({
-            'flow_state': False,
-            'data_buffer': json.dumps({'pending_products': products_to_add})
-        })
-        
-        return self._process_next_product_in_queue()
-    
-    def _handle_flow_esperando_seleccion_o_numero_factura(self):
-        """
-        Maneja la respuesta del usuario, que puede ser la selección de una factura
-        de la lista (ej: '1') o un número de factura completo para buscar.
-        """
-        if self.plain_text.lower() == 'cancelar':
-            self.memory.write({'flow_state': False, 'data_buffer': ''})
-            return self._send_text(messages_config['invoice_selection_cancelled'])
-
-        template_name = "envio_factura_bot"
-        
-        # Intenta interpretar la entrada como una selección de la lista (ej: "1", "2", etc.)
-        if self.plain_text.isdigit():
-            try:
-                data = json.loads(self.memory.data_buffer or '{}')
-                invoice_ids = data.get('invoice_ids', [])
-                choice = int(self.plain_text)
-                
-                if 1 <= choice <= len(invoice_ids):
-                    selected_invoice_id = invoice_ids[choice - 1]
-                    invoice = self.env['account.move'].sudo().browse(selected_invoice_id)
-                    _logger.info(f"🧾 Usuario seleccionó factura de la lista: {invoice.name}")
-                    self.memory.write({'flow_state': False, 'data_buffer': ''})
-                    return self._send_template(template_name, self.partner, invoice)
-            except (ValueError, json.JSONDecodeError, IndexError):
-                # Si falla, no es una selección válida. Lo tratará como un número de factura.
-                _logger.warning(f"⚠️ No se pudo procesar '{self.plain_text}' como selección. Intentando como búsqueda.")
-                pass
-
-        # Si no fue una selección de la lista, lo trata como un número de factura para buscar
-        _logger.info(f"🧾 Buscando factura por número ingresado: '{self.plain_text}'")
-        invoice = find_invoice_by_number(self.env, self.partner, self.plain_text)
-        
-        if invoice:
-            _logger.info(f"🧾 Factura encontrada por número: {invoice.name}")
-            self.memory.write({'flow_state': False, 'data_buffer': ''})
-            return self._send_template(template_name, self.partner, invoice)
-        else:
-            # Si no se encuentra, se le vuelve a ofrecer la lista.
-            _logger.warning(f"🧾 No se encontró factura con '{self.plain_text}'. Re-ofreciendo lista.")
-            data = json.loads(self.memory.data_buffer or '{}')
-            invoices_in_memory = self.env['account.move'].sudo().browse(data.get('invoice_ids', []))
-            
-            invoice_lines = [f"{i+1}) *{inv.name}* del {inv.invoice_date.strftime('%d/%m/%Y')} - ${inv.amount_total:,.2f}" for i, inv in enumerate(invoices_in_memory)]
-            invoice_list_str = "\n".join(invoice_lines)
-
-            message = messages_config['invoice_search_failed_reoffer'].format(
-                number=self.plain_text,
-                invoices=invoice_list_str
-            )
-            return self._send_text(message)
-        
-    def _handle_flow_esperando_numero_factura(self):
-        """
-        Maneja el caso donde no había facturas recientes y el usuario
-        ingresa un número de factura para una búsqueda directa.
-        """
-        if self.plain_text.lower() == 'cancelar':
-            self.memory.write({'flow_state': False, 'data_buffer': ''})
-            return self._send_text(messages_config['invoice_selection_cancelled'])
-
-        template_name = "envio_factura_bot"
-        invoice = find_invoice_by_number(self.env, self.partner, self.plain_text)
-
-        if invoice:
-            _logger.info(f"🧾 Factura encontrada por número: {invoice.name}")
-            self.memory.write({'flow_state': False, 'data_buffer': ''})
-            return self._send_template(template_name, self.partner, invoice)
-        else:
-            # Si no se encuentra, se informa al usuario y se resetea el flujo.
-            _logger.warning(f"🧾 No se encontró factura con el número '{self.plain_text}'.")
-            self.memory.write({'flow_state': False, 'data_buffer': ''})
-            message = messages_config['invoice_not_found_and_reset'].format(number=self.plain_text)
-            return self._send_text(message)
-            
-    def _handle_general_intent(self):
-        api_key = self.env['ir.config_parameter'].sudo().get_param('openai.api_key')
-        system_prompt = prompts_config['general_intent_system']
-        history = self.env['whatsapp.message'].sudo().search([('mobile_number', '=', self.record.mobile_number), ('id', '<=', self.record.id), ('state', 'in', ['received', 'inbound', 'outgoing', 'sent'])], order='id desc', limit=3)
-        conv = [{"role": "user" if msg.state in ("received", "inbound") else "assistant", "content": clean_html(msg.body or "").strip()} for msg in reversed(history)]
-        intent = detect_intention(conv, api_key, system_prompt)
-        self.memory.write({'last_intent_detected': intent})
-        _logger.info(f"👤 Intent General detectado: {intent} para {self.partner.name}")
-
-        if intent == "solicitar_factura":
-            number_match = re.search(r'[\d\-\s]+', self.plain_text)
-            if number_match:
-                invoice = find_invoice_by_number(self.env, self.partner, number_match.group())
-                if invoice:
-                    self.memory.write({'flow_state': False, 'data_buffer': ''})
-                    return self._send_template("envio_factura_bot", self.partner, invoice)
-            
-            response_data = handle_solicitar_factura(self.env, self.partner, self.plain_text)
-            
-            if response_data.get('flow_state'):
-                self.memory.write({
-                    'flow_state': response_data.get('flow_state'),
-                    # --- LÍNEA CORREGIDA ---
-                    # Eliminamos el json.dumps() de aquí
-                    'data_buffer': response_data.get('data_buffer', '{}')
-                })
-            return self._send_response(response_data)
-
-        if intent in ["saludo", "agradecimiento_cierre"]:
-            handler = {"saludo": handle_saludo, "agradecimiento_cierre": handle_agradecimiento_cierre}[intent]
-            response_text = handler(self.env, self.partner, self.plain_text) if intent == "agradecimiento_cierre" else handler(self.env, self.partner)
-            return self._send_text(response_text)
-
-        if intent in ["crear_pedido", "modificar_pedido"]:
-            if intent == "crear_pedido": return self._handle_crear_pedido_intent()
-            if intent == "modificar_pedido": return self._send_text(handle_modificar_pedido(self.env, self.memory))
-
-        if intent == "consulta_producto":
-            response_data = handle_consulta_producto(self.env, self.partner, self.plain_text)
-            if response_data.get('flow_state'):
-                self.memory.write({'flow_state': response_data['flow_state'], 'data_buffer': response_data.get('data_buffer', '')})
-            return self._send_response(response_data)
-        
-        # --- MANEJADOR UNIFICADO CON IA ---
-        if intent in ["consulta_horario_direccion", "consulta_informativa", "otro", ""]:
-            _logger.info(f"General Fallback/Info: Intención '{intent}' detectada. Enviando a handle_respuesta_faq.")
-            faq_response = handle_respuesta_faq(self.env, self.partner, self.plain_text, conv)
-            return self._send_text(faq_response)
-
-        return self._send_text(messages_config['error_default'])
-    
-    def _handle_flow_esperando_seleccion_eliminar(self):
-        cart_lines = json.loads(self.memory.pending_order_lines or '[]')
-        if self.plain_text.lower() == 'cancelar':
-            self.memory.write({'flow_state': 'esperando_confirmacion_pedido'})
-            return self._send_text(messages_config['cancel_modification'])
-        
-        try:
-            index_to_remove = int(self.plain_text)
-            if not (1 <= index_to_remove <= len(cart_lines)):
-                return self._send_text(messages_config['invalid_number_for_deletion'])
-            
-            cart_lines.pop(index_to_remove - 1)
-            self.memory.write({'pending_order_lines': json.dumps(cart_lines)})
-            
-            new_summary = format_cart_for_display(self.env, cart_lines)
-            response = messages_config['item_removed_confirm'].format(summary=new_summary)
-            self.memory.write({'flow_state': 'esperando_confirmacion_pedido'})
-            return self._send_text(response)
-        except ValueError:
-
-            return self._send_text(messages_config['invalid_input_for_deletion'])
+import json
+import logging
+import re
+import openai
+from odoo.exceptions import UserError
+from ..utils.nlp import detect_intention
+from ..utils.openai_client import chat_completion
+from ..utils import metrics
+from ..utils.utils import clean_html
+from ..config.config import general_config, prompts_config, messages_config
+from .intent_handlers.create_order import (
+    create_sale_order, handle_modificar_pedido,
+    format_cart_for_display, lookup_product_variants, resolve_product_queries
+)
+from .intent_handlers.intent_handlers import (
+    handle_solicitar_factura, handle_respuesta_faq, handle_saludo,
+    handle_agradecimiento_cierre, handle_consulta_producto,
+    find_invoice_by_number
+)
+
+_logger = logging.getLogger(__name__)
+
+class ChatbotProcessor:
+    def __init__(self, env, record, ctx, plain_text=None):
+        self.env = env
+        self.record = record
+        self.ctx = ctx
+        self.partner = ctx.partner
+        self.plain_text = plain_text or clean_html(record.body or "").strip()
+
+    def _is_b2c(self):
+        """Verifica si el partner es un cliente B2C (Consumidor Final)."""
+        return self.ctx.is_b2c
+
+    def process_message(self):
+        """
+        Procesa el mensaje entrante, priorizando el flujo B2C si el cliente
+        está etiquetado como tal.
+        """
+        flow = self.ctx.flow_state
+        _logger.info(f"➡️  Procesando flujo: {flow or 'N/A'} para {self.partner.name}")
+
+        if self._is_b2c() and not flow:
+            _logger.info("Cliente detectado como B2C. Iniciando manejador B2C.")
+            return self._handle_b2c_intent()
+
+        if flow:
+            flow_handler = getattr(self, f"_handle_flow_{flow}", None)
+            if flow_handler:
+                return flow_handler()
+
+        return self._handle_general_intent()
+
+    def _handle_b2c_intent(self):
+        """Maneja las intenciones específicas para clientes B2C con respuestas de IA."""
+        system_prompt = prompts_config['general_intent_system']
+        conv = self.ctx.history('general_intent')
+        intent = detect_intention(self.env, conv, system_prompt, classifier='general')
+        self.ctx.update(last_intent_detected=intent)
+        metrics.set_labels(intent=intent)
+
+        _logger.info(f"👤 Intent B2C detectado: {intent} para {self.partner.name}")
+
+        web_url = self.ctx.website_url
+
+        if intent == "consulta_producto":
+            try:
+                extraction_prompt = prompts_config['product_extraction_system_prompt']
+                resp_ext = chat_completion(self.env, [{"role": "system", "content": extraction_prompt}, {"role": "user", "content": self.plain_text}], task='b2c_product_extraction', temperature=0)
+                query = resp_ext.choices[0].message.content.strip()
+
+                try:
+                    variants = lookup_product_variants(self.env, self.partner, query)
+                except UserError as e:
+                    return self._send_text(str(e) + f"\n\nDe todas formas, podés ver todo nuestro catálogo en {web_url} 😉")
+
+                product_list_str = "\n".join([f"- {v['name']} - ${v['price']:.2f}" for v in variants])
+                
+                system_prompt_b2c = prompts_config['b2c_product_query_prompt']
+                user_prompt_b2c = f"Productos encontrados:\n{product_list_str}\n\nURL de la tienda: {web_url}"
+
+                resp_final = chat_completion(
+                    self.env,
+                    [
+                        {"role": "system", "content": system_prompt_b2c},
+                        {"role": "user", "content": user_prompt_b2c}
+                    ],
+                    task='b2c_product_query',
+                    temperature=0.7
+                )
+                return self._send_text(resp_final.choices[0].message.content.strip())
+            except Exception as e:
+                _logger.error(f"❌ Error en consulta B2C con IA: {e}")
+                return self._send_text(messages_config['error_processing'])
+
+        if intent in ("crear_pedido", "repetir_pedido"):
+            try:
+                system_prompt_b2c = prompts_config['b2c_create_order_prompt']
+                user_prompt_b2c = f"Mensaje del cliente: \"{self.plain_text}\"\nURL de la tienda: {web_url}"
+
+                resp = chat_completion(
+                    self.env,
+                    [
+                        {"role": "system", "content": system_prompt_b2c},
+                        {"role": "user", "content": user_prompt_b2c}
+                    ],
+                    task='b2c_create_order',
+                    temperature=0.7
+                )
+                return self._send_text(resp.choices[0].message.content.strip())
+            except Exception as e:
+                _logger.error(f"❌ Error en crear_pedido B2C con IA: {e}")
+                return self._send_text(messages_config['error_processing'])
+
+        if intent == "solicitar_factura":
+            return self._send_text(messages_config['b2c_invoice_response'])
+
+        if intent == "saludo":
+            return self._send_text(handle_saludo(self.env, self.partner))
+
+        if intent == "agradecimiento_cierre":
+            return self._send_text(handle_agradecimiento_cierre(self.env, self.partner, self.plain_text))
+
+        if intent in ["consulta_horario_direccion", "consulta_informativa", "otro", ""]:
+            _logger.info(f"B2C Fallback/Info: Intención '{intent}' detectada. Enviando a handle_respuesta_faq.")
+            faq_response = handle_respuesta_faq(
+                self.env, self.partner, self.plain_text, self.ctx.history('faq'), self.ctx.summary
+            )
+            return self._send_text(faq_response)
+
+        return self._send_text(messages_config['error_default'])
+    
+    def _send_template(self, template_name_to_send, partner, invoice):
+        """
+        Envía una plantilla de WhatsApp para una factura con el número dinámico.
+        """
+        wa_account = self.record.wa_account_id
+        if not wa_account:
+            _logger.error("No se encontró una cuenta de WhatsApp activa.")
+            return
+
+        try:
+            wa_template = self.env['whatsapp.template'].sudo().search([
+                ('template_name', '=', template_name_to_send),
+                ('wa_account_id', '=', wa_account.id)
+            ], limit=1)
+
+            if not wa_template:
+                _logger.error(f"No se encontró la plantilla: {template_name_to_send}")
+                return
+
+            # --- CORRECCIÓN CLAVE ---
+            # Pasamos el diccionario de Python directamente, sin json.dumps()
+            free_text_data = {
+                'free_text_1': invoice.name
+            }
+
+            mail_message = self.env['mail.message'].sudo().create({
+                'model': 'account.move',
+                'res_id': invoice.id,
+                'body': wa_template.body,
+            })
+
+            vals = {
+                'mobile_number': partner.phone or partner.mobile,
+                'wa_account_id': wa_account.id,
+                'wa_template_id': wa_template.id,
+                'mail_message_id': mail_message.id,
+                'state': 'outgoing',
+                # Eliminamos json.dumps() y pasamos el diccionario directamente
+                'free_text_json': free_text_data,
+            }
+
+            outgoing_msg = self.env['whatsapp.message'].sudo().create(vals)
+            outgoing_msg._send_message()
+            _logger.info(f"✅ Plantilla {outgoing_msg.id} enviada para la factura {invoice.name}.")
+
+        except Exception as e:
+            _logger.error(f"❌ Error al enviar plantilla: {e}", exc_info=True)
+
+    def _send_response(self, response_data):
+        """Encola la respuesta; el despachador la registra en el canal y la envía por WhatsApp."""
+        message = response_data.get('message')
+        if not message:
+            return
+        self.ctx.append_turn('assistant', message)
+        self.env['chatbot.whatsapp.outbound'].enqueue(self.record, message)
+
+    def _send_text(self, text_to_send):
+        return self._send_response({'message': text_to_send})
+    
+    def _reset_flow(self):
+        """Sale del flujo actual descartando opciones ofrecidas y productos por resolver."""
+        self.ctx.clear_flow_data()
+        self.ctx.update(flow_state=False)
+
+    def _store_candidates(self, response_data):
+        """Guarda el nuevo estado del flujo y las opciones que devolvió un handler."""
+        self.ctx.clear_flow_data()
+        for kind, items in response_data.get('candidates', {}).items():
+            self.ctx.set_candidates(kind, items)
+        self.ctx.update(flow_state=response_data['flow_state'])
+
+    def _add_item_and_decide_next_step(self, pid, qty, name):
+        self.ctx.add_to_cart(pid, qty)
+        self.ctx.clear_selection()
+        return self._process_product_queue(added=[f"{qty}×{name}"])
+
+    def _process_product_queue(self, added=None, notes=None):
+        """
+        Resuelve de una vez todos los productos de la cola (ver
+        resolve_product_queries) y responde con un único mensaje: lo que se
+        agregó al carrito, lo que no se encontró o no tiene stock y, si alguno
+        necesita una respuesta del cliente (elegir variante, cantidad o aceptar
+        el stock disponible), la pregunta por el primero. Los demás quedan en la
+        cola y se vuelven a resolver cuando el cliente responde.
+        """
+        added = list(added or [])
+        sections = list(notes or [])
+        queue = list(self.ctx.queue)
+        self.ctx.clear_flow_data()
+
+        unavailable, pending = [], []
+        if queue:
+            _logger.info(f"⚙️ Resolviendo la cola de productos en lote: {queue}")
+            try:
+                resolved = resolve_product_queries(self.env, self.partner, queue)
+            except UserError as ue:
+                self.ctx.update(flow_state=False)
+                return self._send_text(str(ue))
+            for result in resolved:
+                variants, qty = result['variants'], result['quantity']
+                if result['status'] == 'not_found':
+                    unavailable.append(messages_config['batch_item_not_found'].format(query=result['query']))
+                elif result['status'] == 'no_stock':
+                    unavailable.append(messages_config['batch_item_no_stock'].format(query=result['query']))
+                elif len(variants) == 1 and qty and qty <= int(variants[0]['stock']):
+                    self.ctx.add_to_cart(variants[0]['id'], qty)
+                    if result['from_history']:
+                        added.append(messages_config['batch_item_from_history'].format(qty=qty, name=variants[0]['name']))
+                    else:
+                        added.append(f"{qty}×{variants[0]['name']}")
+                else:
+                    pending.append(result)
+
+        if added:
+            sections.append(messages_config['batch_items_added'].format(items="\n".join(f"• {item}" for item in added)))
+        if unavailable:
+            sections.append(messages_config['batch_items_unavailable'].format(items="\n".join(unavailable)))
+
+        if pending:
+            current, rest = pending[0], pending[1:]
+            if rest:
+                self.ctx.set_queue(rest)
+                sections.append(messages_config['batch_items_pending'].format(
+                    queries=", ".join(item['query'] for item in rest)
+                ))
+            sections.append(self._ask_for_product_choice(current))
+        elif self.ctx.cart:
+            _logger.info("🏁 Cola de productos resuelta. Pasando a confirmación.")
+            self.ctx.update(flow_state='esperando_confirmacion_pedido')
+            sections.append(messages_config['batch_order_summary'].format(
+                summary=format_cart_for_display(self.env, self.ctx.cart)
+            ))
+        else:
+            self.ctx.update(flow_state=False)
+            sections.append(messages_config['cart_is_empty'])
+        return self._send_text("\n\n".join(sections))
+
+    def _ask_for_product_choice(self, result):
+        """Deja el flujo esperando la respuesta del cliente sobre un producto resuelto y devuelve la pregunta."""
+        variants, qty, query = result['variants'], result['quantity'], result['query']
+        if len(variants) > 1:
+            buttons = "\n".join([f"{i+1}) {v['name']} - ${v['price']:.2f}" for i, v in enumerate(variants)])
+            self.ctx.set_candidates('product', variants)
+            self.ctx.update(flow_state='esperando_seleccion_producto', pending_qty=qty or 0)
+            return messages_config['ask_for_clarification'].format(query=query, buttons=buttons)
+        variant = variants[0]
+        pid, name, avail = variant['id'], variant['name'], int(variant['stock'])
+        if not qty:
+            self.ctx.update(flow_state='esperando_cantidad_producto', last_variant_id=pid)
+            return messages_config['ask_for_quantity'].format(name=name)
+        self.ctx.update(flow_state='esperando_confirmacion_stock', last_variant_id=pid, last_qty_suggested=avail)
+        return messages_config['insufficient_stock'].format(avail=avail, name=name)
+
+    def _handle_flow_esperando_confirmacion_pedido(self):
+        system_prompt = prompts_config['order_confirmation_system']
+        specialized_intent = detect_intention(self.env, [{"role": "user", "content": self.plain_text}], system_prompt, classifier='order_confirmation')
+        
+        if specialized_intent == "finalizar_pedido":
+            _logger.info("✅ Intención detectada: finalizar_pedido")
+            order_lines_data = self.ctx.cart
+            if not order_lines_data:
+                self.ctx.update(flow_state=False, cart=[])
+                return self._send_text(messages_config['cart_is_empty'])
+
+            delivery_addresses = self.partner.child_ids.filtered(lambda c: c.type == 'delivery')
+            
+            if len(delivery_addresses) > 1:
+                _logger.info(f"🚚 Múltiples direcciones de entrega ({len(delivery_addresses)}) encontradas para {self.partner.name}.")
+                
+                address_lines = []
+                for i, addr in enumerate(delivery_addresses):
+                    parts = [
+                        addr.name,
+                        addr.street,
+                        addr.city,
+                        addr.state_id.name,
+                        addr.zip,
+                        addr.country_id.name
+                    ]
+                    formatted_address = ", ".join(filter(None, parts))
+                    address_lines.append(f"{i+1}) {formatted_address}")
+                
+                address_list_str = "\n".join(address_lines)
+                
+                self.ctx.set_candidates('address', delivery_addresses.ids)
+                self.ctx.update(flow_state='esperando_seleccion_direccion')
+                
+                final_message = messages_config['ask_for_delivery_address'].format(addresses=address_list_str)
+                return self._send_text(final_message)
+            else:
+                shipping_id = delivery_addresses.id if delivery_addresses else self.partner.id
+                order = create_sale_order(self.env, self.partner.id, order_lines_data, partner_shipping_id=shipping_id)
+                summary = format_cart_for_display(self.env, order.order_line.mapped(lambda l: {'product_id': l.product_id.id, 'quantity': int(l.product_uom_qty)}))
+                response = messages_config['order_finalized'].format(order_name=order.name, summary=summary)
+                
+                self.ctx.clear_flow_data()
+                self.ctx.update(flow_state=False, cart=[])
+                return self._send_text(response)
+        
+        elif specialized_intent == 'modificar_pedido':
+            _logger.info("✅ Intención detectada: modificar_pedido")
+            response = handle_modificar_pedido(self.env, self.ctx)
+            return self._send_text(response)
+        
+        else:
+            _logger.info("✅ Intención detectada: continuar_pedido.")
+            self.ctx.update(flow_state=False)
+            return self._handle_general_intent()
+
+    def _handle_flow_esperando_seleccion_direccion(self):
+        """Maneja la selección de la dirección de entrega por parte del usuario."""
+        try:
+            address_ids = self.ctx.candidate_ids('address')
+            
+            if not (self.plain_text.isdigit() and 1 <= int(self.plain_text) <= len(address_ids)):
+                return self._send_text(messages_config['invalid_address_option'])
+
+            selected_address_id = address_ids[int(self.plain_text) - 1]
+            _logger.info(f"🚚 Dirección de entrega seleccionada: ID {selected_address_id}")
+
+            order = create_sale_order(self.env, self.partner.id, self.ctx.cart, partner_shipping_id=selected_address_id)
+            
+            summary = format_cart_for_display(self.env, order.order_line.mapped(lambda l: {'product_id': l.product_id.id, 'quantity': int(l.product_uom_qty)}))
+            response = messages_config['order_finalized'].format(order_name=order.name, summary=summary)
+            
+            self.ctx.clear_flow_data()
+            self.ctx.update(flow_state=False, cart=[])
+            
+            return self._send_text(response)
+            
+        except (ValueError, IndexError) as e:
+            _logger.error(f"Error en el flujo de selección de dirección: {e}")
+            self._reset_flow()
+            return self._send_text(messages_config['error_processing'])
+
+    def _handle_flow_esperando_seleccion_producto(self):
+        """
+        Maneja la respuesta del usuario tras mostrar una lista. Puede entender selección
+        por nombre, número o contexto, y también preguntas de seguimiento o cancelaciones.
+        """
+        variants = self.ctx.candidates('product')
+        selected_index = -1
+
+        # --- CORRECCIÓN: Manejo directo de selección numérica ---
+        if self.plain_text.isdigit():
+            try:
+                choice = int(self.plain_text)
+                if 1 <= choice <= len(variants):
+                    selected_index = choice - 1
+                    _logger.info(f"✅ Selección numérica directa detectada: índice {selected_index}")
+            except (ValueError, IndexError):
+                pass
+
+        if selected_index == -1:
+            _logger.info("La selección no fue numérica, usando IA para interpretar.")
+            system_prompt = prompts_config['product_selection_intent_system']
+            sub_intent = detect_intention(self.env, [{"role": "user", "content": self.plain_text}], system_prompt, classifier='product_selection')
+            
+            _logger.info(f"🔎 Sub-intención detectada en selección: '{sub_intent}'")
+
+            if sub_intent == 'seleccionar_producto':
+                disambiguation_prompt = prompts_config['product_disambiguation_prompt']
+                product_names = [v['name'] for v in variants]
+                
+                try:
+                    resp = chat_completion(
+                        self.env,
+                        [
+                            {"role": "system", "content": disambiguation_prompt},
+                            {"role": "user", "content": f"Lista: {product_names}\nRespuesta de usuario: \"{self.plain_text}\""}
+                        ],
+                        task='product_disambiguation',
+                        temperature=0,
+                    )
+                    selected_index = int(resp.choices[0].message.content.strip())
+                except (ValueError, openai.error.OpenAIError) as e:
+                    _logger.error(f"Error procesando desambiguación con IA: {e}")
+                    return self._send_text(messages_config['error_processing'])
+            
+            elif sub_intent == 'nueva_consulta':
+                _logger.info("El usuario hizo una nueva consulta sobre los productos mostrados.")
+                products_in_context = variants
+                context_for_ai = "Productos en contexto:\n" + "\n".join([f"- {p['name']} (${p['price']:.2f})" for p in products_in_context])
+                comparison_prompt = prompts_config['product_comparison_prompt']
+                try:
+                    resp = chat_completion(
+                        self.env,
+                        [
+                            {"role": "system", "content": comparison_prompt},
+                            {"role": "user", "content": f"{context_for_ai}\n\nPregunta del cliente: '{self.plain_text}'"}
+                        ],
+                        task='product_comparison',
+                        temperature=0.7
+                    )
+                    return self._send_text(resp.choices[0].message.content)
+                except Exception as e:
+                    _logger.error(f"Error en la sub-consulta de producto: {e}")
+                    return self._send_text(messages_config['error_processing'])
+            
+            elif sub_intent == 'cancelar_seleccion':
+                _logger.info("El usuario canceló la selección de producto.")
+                self._reset_flow()
+                return self._send_text(messages_config['selection_cancelled'])
+            
+            else:
+                 return self._send_text(messages_config['invalid_option'])
+
+        if 0 <= selected_index < len(variants):
+            selected_variant = variants[selected_index]
+            qty = self.ctx.get('pending_qty')
+            
+            self.ctx.clear_selection()
+            pid, name, avail = selected_variant['id'], selected_variant['name'], int(selected_variant['stock'])
+
+            if not qty:
+                self.ctx.update(flow_state='esperando_cantidad_producto', last_variant_id=pid)
+                return self._send_text(messages_config['ask_for_quantity'].format(name=name))
+            
+            if qty <= avail:
+                return self._add_item_and_decide_next_step(pid, qty, name)
+            else:
+                self.ctx.update(flow_state='esperando_confirmacion_stock', last_variant_id=pid, last_qty_suggested=avail)
+                return self._send_text(messages_config['insufficient_stock'].format(avail=avail, name=name))
+        else:
+            return self._send_text(messages_config['invalid_option'])
+
+
+    def _handle_flow_esperando_cantidad_producto(self):
+        """
+        Maneja la entrada de cantidad del usuario, usando IA para interpretar
+        lenguaje natural (ej: "uno", "un par").
+        """
+        qty = 0
+        # Primero, intenta una conversión directa si el usuario escribe un número
+        if self.plain_text.isdigit():
+            qty = int(self.plain_text)
+        else:
+            # Si no es un dígito, usa IA para interpretar el texto
+            _logger.info(f"🔢 La cantidad '{self.plain_text}' no es un dígito. Usando IA para interpretar.")
+            try:
+                extraction_prompt = prompts_config['quantity_extraction_prompt']
+                
+                resp = chat_completion(
+                    self.env,
+                    [
+                        {"role": "system", "content": extraction_prompt},
+                        {"role": "user", "content": self.plain_text}
+                    ],
+                    task='quantity_extraction',
+                    temperature=0
+                )
+                qty_str = resp.choices[0].message.content.strip()
+                qty = int(qty_str)
+            except (ValueError, openai.error.OpenAIError) as e:
+                _logger.error(f"❌ Error convirtiendo cantidad con IA: {e}")
+                return self._send_text(messages_config['invalid_quantity_format'])
+
+        if qty <= 0:
+            return self._send_text(messages_config['invalid_quantity'])
+
+        variant = self.ctx.last_variant
+        avail = self.env['chatbot.stock.snapshot'].sudo().get_available_qty(variant).get(variant.id, 0)
+
+        if qty > avail:
+            self.ctx.update(flow_state='esperando_confirmacion_stock', last_qty_suggested=int(avail))
+            return self._send_text(messages_config['insufficient_stock'].format(avail=int(avail), name=variant.display_name))
+        else:
+            return self._add_item_and_decide_next_step(variant.id, qty, variant.display_name)
+
+    def _handle_flow_esperando_confirmacion_stock(self):
+        choice = self.plain_text.lower().strip()
+        if choice in ('1', 'sí', 'si', 'si, esa cantidad'):
+            var = self.ctx.last_variant
+            qty = self.ctx.last_qty_suggested
+            return self._add_item_and_decide_next_step(var.id, qty, var.display_name)
+        
+        elif choice in ('2', 'no', 'cancelar'):
+            self.ctx.update(flow_state=False)
+            return self._process_product_queue(notes=[messages_config['stock_item_cancelled']])
+        
+        else:
+            return self._send_text(messages_config['invalid_stock_confirmation'])
+    
+    def _handle_crear_pedido_intent(self):
+        """Inicia el proceso de creación de pedido, obteniendo y encolando productos."""
+        system_prompt = prompts_config['create_order_system']
+        
+        try:
+            resp = chat_completion(
+                self.env,
+                [{"role": "system", "content": system_prompt}, {"role": "user", "content": self.plain_text}],
+                task='create_order_extraction',
+                functions=prompts_config['create_order_function'],
+                function_call={"name": "lookup_product_variants"},
+                temperature=0,
+            )
+            msg = resp.choices[0].message
+        except Exception as e:
+            _logger.error(f"❌ Error en la llamada a OpenAI para extraer productos: {e}")
+            return self._send_text(messages_config['error_processing'])
+
+        if not msg.get('function_call'):
+            return self._send_text(messages_config['error_default'])
+
+        args = json.loads(msg.function_call.arguments)
+        products_to_add = args.get('products', [])
+
+        if not products_to_add:
+            _logger.info("🛒 Intención 'crear_pedido' sin productos. Usando IA para preguntar qué desea.")
+            try:
+                ask_prompt = prompts_config['ask_for_products_prompt']
+                
+                # Se arma el payload para OpenAI con la ventana reciente y el resumen de la conversación
+                messages = self.ctx.prompt('ask_for_products', ask_prompt)
+
+                resp_ask = chat_completion(
+                    self.env,
+                    messages,
+                    task='ask_for_products',
+                    temperature=0.7
+                )
+                ai_response = resp_ask.choices[0].message.content.strip()
+                return self._send_text(ai_response)
+                
+            except Exception as e:
+                _logger.error(f"❌ Error generando la pregunta por productos con IA: {e}")
+                return self._send_text(messages_config['product_not_found_gpt'])
+
+        _logger.info(f"🛒 Productos detectados por IA para encolar: {products_to_add}")
+        self.ctx.clear_selection()
+        self.ctx.update(flow_state=False, queue=products_to_add)
+        
+        return self._process_product_queue()
+    
+    def _handle_repetir_pedido_intent(self):
+        """
+        Carga en el carrito el último pedido confirmado del cliente, leído del
+        historial de compras (chatbot.partner.affinity), sin llamar a la IA.
+        """
+        lines = self.env['chatbot.partner.affinity'].sudo().last_order_lines(self.partner)
+        if not lines:
+            return self._send_text(messages_config['repeat_order_no_history'])
+
+        products = self.env['product.product'].sudo().browse([product_id for product_id, _qty in lines])
+        stock = self.env['chatbot.stock.snapshot'].sudo().get_available_qty(products)
+        added, unavailable = [], []
+        for product, (_product_id, qty) in zip(products, lines):
+            qty = max(int(round(qty)), 1)
+            if not (product.active and product.sale_ok) or stock.get(product.id, 0) < qty:
+                unavailable.append(messages_config['batch_item_no_stock'].format(query=product.display_name))
+                continue
+            self.ctx.add_to_cart(product.id, qty)
+            added.append(f"{qty}×{product.display_name}")
+        _logger.info(f"🔁 Repetir pedido de {self.partner.name}: {len(added)} productos agregados, {len(unavailable)} sin stock")
+
+        notes = [messages_config['repeat_order_intro']]
+        if unavailable:
+            notes.append(messages_config['batch_items_unavailable'].format(items="\n".join(unavailable)))
+        self.ctx.clear_flow_data()
+        return self._process_product_queue(added=added, notes=notes)
+
+    def _handle_flow_esperando_seleccion_o_numero_factura(self):
+        """
+        Maneja la respuesta del usuario, que puede ser la selección de una factura
+        de la lista (ej: '1') o un número de factura completo para buscar.
+        """
+        if self.plain_text.lower() == 'cancelar':
+            self._reset_flow()
+            return self._send_text(messages_config['invoice_selection_cancelled'])
+
+        template_name = "envio_factura_bot"
+        
+        # Intenta interpretar la entrada como una selección de la lista (ej: "1", "2", etc.)
+        if self.plain_text.isdigit():
+            try:
+                invoice_ids = self.ctx.candidate_ids('invoice')
+                choice = int(self.plain_text)
+                
+                if 1 <= choice <= len(invoice_ids):
+                    selected_invoice_id = invoice_ids[choice - 1]
+                    invoice = self.env['account.move'].sudo().browse(selected_invoice_id)
+                    _logger.info(f"🧾 Usuario seleccionó factura de la lista: {invoice.name}")
+                    self._reset_flow()
+                    return self._send_template(template_name, self.partner, invoice)
+            except (ValueError, IndexError):
+                # Si falla, no es una selección válida. Lo tratará como un número de factura.
+                _logger.warning(f"⚠️ No se pudo procesar '{self.plain_text}' como selección. Intentando como búsqueda.")
+                pass
+
+        # Si no fue una selección de la lista, lo trata como un número de factura para buscar
+        _logger.info(f"🧾 Buscando factura por número ingresado: '{self.plain_text}'")
+        invoice = find_invoice_by_number(self.env, self.partner, self.plain_text)
+        
+        if invoice:
+            _logger.info(f"🧾 Factura encontrada por número: {invoice.name}")
+            self._reset_flow()
+            return self._send_template(template_name, self.partner, invoice)
+        else:
+            # Si no se encuentra, se le vuelve a ofrecer la lista.
+            _logger.warning(f"🧾 No se encontró factura con '{self.plain_text}'. Re-ofreciendo lista.")
+            invoices_in_memory = self.env['account.move'].sudo().browse(self.ctx.candidate_ids('invoice'))
+            
+            invoice_lines = [f"{i+1}) *{inv.name}* del {inv.invoice_date.strftime('%d/%m/%Y')} - ${inv.amount_total:,.2f}" for i, inv in enumerate(invoices_in_memory)]
+            invoice_list_str = "\n".join(invoice_lines)
+
+            message = messages_config['invoice_search_failed_reoffer'].format(
+                number=self.plain_text,
+                invoices=invoice_list_str
+            )
+            return self._send_text(message)
+        
+    def _handle_flow_esperando_numero_factura(self):
+        """
+        Maneja el caso donde no había facturas recientes y el usuario
+        ingresa un número de factura para una búsqueda directa.
+        """
+        if self.plain_text.lower() == 'cancelar':
+            self._reset_flow()
+            return self._send_text(messages_config['invoice_selection_cancelled'])
+
+        template_name = "envio_factura_bot"
+        invoice = find_invoice_by_number(self.env, self.partner, self.plain_text)
+
+        if invoice:
+            _logger.info(f"🧾 Factura encontrada por número: {invoice.name}")
+            self._reset_flow()
+            return self._send_template(template_name, self.partner, invoice)
+        else:
+            # Si no se encuentra, se informa al usuario y se resetea el flujo.
+            _logger.warning(f"🧾 No se encontró factura con el número '{self.plain_text}'.")
+            self._reset_flow()
+            message = messages_config['invoice_not_found_and_reset'].format(number=self.plain_text)
+            return self._send_text(message)
+            
+    def _handle_general_intent(self):
+        system_prompt = prompts_config['general_intent_system']
+        conv = self.ctx.history('general_intent')
+        intent = detect_intention(self.env, conv, system_prompt, classifier='general')
+        self.ctx.update(last_intent_detected=intent)
+        metrics.set_labels(intent=intent)
+        _logger.info(f"👤 Intent General detectado: {intent} para {self.partner.name}")
+
+        if intent == "solicitar_factura":
+            number_match = re.search(r'[\d\-\s]+', self.plain_text)
+            if number_match:
+                invoice = find_invoice_by_number(self.env, self.partner, number_match.group())
+                if invoice:
+                    self._reset_flow()
+                    return self._send_template("envio_factura_bot", self.partner, invoice)
+            
+            response_data = handle_solicitar_factura(self.env, self.partner, self.plain_text)
+            
+            if response_data.get('flow_state'):
+                self._store_candidates(response_data)
+            return self._send_response(response_data)
+
+        if intent in ["saludo", "agradecimiento_cierre"]:
+            handler = {"saludo": handle_saludo, "agradecimiento_cierre": handle_agradecimiento_cierre}[intent]
+            response_text = handler(self.env, self.partner, self.plain_text) if intent == "agradecimiento_cierre" else handler(self.env, self.partner)
+            return self._send_text(response_text)
+
+        if intent in ["crear_pedido", "modificar_pedido"]:
+            if intent == "crear_pedido": return self._handle_crear_pedido_intent()
+            if intent == "modificar_pedido": return self._send_text(handle_modificar_pedido(self.env, self.ctx))
+
+        if intent == "repetir_pedido":
+            return self._handle_repetir_pedido_intent()
+
+        if intent == "consulta_producto":
+            response_data = handle_consulta_producto(self.env, self.partner, self.plain_text)
+            if response_data.get('flow_state'):
+                self._store_candidates(response_data)
+            return self._send_response(response_data)
+        
+        # --- MANEJADOR UNIFICADO CON IA ---
+        if intent in ["consulta_horario_direccion", "consulta_informativa", "otro", ""]:
+            _logger.info(f"General Fallback/Info: Intención '{intent}' detectada. Enviando a handle_respuesta_faq.")
+            faq_response = handle_respuesta_faq(
+                self.env, self.partner, self.plain_text, self.ctx.history('faq'), self.ctx.summary
+            )
+            return self._send_text(faq_response)
+
+        return self._send_text(messages_config['error_default'])
+    
+    def _handle_flow_esperando_seleccion_eliminar(self):
+        cart_lines = self.ctx.cart
+        if self.plain_text.lower() == 'cancelar':
+            self.ctx.update(flow_state='esperando_confirmacion_pedido')
+            return self._send_text(messages_config['cancel_modification'])
+        
+        try:
+            index_to_remove = int(self.plain_text)
+            if not (1 <= index_to_remove <= len(cart_lines)):
+                return self._send_text(messages_config['invalid_number_for_deletion'])
+            
+            cart_lines.pop(index_to_remove - 1)
+            self.ctx.set_cart(cart_lines)
+            
+            new_summary = format_cart_for_display(self.env, cart_lines)
+            response = messages_config['item_removed_confirm'].format(summary=new_summary)
+            self.ctx.update(flow_state='esperando_confirmacion_pedido')
+            return self._send_text(response)
+        except ValueError:
+
+            return self._send_text(messages_config['invalid_input_for_deletion'])
@@ -0,0 +1,278 @@
+import logging
+
+from odoo.fields import Command
+
+from ..config.config import general_config
+from ..utils.prompt_builder import build_messages, compact_turns
+
+_logger = logging.getLogger(__name__)
+
+HISTORY_CONFIG = general_config.get('conversation_history', {})
+
+
+class ConversationContext:
+    """
+    Estado de la conversación durante un turno. El partner, la memoria, el
+    carrito, la cola de productos y las opciones ofrecidas se cargan una sola
+    vez; los handlers los modifican en memoria y flush() los escribe con un
+    único write() al terminar el turno.
+    """
+
+    def __init__(self, env, partner, memory):
+        self.env = env
+        self.partner = partner
+        self.memory = memory
+        self._pending = {}
+        self._cart = None
+        self._queue = None
+        self._candidates = None
+        self._turns = None
+        self._cart_dirty = False
+        self._queue_dirty = False
+        self._candidates_dirty = False
+        self._profile = None
+        self._delete = False
+
+    @classmethod
+    def load(cls, env, partner):
+        Memory = env['chatbot.whatsapp.memory'].sudo()
+        # La fila queda bloqueada durante el turno: el cron de expiración
+        # (clean_old_memory, con SKIP LOCKED) no borra una sesión en uso.
+        env.cr.execute(
+            "SELECT id FROM chatbot_whatsapp_memory WHERE partner_id = %s FOR UPDATE", (partner.id,)
+        )
+        row = env.cr.fetchone()
+        memory = Memory.browse(row[0]) if row else Memory.create({'partner_id': partner.id})
+        return cls(env, partner, memory)
+
+    # --- Campos de la memoria ---
+
+    def get(self, field_name):
+        if field_name in self._pending:
+            return self._pending[field_name]
+        return self.memory[field_name]
+
+    def update(self, **values):
+        """Registra cambios en la memoria. `cart` y `queue` reciben listas de dicts."""
+        if 'cart' in values:
+            self.set_cart(values.pop('cart'))
+        if 'queue' in values:
+            self.set_queue(values.pop('queue'))
+        self._pending.update(values)
+
+    @property
+    def flow_state(self):
+        return self.get('flow_state')
+
+    @property
+    def human_takeover(self):
+        return self.get('human_takeover')
+
+    @property
+    def takeover_until(self):
+        return self.get('takeover_until')
+
+    @property
+    def last_variant(self):
+        variant = self.get('last_variant_id')
+        if isinstance(variant, int):
+            variant = self.env['product.product'].browse(variant)
+        return variant.sudo()
+
+    @property
+    def last_qty_suggested(self):
+        return self.get('last_qty_suggested')
+
+    # --- Carrito, cola de productos y opciones ofrecidas (modelos hijos de la memoria) ---
+
+    @property
+    def cart(self):
+        """Líneas del carrito como [{'product_id', 'quantity'}], leídas una sola vez."""
+        if self._cart is None:
+            self._cart = [
+                {'product_id': line.product_id.id, 'quantity': line.quantity}
+                for line in self.memory.cart_line_ids
+            ]
+        return self._cart
+
+    def set_cart(self, lines):
+        self._cart = list(lines or [])
+        self._cart_dirty = True
+
+    def add_to_cart(self, product_id, quantity):
+        """Agrega un item al carrito, consolidando si ya existe."""
+        for item in self.cart:
+            if item.get('product_id') == product_id:
+                item['quantity'] += quantity
+                break
+        else:
+            self.cart.append({'product_id': product_id, 'quantity': quantity})
+        self._cart_dirty = True
+        _logger.info(f"🛒 Carrito actualizado: {self.cart}")
+
+    @property
+    def queue(self):
+        """Productos pedidos que todavía falta resolver, como [{'query', 'quantity'}]."""
+        if self._queue is None:
+            self._queue = [
+                {'query': item.query, 'quantity': item.quantity or None}
+                for item in self.memory.pending_product_ids
+            ]
+        return self._queue
+
+    def set_queue(self, items):
+        self._queue = [{'query': item.get('query'), 'quantity': item.get('quantity')} for item in items or []]
+        self._queue_dirty = True
+
+    def _load_candidates(self):
+        if self._candidates is None:
+            self._candidates = {}
+            for candidate in self.memory.candidate_ids:
+                self._candidates.setdefault(candidate.kind, []).append(candidate._to_dict())
+        return self._candidates
+
+    def candidates(self, kind):
+        """Opciones ofrecidas al cliente de un tipo ('product', 'address', 'invoice')."""
+        return self._load_candidates().get(kind, [])
+
+    def candidate_ids(self, kind):
+        return [candidate['id'] for candidate in self.candidates(kind)]
+
+    def set_candidates(self, kind, items):
+        """Reemplaza las opciones ofrecidas. `items` son dicts con 'id' (y nombre, precio y stock) o ids."""
+        candidates = self._load_candidates()
+        candidates.clear()
+        candidates[kind] = [item if isinstance(item, dict) else {'id': item} for item in items or []]
+        self._candidates_dirty = True
+
+    def clear_selection(self):
+        """Descarta las opciones ofrecidas y la cantidad que esperaba una selección."""
+        if self._load_candidates():
+            self._candidates.clear()
+            self._candidates_dirty = True
+        if self.get('pending_qty'):
+            self.update(pending_qty=0)
+
+    def clear_flow_data(self):
+        """Descarta todo el estado temporal del flujo: opciones ofrecidas y cola de productos."""
+        self.clear_selection()
+        if self.queue:
+            self.set_queue([])
+
+    # --- Ventana de turnos recientes ---
+
+    @property
+    def turns(self):
+        if self._turns is None:
+            self._turns = list(self.memory.recent_turns or [])
+        return self._turns
+
+    @property
+    def summary(self):
+        return self.get('conversation_summary') or ''
+
+    def append_turn(self, role, content):
+        """
+        Agrega un turno a la ventana. Los que quedan por encima de max_turns
+        pasan al resumen compacto de la conversación.
+        """
+        if not content:
+            return
+        max_turns = HISTORY_CONFIG.get('max_turns', 10)
+        turns = self.turns + [{'role': role, 'content': content}]
+        evicted, self._turns = turns[:-max_turns], turns[-max_turns:]
+        self._pending['recent_turns'] = self._turns
+        if evicted:
+            self._pending['conversation_summary'] = compact_turns(self.summary, evicted)
+
+    def history(self, handler=None):
+        """Últimos turnos para armar el prompt de `handler`, según conversation_history.window_turns."""
+        windows = HISTORY_CONFIG.get('window_turns', {})
+        size = windows.get(handler, windows.get('default', 3))
+        return [dict(turn) for turn in self.turns[-size:]] if size else []
+
+    def prompt(self, task, system_prompt, handler=None, user_content=None):
+        """
+        Mensajes para `task` con la ventana de `handler` y el resumen de la
+        conversación, ajustados a su presupuesto de tokens.
+        """
+        return build_messages(task, system_prompt, self.history(handler or task), user_content, self.summary)
+
+    # --- Datos del partner ---
+
+    @property
+    def profile(self):
+        """Perfil de ruteo del partner (chatbot.partner.profile), leído una vez por turno."""
+        if self._profile is None:
+            self._profile = self.env['chatbot.partner.profile'].sudo().get_profile(self.partner)
+        return self._profile
+
+    @property
+    def customer_type(self):
+        """Nombre de la etiqueta hija de "Tipo de Cliente" del partner, o None."""
+        return self.profile['customer_type']
+
+    @property
+    def is_b2c(self):
+        return self.profile['is_b2c']
+
+    @property
+    def is_quoted(self):
+        return self.profile['has_quote']
+
+    @property
+    def website_url(self):
+        return self.profile['website_url']
+
+    @property
+    def pricelist(self):
+        return self.env['product.pricelist'].sudo().browse(self.profile['pricelist_id'] or [])
+
+    def invalidate_partner(self):
+        """Vuelve a leer el perfil del partner (p. ej. tras cambiar sus etiquetas)."""
+        self._profile = None
+
+    # --- Fin del turno ---
+
+    def delete(self):
+        """Borra la memoria al final del turno en lugar de escribirla."""
+        self._delete = True
+
+    def _cart_commands(self):
+        """Comandos mínimos para llevar las líneas guardadas al carrito del turno."""
+        existing = {line.product_id.id: line for line in self.memory.cart_line_ids}
+        commands = []
+        for sequence, item in enumerate(self._cart):
+            line = existing.pop(item['product_id'], None)
+            if not line:
+                commands.append(Command.create({
+                    'product_id': item['product_id'], 'quantity': item['quantity'], 'sequence': sequence,
+                }))
+            elif (line.quantity, line.sequence) != (item['quantity'], sequence):
+                commands.append(Command.update(line.id, {'quantity': item['quantity'], 'sequence': sequence}))
+        commands += [Command.delete(line.id) for line in existing.values()]
+        return commands
+
+    def flush(self):
+        """Escribe los cambios del turno (campos e hijos) con un único write() de la memoria."""
+        if self._delete:
+            self.memory.unlink()
+            return
+        vals = dict(self._pending)
+        if self._cart_dirty:
+            vals['cart_line_ids'] = self._cart_commands()
+        if self._queue_dirty:
+            vals['pending_product_ids'] = [Command.delete(item.id) for item in self.memory.pending_product_ids] + [
+                Command.create({'sequence': sequence, 'query': item['query'], 'quantity': item['quantity'] or 0})
+                for sequence, item in enumerate(self._queue)
+            ]
+        if self._candidates_dirty:
+            vals['candidate_ids'] = [Command.delete(candidate.id) for candidate in self.memory.candidate_ids] + [
+                Command.create(self.env['chatbot.whatsapp.candidate']._from_dict(kind, sequence, candidate))
+                for kind, items in self._candidates.items()
+                for sequence, candidate in enumerate(items)
+            ]
+        if vals:
+            self.memory.write(vals)
+        self._pending.clear()
+        self._cart_dirty = self._queue_dirty = self._candidates_dirty = False
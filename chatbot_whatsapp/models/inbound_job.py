@@ -0,0 +1,342 @@
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import math
+import threading
+import time
+
+from ..config.config import general_config
+from ..utils import metrics
+from ..utils.utils import clean_html
+
+_logger = logging.getLogger(__name__)
+
+QUEUE_CONFIG = general_config.get('queue', {})
+OPENAI_CONFIG = general_config.get('openai', {})
+
+# Espacio de claves para los advisory locks por teléfono (pg_advisory_lock(int, int)).
+PHONE_LOCK_NAMESPACE = 22369
+
+
+class WhatsAppInboundJob(models.Model):
+    _name = 'chatbot.whatsapp.inbound.job'
+    _description = 'Cola de mensajes entrantes del chatbot de WhatsApp'
+    _order = 'id'
+
+    message_id = fields.Many2one('whatsapp.message', string="Mensaje", required=True, ondelete='cascade', index=True)
+    mobile_number = fields.Char(string="Teléfono", required=True, index=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('processing', 'Procesando'),
+        ('done', 'Procesado'),
+        ('merged', 'Agrupado'),
+        ('dead', 'Descartado'),
+    ], string="Estado", default='pending', required=True, index=True)
+    attempts = fields.Integer(string="Intentos", default=0)
+    merged_into_id = fields.Many2one('chatbot.whatsapp.inbound.job', string="Agrupado en", ondelete='cascade', index=True)
+    merged_job_ids = fields.One2many('chatbot.whatsapp.inbound.job', 'merged_into_id', string="Mensajes Agrupados")
+    last_error = fields.Text(string="Último Error")
+
+    # Tiempos
+    enqueued_at = fields.Datetime(string="Encolado", default=fields.Datetime.now, required=True)
+    next_attempt_at = fields.Datetime(string="Próximo Intento", default=fields.Datetime.now, index=True)
+    started_at = fields.Datetime(string="Inicio")
+    finished_at = fields.Datetime(string="Fin")
+    duration_ms = fields.Integer(string="Duración (ms)")
+
+    @api.model
+    def enqueue(self, messages):
+        """Encola los mensajes entrantes y despierta al consumidor. No procesa nada."""
+        vals_list = [{
+            'message_id': msg.id,
+            'mobile_number': msg._chatbot_sanitized_phone(),
+        } for msg in messages]
+        if not vals_list:
+            return self.browse()
+        jobs = self.sudo().create(vals_list)
+        _logger.info(f"📥 Encolados {len(jobs)} mensajes entrantes para el chatbot.")
+        # Se despierta al consumidor cuando vence la ventana de agrupación (debounce).
+        debounce = QUEUE_CONFIG.get('debounce_seconds', 0)
+        self.env.ref('chatbot_whatsapp.ir_cron_chatbot_process_inbound_jobs').sudo()._trigger(
+            at=fields.Datetime.now() + timedelta(seconds=debounce) if debounce else None
+        )
+        return jobs
+
+    def init(self):
+        # Acelera el chequeo de orden por teléfono al reclamar jobs.
+        create_index(
+            self.env.cr, 'chatbot_whatsapp_inbound_job_phone_open_idx', self._table,
+            ['mobile_number', 'id'], where="state IN ('pending', 'processing')",
+        )
+
+    @api.model
+    def process_pending_jobs(self, limit=None):
+        """
+        Consumidor de la cola, llamado por el cron. Reparte el trabajo entre
+        queue.pool_size hilos, cada uno con su propio cursor. Cada job se reclama,
+        procesa y confirma en su propia transacción para no bloquear al resto.
+        """
+        limit = limit or QUEUE_CONFIG.get('batch_size', 50)
+        pool_size = max(1, QUEUE_CONFIG.get('pool_size', 4))
+        self._requeue_stalled_jobs()
+
+        if pool_size == 1:
+            processed = self._consume(limit)
+        else:
+            per_worker = math.ceil(limit / pool_size)
+            with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='chatbot-worker') as executor:
+                futures = [
+                    executor.submit(self._consume_in_new_cursor, per_worker)
+                    for _ in range(pool_size)
+                ]
+                processed = sum(future.result() for future in futures)
+
+        queue = self.get_queue_metrics()
+        if processed or queue['depth']:
+            _logger.info(
+                f"📤 Consumidor de la cola: {processed} jobs procesados | "
+                f"pendientes: {queue['depth']} | en proceso: {queue['processing']} | "
+                f"lag: {queue['lag_seconds']:.1f}s"
+            )
+        metrics.flush_all(self.env)
+        self._gc_finished_jobs()
+        return processed
+
+    def _consume_in_new_cursor(self, limit):
+        """Punto de entrada de cada hilo: abre su propio cursor y entorno."""
+        threading.current_thread().dbname = self.env.cr.dbname
+        with self.env.registry.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            return env[self._name]._consume(limit)
+
+    @api.model
+    def _consume(self, limit):
+        processed = 0
+        while processed < limit:
+            job = self._claim_next_job()
+            if not job:
+                break
+            if not job._run():
+                # Otro proceso tiene tomada la conversación: el job volvió a la cola y
+                # el cron se vuelve a disparar en un segundo (ver _run).
+                break
+            processed += 1
+        return processed
+
+    def _claim_next_job(self):
+        """
+        Toma el próximo job listo. SKIP LOCKED permite varios consumidores a la vez
+        y solo se elige un job si no hay otro anterior abierto para el mismo teléfono,
+        para que los mensajes de una conversación se procesen en orden.
+
+        Además, una conversación solo se toma cuando lleva queue.debounce_seconds sin
+        mensajes nuevos (o su primer mensaje pendiente ya esperó
+        queue.debounce_max_wait_seconds); los mensajes posteriores de la ráfaga
+        se agrupan en el job reclamado.
+        """
+        self.env.cr.execute("""
+            SELECT job.id FROM chatbot_whatsapp_inbound_job job
+             WHERE job.state = 'pending'
+               AND job.next_attempt_at <= (now() at time zone 'UTC')
+               AND NOT EXISTS (
+                    SELECT 1 FROM chatbot_whatsapp_inbound_job prev
+                     WHERE prev.mobile_number = job.mobile_number
+                       AND prev.id < job.id
+                       AND prev.state IN ('pending', 'processing'))
+               AND (job.enqueued_at <= (now() at time zone 'UTC') - make_interval(secs => %(max_wait)s)
+                    OR NOT EXISTS (
+                        SELECT 1 FROM chatbot_whatsapp_inbound_job newer
+                         WHERE newer.mobile_number = job.mobile_number
+                           AND newer.state = 'pending'
+                           AND newer.enqueued_at > (now() at time zone 'UTC') - make_interval(secs => %(debounce)s)))
+          ORDER BY job.id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """, {
+            'debounce': QUEUE_CONFIG.get('debounce_seconds', 0),
+            'max_wait': QUEUE_CONFIG.get('debounce_max_wait_seconds', 15),
+        })
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        job.write({
+            'state': 'processing',
+            'attempts': job.attempts + 1,
+            'started_at': fields.Datetime.now(),
+        })
+        job._absorb_burst()
+        self._commit()
+        return job
+
+    def _absorb_burst(self):
+        """Agrupa en este job los mensajes pendientes posteriores del mismo teléfono."""
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT id FROM chatbot_whatsapp_inbound_job
+             WHERE mobile_number = %s AND state = 'pending' AND id > %s
+          ORDER BY id
+               FOR UPDATE SKIP LOCKED
+        """, (self.mobile_number, self.id))
+        burst_ids = [row[0] for row in self.env.cr.fetchall()]
+        if burst_ids:
+            _logger.info(f"🧩 Agrupando {len(burst_ids)} mensajes de {self.mobile_number} en el job {self.id}.")
+            self.browse(burst_ids).write({
+                'state': 'merged',
+                'merged_into_id': self.id,
+                'finished_at': fields.Datetime.now(),
+            })
+
+    def _get_turn_messages(self):
+        """Mensajes que forman el turno: el del job más los agrupados, en orden."""
+        self.ensure_one()
+        return (self.message_id | self.merged_job_ids.message_id).sorted('id')
+
+    def _acquire_phone_lock(self):
+        self.env.cr.execute(
+            "SELECT pg_try_advisory_lock(%s, hashtext(%s))",
+            (PHONE_LOCK_NAMESPACE, self.mobile_number),
+        )
+        return self.env.cr.fetchone()[0]
+
+    def _release_phone_lock(self):
+        self.env.cr.execute(
+            "SELECT pg_advisory_unlock(%s, hashtext(%s))",
+            (PHONE_LOCK_NAMESPACE, self.mobile_number),
+        )
+
+    def _run(self):
+        """
+        Procesa el job con un advisory lock sobre el teléfono, que serializa todo
+        lo que toque la misma conversación (y su chatbot.whatsapp.memory).
+        Devuelve False si el lock está tomado y el job vuelve a la cola.
+        """
+        self.ensure_one()
+        if not self._acquire_phone_lock():
+            _logger.info(f"🔒 Conversación {self.mobile_number} ocupada. Job {self.id} devuelto a la cola.")
+            self.write({'state': 'pending', 'attempts': self.attempts - 1})
+            self.env.ref('chatbot_whatsapp.ir_cron_chatbot_process_inbound_jobs').sudo()._trigger(
+                at=fields.Datetime.now() + timedelta(seconds=1)
+            )
+            self._commit()
+            return False
+
+        start = time.monotonic()
+        try:
+            try:
+                with self.env.cr.savepoint():
+                    messages = self._get_turn_messages()
+                    plain_text = "\n".join(
+                        clean_html(msg.body or "").strip() for msg in messages
+                    ).strip()
+                    messages[-1]._chatbot_process_inbound(plain_text=plain_text)
+            except Exception as e:
+                _logger.error(f"❌ Error procesando el job {self.id} (intento {self.attempts}): {e}", exc_info=True)
+                self._mark_failed(str(e), start)
+            else:
+                self.write({
+                    'state': 'done',
+                    'finished_at': fields.Datetime.now(),
+                    'duration_ms': int((time.monotonic() - start) * 1000),
+                    'last_error': False,
+                })
+            self._commit()
+        finally:
+            self._release_phone_lock()
+        return True
+
+    @api.model
+    def get_queue_metrics(self):
+        """Profundidad de la cola y antigüedad (lag) del job pendiente más viejo."""
+        self.env.cr.execute("""
+            SELECT count(*) FILTER (WHERE state = 'pending'),
+                   count(*) FILTER (WHERE state = 'processing'),
+                   EXTRACT(EPOCH FROM (now() at time zone 'UTC') - min(enqueued_at) FILTER (WHERE state = 'pending'))
+              FROM chatbot_whatsapp_inbound_job
+             WHERE state IN ('pending', 'processing')
+        """)
+        depth, processing, lag = self.env.cr.fetchone()
+        return {
+            'depth': depth or 0,
+            'processing': processing or 0,
+            'lag_seconds': float(lag or 0.0),
+        }
+
+    def _commit(self):
+        # En los tests todo corre en la transacción del test, pero los cambios
+        # se escriben igual para que las consultas SQL de la cola los vean.
+        self.env.flush_all()
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _mark_failed(self, error, start=None):
+        max_attempts = QUEUE_CONFIG.get('max_attempts', 3)
+        vals = {
+            'last_error': error,
+            'finished_at': fields.Datetime.now(),
+        }
+        if start is not None:
+            vals['duration_ms'] = int((time.monotonic() - start) * 1000)
+        if self.attempts >= max_attempts:
+            _logger.warning(f"☠️ Job {self.id} descartado tras {self.attempts} intentos.")
+            vals['state'] = 'dead'
+            # Los mensajes agrupados en el job eran parte del mismo turno: se descartan con él.
+            self.merged_job_ids.write({'state': 'dead', 'last_error': error})
+        else:
+            delay = QUEUE_CONFIG.get('retry_backoff_seconds', 30) * (2 ** (self.attempts - 1))
+            vals.update({
+                'state': 'pending',
+                'next_attempt_at': fields.Datetime.now() + timedelta(seconds=delay),
+            })
+            self.env.ref('chatbot_whatsapp.ir_cron_chatbot_process_inbound_jobs').sudo()._trigger(
+                at=vals['next_attempt_at']
+            )
+        self.write(vals)
+
+    @api.model
+    def _processing_timeout(self):
+        """
+        Segundos que un job puede estar en 'processing' antes de darlo por caído:
+        queue.max_llm_calls_per_turn llamadas a OpenAI seguidas en el peor caso
+        (cada una con todos sus reintentos y esperas), y nunca menos que
+        queue.processing_timeout_seconds.
+        """
+        max_retries = OPENAI_CONFIG.get('max_retries', 3)
+        per_call = (
+            (max_retries + 1) * OPENAI_CONFIG.get('timeout_seconds', 20)
+            + max_retries * OPENAI_CONFIG.get('backoff_max_seconds', 8)
+        )
+        worst_turn = QUEUE_CONFIG.get('max_llm_calls_per_turn', 6) * per_call
+        return max(QUEUE_CONFIG.get('processing_timeout_seconds', 300), worst_turn)
+
+    @api.model
+    def _requeue_stalled_jobs(self):
+        """
+        Los jobs que quedaron en 'processing' por un worker caído o colgado
+        cuentan como un intento fallido: vuelven a la cola con backoff o, si ya
+        agotaron queue.max_attempts, pasan a 'dead'. Un mensaje que tira abajo
+        al worker cada vez no se reintenta para siempre.
+        """
+        timeout = self._processing_timeout()
+        stalled = self.search([
+            ('state', '=', 'processing'),
+            ('started_at', '<', fields.Datetime.now() - timedelta(seconds=timeout)),
+        ])
+        if stalled:
+            _logger.warning(f"⏱️ {len(stalled)} jobs colgados en 'processing' por más de {timeout}s.")
+            for job in stalled:
+                job._mark_failed(f"Sin terminar tras {timeout}s en proceso (worker caído o colgado).")
+            self._commit()
+
+    @api.model
+    def _gc_finished_jobs(self):
+        retention_days = QUEUE_CONFIG.get('retention_days', 7)
+        old_jobs = self.search([
+            ('state', '=', 'done'),
+            ('finished_at', '<', fields.Datetime.now() - timedelta(days=retention_days)),
+        ])
+        if old_jobs:
+            old_jobs.unlink()
+            self._commit()
@@ -0,0 +1,238 @@
+from odoo import models, fields, api
+from collections import Counter
+from datetime import timedelta
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from ..config.config import general_config, prompts_version
+from ..utils.cache import LRUCache
+from ..utils import intent_classifier
+
+_logger = logging.getLogger(__name__)
+
+INTENT_CACHE_CONFIG = general_config.get('intent_cache', {})
+
+# Primer nivel: LRU en memoria de cada proceso. El segundo nivel es la tabla,
+# compartida entre todos los workers.
+_local_cache = LRUCache(
+    max_size=INTENT_CACHE_CONFIG.get('max_entries', 5000),
+    ttl=INTENT_CACHE_CONFIG.get('ttl_seconds', 86400),
+)
+_db_stats = {'hits': 0, 'misses': 0}
+
+# Aciertos por clave contados en memoria; se suman a la tabla cada
+# intent_cache.hits_flush_seconds en una transacción aparte.
+_pending_hits = Counter()
+_hits_lock = threading.Lock()
+_last_hits_flush = [time.monotonic()]
+
+# Modelos locales entrenados, por clasificador. Se releen periódicamente de ir.attachment.
+_local_models = LRUCache(max_size=10, ttl=intent_classifier.CLASSIFIER_CONFIG.get('model_reload_seconds', 600))
+_NO_MODEL = object()
+
+
+def _normalize_turn(text):
+    text = re.sub(r'\s+', ' ', (text or '').lower()).strip()
+    return text.strip('.!¡¿?,; ')
+
+
+class ChatbotIntentCache(models.Model):
+    _name = 'chatbot.intent.cache'
+    _description = 'Cache de clasificación de intenciones del chatbot'
+
+    key = fields.Char(string="Clave", required=True, index=True)
+    intent = fields.Char(string="Intención", required=True)
+    prompt_version = fields.Char(string="Versión de prompts.yml", required=True, index=True)
+    classifier = fields.Char(string="Clasificador", index=True)
+    sample_text = fields.Text(string="Último Mensaje")
+    hits = fields.Integer(string="Aciertos", default=0)
+    expires_at = fields.Datetime(string="Vence", required=True, index=True)
+
+    _sql_constraints = [
+        ('key_unique', 'unique(key)', 'La clave del cache de intenciones debe ser única.')
+    ]
+
+    @api.model
+    def make_key(self, system_prompt, conversation_history):
+        """Hash de (versión de prompts, prompt de sistema, últimos N turnos normalizados)."""
+        window = INTENT_CACHE_CONFIG.get('window_turns', 3)
+        turns = [
+            (turn.get('role'), _normalize_turn(turn.get('content')))
+            for turn in conversation_history[-window:]
+        ]
+        payload = json.dumps([prompts_version, system_prompt, turns], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @api.model
+    def lookup(self, key):
+        if not INTENT_CACHE_CONFIG.get('enabled', True):
+            return None
+        intent = _local_cache.get(key)
+        if intent is not None:
+            return intent
+
+        # Lectura sin bloqueos: las claves más comunes ("hola", "gracias") no
+        # serializan las conversaciones que las comparten.
+        self.env.cr.execute("""
+            SELECT intent FROM chatbot_intent_cache
+             WHERE key = %s AND prompt_version = %s
+               AND expires_at > (now() at time zone 'UTC')
+        """, (key, prompts_version))
+        row = self.env.cr.fetchone()
+        if not row:
+            _db_stats['misses'] += 1
+            return None
+        _db_stats['hits'] += 1
+        _local_cache.set(key, row[0])
+        with _hits_lock:
+            _pending_hits[key] += 1
+            due = time.monotonic() - _last_hits_flush[0] >= INTENT_CACHE_CONFIG.get('hits_flush_seconds', 60)
+        if due:
+            self.flush_hits()
+        return row[0]
+
+    @api.model
+    def flush_hits(self):
+        """
+        Suma a la tabla los aciertos contados en memoria, en una transacción
+        corta aparte que saltea las filas bloqueadas (los aciertos son informativos).
+        """
+        with _hits_lock:
+            pending = sorted(_pending_hits.items())
+            _pending_hits.clear()
+            _last_hits_flush[0] = time.monotonic()
+        if not pending:
+            return
+        values = ', '.join(["(%s, %s::int)"] * len(pending))
+        params = [value for key, hits in pending for value in (key, hits)]
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute(f"""
+                    WITH counted(key, hits) AS (VALUES {values}),
+                    locked AS (
+                        SELECT cache.id, counted.hits
+                          FROM chatbot_intent_cache cache
+                          JOIN counted USING (key)
+                      ORDER BY cache.id
+                           FOR UPDATE OF cache SKIP LOCKED
+                    )
+                    UPDATE chatbot_intent_cache cache
+                       SET hits = cache.hits + locked.hits
+                      FROM locked
+                     WHERE cache.id = locked.id
+                """, params)
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudieron registrar los aciertos del cache de intenciones: {e}")
+
+    @api.model
+    def store(self, key, intent, sample_text=None, classifier=None):
+        if not INTENT_CACHE_CONFIG.get('enabled', True):
+            return
+        _local_cache.set(key, intent)
+        expires_at = fields.Datetime.now() + timedelta(seconds=INTENT_CACHE_CONFIG.get('ttl_seconds', 86400))
+        # En una transacción corta propia: la fila no queda bloqueada hasta el final del turno.
+        # Si falla, el turno sigue: la intención ya está clasificada y solo se pierde el cacheo.
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute("""
+                    INSERT INTO chatbot_intent_cache
+                           (key, intent, prompt_version, classifier, sample_text, hits, expires_at,
+                            create_uid, write_uid, create_date, write_date)
+                    VALUES (%s, %s, %s, %s, %s, 0, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')
+               ON CONFLICT (key) DO UPDATE
+                       SET intent = EXCLUDED.intent,
+                           prompt_version = EXCLUDED.prompt_version,
+                           classifier = EXCLUDED.classifier,
+                           sample_text = EXCLUDED.sample_text,
+                           expires_at = EXCLUDED.expires_at,
+                           write_date = EXCLUDED.write_date
+                """, (key, intent, prompts_version, classifier, sample_text, expires_at, self.env.uid, self.env.uid))
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudo guardar la intención en el cache: {e}")
+
+    @api.model
+    def get_stats(self):
+        return {
+            'local': _local_cache.stats(),
+            'db_hits': _db_stats['hits'],
+            'db_misses': _db_stats['misses'],
+            'local_classifier': intent_classifier.get_stats(),
+        }
+
+    @api.model
+    def purge_stale_entries(self):
+        """Borra entradas vencidas o generadas con otra versión de prompts.yml. Lo llama un cron."""
+        self.flush_hits()
+        self.env.cr.execute("""
+            DELETE FROM chatbot_intent_cache
+             WHERE expires_at <= (now() at time zone 'UTC') OR prompt_version != %s
+        """, (prompts_version,))
+        if self.env.cr.rowcount:
+            _logger.info(f"🗑️ Cache de intenciones: {self.env.cr.rowcount} entradas vencidas eliminadas.")
+        _logger.info(f"📊 Cache de intenciones: {self.get_stats()}")
+
+    # --- Clasificador local (ver utils/intent_classifier.py) ---
+
+    def _model_attachment_name(self, classifier):
+        return f"chatbot_intent_model_{classifier}.json"
+
+    @api.model
+    def get_local_model(self, classifier):
+        """Devuelve el modelo local entrenado para `classifier`, o None si no hay."""
+        model = _local_models.get(classifier)
+        if model is None:
+            attachment = self.env['ir.attachment'].sudo().search([
+                ('res_model', '=', self._name),
+                ('name', '=', self._model_attachment_name(classifier)),
+            ], limit=1)
+            model = _NO_MODEL
+            if attachment:
+                try:
+                    model = intent_classifier.LocalIntentModel(json.loads(attachment.raw))
+                except (ValueError, KeyError) as e:
+                    _logger.error(f"❌ Modelo local de intenciones '{classifier}' inválido: {e}")
+            _local_models.set(classifier, model)
+        return None if model is _NO_MODEL else model
+
+    @api.model
+    def train_local_classifiers(self):
+        """
+        Entrena el clasificador local de cada tipo de prompt con las intenciones
+        que ya resolvió OpenAI. Lo llama un cron.
+        """
+        min_samples = intent_classifier.CLASSIFIER_CONFIG.get('min_training_samples', 200)
+        self.env.cr.execute("""
+            SELECT classifier, sample_text, intent
+              FROM chatbot_intent_cache
+             WHERE classifier IS NOT NULL AND sample_text IS NOT NULL
+               AND prompt_version = %s
+        """, (prompts_version,))
+        samples_by_classifier = {}
+        for classifier, text, intent in self.env.cr.fetchall():
+            samples_by_classifier.setdefault(classifier, []).append((text, intent))
+
+        Attachment = self.env['ir.attachment'].sudo()
+        for classifier, samples in samples_by_classifier.items():
+            if len(samples) < min_samples:
+                _logger.info(f"🧪 Clasificador '{classifier}': {len(samples)} ejemplos, se necesitan {min_samples}.")
+                continue
+            try:
+                data = intent_classifier.train(samples)
+            except ValueError as e:
+                _logger.warning(f"⚠️ No se pudo entrenar el clasificador '{classifier}': {e}")
+                continue
+            if not data:
+                continue
+            name = self._model_attachment_name(classifier)
+            raw = json.dumps(data).encode('utf-8')
+            attachment = Attachment.search([('res_model', '=', self._name), ('name', '=', name)], limit=1)
+            if attachment:
+                attachment.write({'raw': raw})
+            else:
+                Attachment.create({'name': name, 'res_model': self._name, 'raw': raw, 'mimetype': 'application/json'})
+            _local_models.pop(classifier)
+            _logger.info(f"🧪 Clasificador '{classifier}' entrenado: {data['metrics']}")
@@ -0,0 +1,94 @@
+from odoo import models, fields, api
+from datetime import timedelta
+import logging
+
+from ..config.config import general_config
+from ..utils import metrics
+
+_logger = logging.getLogger(__name__)
+
+LEDGER_CONFIG = general_config.get('llm_ledger', {})
+
+OUTCOMES = [('ok', 'OK'), ('error', 'Error')]
+
+
+class ChatbotLlmCall(models.Model):
+    _name = 'chatbot.llm.call'
+    _description = 'Llamada a OpenAI del chatbot'
+    _order = 'called_at desc'
+    _log_access = False
+
+    called_at = fields.Datetime(string="Fecha", required=True, index=True, readonly=True)
+    task = fields.Char(string="Tarea", required=True, readonly=True)
+    model = fields.Char(string="Modelo", readonly=True)
+    intent = fields.Char(string="Intención", readonly=True)
+    # Sin FK a res.partner: las filas se escriben con un cursor propio antes de
+    # que el turno haga commit, y el contacto puede haberse creado en ese turno.
+    partner_ref = fields.Integer(string="ID Contacto", index=True, readonly=True)
+    partner_name = fields.Char(string="Contacto", readonly=True)
+    outcome = fields.Selection(OUTCOMES, string="Resultado", readonly=True)
+    error = fields.Char(string="Error", readonly=True)
+    attempts = fields.Integer(string="Intentos", readonly=True)
+    latency_ms = fields.Integer(string="Latencia (ms)", aggregator='avg', readonly=True)
+    estimated_prompt_tokens = fields.Integer(string="Tokens Prompt Estimados", readonly=True)
+    prompt_tokens = fields.Integer(string="Tokens Prompt", readonly=True)
+    completion_tokens = fields.Integer(string="Tokens Respuesta", readonly=True)
+    cost = fields.Float(string="Costo", digits=(16, 6), readonly=True)
+
+    @api.model
+    def rollup_daily(self):
+        """
+        Recalcula el resumen diario (chatbot.llm.call.daily) desde el último día
+        resumido hasta ayer y borra las llamadas más viejas que
+        llm_ledger.retention_days, que ya están resumidas. Lo llama un cron.
+        """
+        metrics.ledger_writer.flush(self.env)
+        today = fields.Date.context_today(self)
+        self.env.cr.execute("SELECT MAX(date) FROM chatbot_llm_call_daily")
+        start = self.env.cr.fetchone()[0]
+        if not start:
+            self.env.cr.execute("SELECT MIN(called_at)::date FROM chatbot_llm_call")
+            start = self.env.cr.fetchone()[0] or today
+
+        # El último día resumido se recalcula: pudo recibir filas que estaban en el buffer.
+        self.env.cr.execute("DELETE FROM chatbot_llm_call_daily WHERE date >= %s", (start,))
+        self.env.cr.execute("""
+            INSERT INTO chatbot_llm_call_daily
+                   (date, task, model, intent, call_count, error_count, prompt_tokens,
+                    completion_tokens, cost, latency_avg_ms, latency_p95_ms)
+            SELECT called_at::date, task, model, intent, count(*),
+                   count(*) FILTER (WHERE outcome = 'error'),
+                   sum(prompt_tokens), sum(completion_tokens), sum(cost), avg(latency_ms),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)
+              FROM chatbot_llm_call
+             WHERE called_at >= %s AND called_at < %s
+          GROUP BY called_at::date, task, model, intent
+        """, (start, today))
+        _logger.info(f"📒 Resumen diario de llamadas a OpenAI: {self.env.cr.rowcount} filas desde {start}.")
+
+        retention_days = LEDGER_CONFIG.get('retention_days', 90)
+        self.env.cr.execute(
+            "DELETE FROM chatbot_llm_call WHERE called_at < %s",
+            (today - timedelta(days=retention_days),),
+        )
+        self.invalidate_model()
+        self.env['chatbot.llm.call.daily'].invalidate_model()
+
+
+class ChatbotLlmCallDaily(models.Model):
+    _name = 'chatbot.llm.call.daily'
+    _description = 'Resumen diario de llamadas a OpenAI del chatbot'
+    _order = 'date desc, cost desc'
+    _log_access = False
+
+    date = fields.Date(string="Día", required=True, index=True, readonly=True)
+    task = fields.Char(string="Tarea", readonly=True)
+    model = fields.Char(string="Modelo", readonly=True)
+    intent = fields.Char(string="Intención", readonly=True)
+    call_count = fields.Integer(string="Llamadas", readonly=True)
+    error_count = fields.Integer(string="Errores", readonly=True)
+    prompt_tokens = fields.Integer(string="Tokens Prompt", readonly=True)
+    completion_tokens = fields.Integer(string="Tokens Respuesta", readonly=True)
+    cost = fields.Float(string="Costo", digits=(16, 6), readonly=True)
+    latency_avg_ms = fields.Float(string="Latencia Promedio (ms)", aggregator='avg', readonly=True)
+    latency_p95_ms = fields.Float(string="Latencia p95 (ms)", aggregator='max', readonly=True)
\ No newline at end of file
@@ -0,0 +1,117 @@
+from odoo import models, fields, api
+from datetime import timedelta
+import logging
+
+from ..config.config import general_config
+from ..utils import metrics
+
+_logger = logging.getLogger(__name__)
+
+METRICS_CONFIG = general_config.get('metrics', {})
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _labels(**values):
+    """Etiquetas de una muestra de Prometheus, con los valores escapados."""
+    escaped = {
+        key: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for key, value in values.items()
+    }
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped.items()) + '}'
+
+
+class ChatbotMetricSpan(models.Model):
+    _name = 'chatbot.metric.span'
+    _description = 'Duración de las etapas del chatbot'
+    _order = 'recorded_at desc'
+    _log_access = False
+
+    stage = fields.Char(string="Etapa", required=True)
+    intent = fields.Char(string="Intención")
+    duration_ms = fields.Float(string="Duración (ms)")
+    recorded_at = fields.Datetime(string="Registrado", required=True, index=True)
+
+    @api.model
+    def get_stage_percentiles(self, window_minutes=None):
+        """
+        Percentiles de duración por etapa y por etapa e intención, en la ventana
+        de metrics.window_minutes. Las filas con intent None son el total de la etapa.
+        """
+        metrics.span_writer.flush(self.env)
+        window_minutes = window_minutes or METRICS_CONFIG.get('window_minutes', 60)
+        quantile_columns = ', '.join(
+            f"percentile_cont({q}) WITHIN GROUP (ORDER BY duration_ms)" for q in QUANTILES
+        )
+        self.env.cr.execute(f"""
+            SELECT stage, GROUPING(intent) = 1 AS is_total, COALESCE(intent, 'ninguna'),
+                   {quantile_columns}, count(*), sum(duration_ms)
+              FROM chatbot_metric_span
+             WHERE recorded_at > (now() at time zone 'UTC') - make_interval(mins => %s)
+          GROUP BY GROUPING SETS ((stage, intent), (stage))
+          ORDER BY stage, is_total DESC, 3
+        """, (window_minutes,))
+        rows = []
+        for stage, is_total, intent, *values in self.env.cr.fetchall():
+            quantiles, (count, total_ms) = values[:len(QUANTILES)], values[len(QUANTILES):]
+            rows.append({
+                'stage': stage,
+                'intent': None if is_total else intent,
+                'quantiles': dict(zip(QUANTILES, quantiles)),
+                'count': count,
+                'sum_ms': total_ms or 0.0,
+            })
+        return rows
+
+    @api.model
+    def render_prometheus(self):
+        """
+        Métricas del chatbot en el formato de texto de Prometheus. Todas son
+        gauges: los valores por etapa se calculan sobre la ventana de
+        metrics.window_minutes y bajan cuando los spans salen de ella, así que
+        no pueden publicarse como summary (su _count y _sum deben ser acumulados).
+        """
+        window = METRICS_CONFIG.get('window_minutes', 60)
+        quantiles = [
+            f'# HELP chatbot_stage_duration_seconds Percentiles de duración de cada etapa del turno en los últimos {window} minutos (intent="all": todas las intenciones).',
+            '# TYPE chatbot_stage_duration_seconds gauge',
+        ]
+        counts = [
+            f'# HELP chatbot_stage_window_spans Etapas medidas en los últimos {window} minutos.',
+            '# TYPE chatbot_stage_window_spans gauge',
+        ]
+        sums = [
+            f'# HELP chatbot_stage_window_seconds Duración sumada de las etapas medidas en los últimos {window} minutos.',
+            '# TYPE chatbot_stage_window_seconds gauge',
+        ]
+        for row in self.get_stage_percentiles():
+            labels = {'stage': row['stage'], 'intent': row['intent'] or 'all'}
+            for quantile, value in row['quantiles'].items():
+                quantiles.append(f"chatbot_stage_duration_seconds{_labels(**labels, quantile=quantile)} {value / 1000:.6f}")
+            counts.append(f"chatbot_stage_window_spans{_labels(**labels)} {row['count']}")
+            sums.append(f"chatbot_stage_window_seconds{_labels(**labels)} {row['sum_ms'] / 1000:.6f}")
+        lines = quantiles + counts + sums
+
+        inbound = self.env['chatbot.whatsapp.inbound.job'].get_queue_metrics()
+        outbound = self.env['chatbot.whatsapp.outbound'].get_queue_metrics()
+        gauges = [
+            ('chatbot_inbound_queue_depth', 'Mensajes entrantes pendientes de procesar.', inbound['depth']),
+            ('chatbot_inbound_queue_processing', 'Mensajes entrantes en proceso.', inbound['processing']),
+            ('chatbot_inbound_queue_lag_seconds', 'Antigüedad del mensaje entrante pendiente más viejo.', inbound['lag_seconds']),
+            ('chatbot_outbound_queue_depth', 'Respuestas pendientes de envío.', outbound['depth']),
+            ('chatbot_outbound_queue_lag_seconds', 'Antigüedad de la respuesta pendiente más vieja.', outbound['lag_seconds']),
+        ]
+        for name, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    @api.model
+    def purge_old_spans(self):
+        """Borra los spans más viejos que metrics.retention_days. Lo llama un cron."""
+        metrics.span_writer.flush(self.env)
+        retention_days = METRICS_CONFIG.get('retention_days', 14)
+        self.env.cr.execute(
+            "DELETE FROM chatbot_metric_span WHERE recorded_at < %s",
+            (fields.Datetime.now() - timedelta(days=retention_days),),
+        )
+        _logger.info(f"🧹 Spans de métricas purgados: {self.env.cr.rowcount}.")
\ No newline at end of file
@@ -0,0 +1,228 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+from datetime import timedelta
+import logging
+import threading
+
+from ..config.config import general_config
+from ..utils import metrics
+
+_logger = logging.getLogger(__name__)
+
+OUTBOUND_CONFIG = general_config.get('outbound', {})
+
+
+class WhatsAppOutboundMessage(models.Model):
+    _name = 'chatbot.whatsapp.outbound'
+    _description = 'Cola de mensajes salientes del chatbot de WhatsApp'
+    _order = 'id'
+
+    mobile_number = fields.Char(string="Teléfono", required=True, index=True)
+    wa_account_id = fields.Many2one('whatsapp.account', string="Cuenta de WhatsApp", ondelete='cascade')
+    channel_id = fields.Many2one('discuss.channel', string="Canal", ondelete='set null')
+    body = fields.Text(string="Mensaje", required=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('sent', 'Enviado'),
+        ('merged', 'Agrupado'),
+        ('dead', 'Descartado'),
+    ], string="Estado", default='pending', required=True, index=True)
+    attempts = fields.Integer(string="Intentos", default=0)
+    last_error = fields.Text(string="Último Error")
+    message_id = fields.Many2one('whatsapp.message', string="Mensaje de WhatsApp", ondelete='set null')
+    merged_into_id = fields.Many2one('chatbot.whatsapp.outbound', string="Agrupado en", ondelete='cascade', index=True)
+    merged_message_ids = fields.One2many('chatbot.whatsapp.outbound', 'merged_into_id', string="Mensajes Agrupados")
+
+    # Tiempos
+    enqueued_at = fields.Datetime(string="Encolado", default=fields.Datetime.now, required=True)
+    next_attempt_at = fields.Datetime(string="Próximo Intento", default=fields.Datetime.now)
+    sent_at = fields.Datetime(string="Enviado")
+
+    def init(self):
+        # El despachador solo mira los mensajes pendientes, en orden por teléfono.
+        create_index(
+            self.env.cr, 'chatbot_whatsapp_outbound_phone_pending_idx', self._table,
+            ['mobile_number', 'id'], where="state = 'pending'",
+        )
+
+    @api.model
+    def enqueue(self, record, body, log_in_channel=True):
+        """
+        Encola una respuesta al remitente de `record` (el whatsapp.message
+        entrante) con un único INSERT y despierta al despachador. El envío a la
+        API de WhatsApp y el registro en el canal se hacen fuera del turno.
+        """
+        if not body:
+            return self.browse()
+        channel_id = False
+        mail_message = record.mail_message_id
+        if log_in_channel and mail_message and mail_message.model == 'discuss.channel' and mail_message.res_id:
+            channel_id = mail_message.res_id
+        outbound = self.sudo().create({
+            'mobile_number': record.mobile_number,
+            'wa_account_id': record.wa_account_id.id,
+            'channel_id': channel_id,
+            'body': body,
+        })
+        _logger.info(f"📮 Respuesta {outbound.id} encolada para {record.mobile_number}.")
+        self.env.ref('chatbot_whatsapp.ir_cron_chatbot_dispatch_outbound').sudo()._trigger()
+        return outbound
+
+    @api.model
+    def dispatch_pending(self, limit=None, auto_commit=None):
+        """
+        Despachador de la cola, llamado por el cron. Envía los mensajes en orden
+        por teléfono y confirma cada envío en su propia transacción.
+        """
+        if auto_commit is None:
+            auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        limit = limit or OUTBOUND_CONFIG.get('batch_size', 50)
+        sent = 0
+        while sent < limit:
+            outbound = self._claim_next()
+            if not outbound:
+                break
+            with metrics.collect(self.env, stage='outbound_send'):
+                outbound._dispatch()
+            if auto_commit:
+                self.env.cr.commit()
+            sent += 1
+        if sent:
+            _logger.info(f"📬 Despachador de respuestas: {sent} mensajes procesados.")
+        metrics.flush_all(self.env)
+        self._gc_sent_messages(auto_commit)
+        return sent
+
+    def _claim_next(self):
+        """
+        Toma el próximo mensaje listo. Como en la cola de entrada, SKIP LOCKED
+        permite varios despachadores y nunca se adelanta a un mensaje anterior
+        del mismo teléfono que todavía espera su reintento.
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT msg.id FROM chatbot_whatsapp_outbound msg
+             WHERE msg.state = 'pending'
+               AND msg.next_attempt_at <= %s
+               AND NOT EXISTS (
+                    SELECT 1 FROM chatbot_whatsapp_outbound prev
+                     WHERE prev.mobile_number = msg.mobile_number
+                       AND prev.id < msg.id
+                       AND prev.state = 'pending')
+          ORDER BY msg.id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """, (fields.Datetime.now(),))
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        outbound = self.browse(row[0])
+        if OUTBOUND_CONFIG.get('merge_consecutive', True):
+            outbound._absorb_consecutive()
+        return outbound
+
+    def _absorb_consecutive(self):
+        """
+        Junta en este mensaje los siguientes pendientes al mismo teléfono (p. ej.
+        las respuestas de un pedido con varios productos), sin pasar el largo
+        máximo de un mensaje de WhatsApp.
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT id, body FROM chatbot_whatsapp_outbound
+             WHERE mobile_number = %s AND state = 'pending' AND id > %s
+               AND COALESCE(wa_account_id, 0) = %s
+          ORDER BY id
+               FOR UPDATE SKIP LOCKED
+        """, (self.mobile_number, self.id, self.wa_account_id.id or 0))
+        separator = OUTBOUND_CONFIG.get('merge_separator', '\n\n')
+        max_chars = OUTBOUND_CONFIG.get('merge_max_chars', 4000)
+        body = self.body
+        merged_ids = []
+        for outbound_id, next_body in self.env.cr.fetchall():
+            if len(body) + len(separator) + len(next_body) > max_chars:
+                break
+            body += separator + next_body
+            merged_ids.append(outbound_id)
+        if merged_ids:
+            merged = self.browse(merged_ids)
+            _logger.info(f"🧩 Agrupando {len(merged)} respuestas para {self.mobile_number} en el mensaje {self.id}.")
+            self.write({'body': body, 'channel_id': self.channel_id.id or merged.channel_id[:1].id})
+            merged.write({'state': 'merged', 'merged_into_id': self.id})
+
+    def _dispatch(self):
+        """
+        Registra el mensaje en el canal y lo envía a la API de WhatsApp. Si algo
+        falla se deshacen ambos y el mensaje queda para un reintento con backoff.
+        """
+        self.ensure_one()
+        self.attempts += 1
+        try:
+            with self.env.cr.savepoint():
+                if self.channel_id:
+                    self.channel_id.with_context(from_wa_bot=True).message_post(
+                        body=self.body,
+                        message_type='comment',
+                        subtype_xmlid='mail.mt_comment'
+                    )
+                self._send_to_whatsapp()
+        except Exception as e:
+            _logger.error(f"❌ Error enviando la respuesta {self.id} (intento {self.attempts}): {e}", exc_info=True)
+            self._mark_failed(str(e))
+        else:
+            now = fields.Datetime.now()
+            self.write({'state': 'sent', 'sent_at': now, 'last_error': False})
+            self.merged_message_ids.write({'sent_at': now})
+
+    def _send_to_whatsapp(self):
+        # Un único create con el cuerpo final; si el envío falla, el savepoint lo descarta.
+        self.message_id = self.env['whatsapp.message'].sudo().create({
+            'mobile_number': self.mobile_number,
+            'body': self.body,
+            'state': 'outgoing',
+            'wa_account_id': self.wa_account_id.id,
+            'create_uid': self.env.ref('base.user_admin').id,
+        })
+        self.message_id._send_message()
+        if self.message_id.state in ('error', 'bounced'):
+            # _send_message() no lanza los errores de la API: los deja en el mensaje.
+            raise UserError(self.message_id.failure_reason or f"Envío fallido ({self.message_id.failure_type})")
+
+    def _mark_failed(self, error):
+        max_attempts = OUTBOUND_CONFIG.get('max_attempts', 5)
+        vals = {'last_error': error}
+        if self.attempts >= max_attempts:
+            _logger.warning(f"☠️ Respuesta {self.id} para {self.mobile_number} descartada tras {self.attempts} intentos.")
+            vals['state'] = 'dead'
+        else:
+            delay = OUTBOUND_CONFIG.get('retry_backoff_seconds', 10) * (2 ** (self.attempts - 1))
+            vals['next_attempt_at'] = fields.Datetime.now() + timedelta(seconds=delay)
+            self.env.ref('chatbot_whatsapp.ir_cron_chatbot_dispatch_outbound').sudo()._trigger(
+                at=vals['next_attempt_at']
+            )
+        self.write(vals)
+
+    @api.model
+    def get_queue_metrics(self):
+        """Mensajes pendientes de envío y antigüedad del más viejo."""
+        self.env.cr.execute("""
+            SELECT count(*),
+                   EXTRACT(EPOCH FROM (now() at time zone 'UTC') - min(enqueued_at))
+              FROM chatbot_whatsapp_outbound
+             WHERE state = 'pending'
+        """)
+        depth, lag = self.env.cr.fetchone()
+        return {'depth': depth or 0, 'lag_seconds': float(lag or 0.0)}
+
+    @api.model
+    def _gc_sent_messages(self, auto_commit=True):
+        retention_days = OUTBOUND_CONFIG.get('retention_days', 7)
+        old_messages = self.search([
+            ('state', 'in', ('sent', 'merged')),
+            ('enqueued_at', '<', fields.Datetime.now() - timedelta(days=retention_days)),
+        ])
+        if old_messages:
+            old_messages.unlink()
+            if auto_commit:
+                self.env.cr.commit()
\ No newline at end of file
@@ -0,0 +1,186 @@
+from odoo import models, fields, api
+import logging
+
+from ..config.config import general_config
+
+_logger = logging.getLogger(__name__)
+
+AFFINITY_CONFIG = general_config.get('purchase_affinity', {})
+
+# Compras confirmadas del contacto: una fila por (contacto, variante, pedido).
+# Las órdenes de venta cuentan al confirmarse; las de punto de venta, al pagarse.
+_PURCHASES_SQL = """
+    SELECT so.partner_id, sol.product_id, so.id AS order_id, 'sale.order,' || so.id AS order_ref,
+           MAX(so.date_order) AS order_date, SUM(sol.product_uom_qty) AS qty
+      FROM sale_order_line sol
+      JOIN sale_order so ON so.id = sol.order_id
+     WHERE so.state = 'sale' AND sol.product_id IS NOT NULL AND sol.product_uom_qty > 0
+       AND so.partner_id IN %(partner_ids)s
+  GROUP BY so.partner_id, sol.product_id, so.id
+ UNION ALL
+    SELECT po.partner_id, pol.product_id, po.id AS order_id, 'pos.order,' || po.id AS order_ref,
+           MAX(po.date_order) AS order_date, SUM(pol.qty) AS qty
+      FROM pos_order_line pol
+      JOIN pos_order po ON po.id = pol.order_id
+     WHERE po.state IN ('paid', 'done', 'invoiced') AND pol.qty > 0
+       AND po.partner_id IN %(partner_ids)s
+  GROUP BY po.partner_id, pol.product_id, po.id
+"""
+
+
+class ChatbotPartnerAffinity(models.Model):
+    _name = 'chatbot.partner.affinity'
+    _description = 'Historial de compras por contacto y variante para el chatbot'
+    _order = 'partner_id, last_date desc'
+
+    partner_id = fields.Many2one('res.partner', string="Contacto", required=True, ondelete='cascade')
+    product_id = fields.Many2one('product.product', string="Variante", required=True, ondelete='cascade')
+    product_tmpl_id = fields.Many2one('product.template', string="Producto", ondelete='cascade')
+    categ_id = fields.Many2one('product.category', string="Categoría", ondelete='set null')
+    order_count = fields.Integer(string="Pedidos")
+    total_qty = fields.Float(string="Cantidad Total")
+    last_qty = fields.Float(string="Última Cantidad")
+    last_date = fields.Datetime(string="Última Compra")
+    last_order_ref = fields.Char(string="Último Pedido")
+
+    _sql_constraints = [
+        ('partner_product_unique', 'unique(partner_id, product_id)', 'La variante ya tiene historial para este contacto.')
+    ]
+
+    def init(self):
+        # El índice único (partner_id, product_id) resuelve las lecturas por contacto.
+        self.env.cr.execute("SELECT 1 FROM chatbot_partner_affinity LIMIT 1")
+        if not self.env.cr.fetchone():
+            self.rebuild_affinity()
+
+    @api.model
+    def rebuild_affinity(self):
+        """
+        Recalcula el historial de todos los contactos con compras, de a
+        purchase_affinity.rebuild_batch_size contactos por consulta. Lo llama un
+        cron como respaldo de las actualizaciones incrementales.
+        """
+        self.env.cr.execute("""
+            SELECT partner_id FROM sale_order WHERE state = 'sale'
+             UNION
+            SELECT partner_id FROM pos_order WHERE partner_id IS NOT NULL
+             UNION
+            SELECT partner_id FROM chatbot_partner_affinity
+        """)
+        partner_ids = sorted(row[0] for row in self.env.cr.fetchall())
+        batch_size = AFFINITY_CONFIG.get('rebuild_batch_size', 1000)
+        for start in range(0, len(partner_ids), batch_size):
+            self._refresh_partner_ids(partner_ids[start:start + batch_size])
+        _logger.info(f"🛍️ Historial de compras recalculado para {len(partner_ids)} contactos.")
+
+    @api.model
+    def refresh_partners(self, partners):
+        """Recalcula el historial de los contactos indicados (p. ej. al confirmar una orden)."""
+        if partners:
+            self._refresh_partner_ids(partners.ids)
+
+    @api.model
+    def _refresh_partner_ids(self, partner_ids):
+        params = {'partner_ids': tuple(partner_ids), 'uid': self.env.uid}
+        # La consulta lee las órdenes directo de la base: primero se escriben los cambios pendientes.
+        for model in ('sale.order', 'sale.order.line', 'pos.order', 'pos.order.line'):
+            self.env[model].flush_model()
+        self.env.cr.execute("DELETE FROM chatbot_partner_affinity WHERE partner_id IN %(partner_ids)s", params)
+        self.env.cr.execute(f"""
+            WITH purchases AS ({_PURCHASES_SQL}),
+            ranked AS (
+                SELECT *,
+                       row_number() OVER w_last AS position,
+                       count(*) OVER w_all AS order_count,
+                       sum(qty) OVER w_all AS total_qty
+                  FROM purchases
+                WINDOW w_last AS (PARTITION BY partner_id, product_id ORDER BY order_date DESC, order_id DESC),
+                       w_all AS (PARTITION BY partner_id, product_id)
+            )
+            INSERT INTO chatbot_partner_affinity
+                   (partner_id, product_id, product_tmpl_id, categ_id, order_count, total_qty, last_qty,
+                    last_date, last_order_ref, create_uid, write_uid, create_date, write_date)
+            SELECT r.partner_id, r.product_id, pp.product_tmpl_id, pt.categ_id, r.order_count, r.total_qty, r.qty,
+                   r.order_date, r.order_ref, %(uid)s, %(uid)s, now() at time zone 'UTC', now() at time zone 'UTC'
+              FROM ranked r
+              JOIN product_product pp ON pp.id = r.product_id
+              JOIN product_template pt ON pt.id = pp.product_tmpl_id
+             WHERE r.position = 1 AND pt.type <> 'service'
+        """, params)
+        self.invalidate_model()
+
+    @api.model
+    def _partner_ids(self, partner):
+        # Las compras pueden estar a nombre del contacto o de su empresa.
+        return tuple((partner | partner.commercial_partner_id).ids)
+
+    @api.model
+    def preferred_variants(self, partner, candidate_ids):
+        """
+        Entre las variantes candidatas de cada consulta (listas de ids), la que
+        el contacto ya compró, si es una elección confiable: la única con
+        historial, o la más reciente si se pidió al menos
+        purchase_affinity.min_orders veces. Una sola lectura para todas las
+        consultas. Devuelve {índice de la consulta: product_id}.
+        """
+        all_ids = {product_id for ids in candidate_ids for product_id in ids}
+        if not partner or not all_ids:
+            return {}
+        self.env.cr.execute("""
+            SELECT product_id, SUM(order_count), MAX(last_date)
+              FROM chatbot_partner_affinity
+             WHERE partner_id IN %s AND product_id IN %s
+          GROUP BY product_id
+        """, (self._partner_ids(partner), tuple(all_ids)))
+        history = {product_id: (count, last_date) for product_id, count, last_date in self.env.cr.fetchall()}
+
+        min_orders = AFFINITY_CONFIG.get('min_orders', 2)
+        preferred = {}
+        for index, ids in enumerate(candidate_ids):
+            bought = sorted((history[pid][1], pid) for pid in ids if pid in history)
+            if not bought:
+                continue
+            product_id = bought[-1][1]
+            if len(bought) == 1 or history[product_id][0] >= min_orders:
+                preferred[index] = product_id
+        return preferred
+
+    @api.model
+    def last_order_lines(self, partner):
+        """[(product_id, cantidad)] del último pedido confirmado del contacto, en una sola consulta."""
+        self.env.cr.execute("""
+            SELECT product_id, last_qty
+              FROM chatbot_partner_affinity
+             WHERE partner_id IN %(partner_ids)s
+               AND last_order_ref = (
+                       SELECT last_order_ref FROM chatbot_partner_affinity
+                        WHERE partner_id IN %(partner_ids)s
+                     ORDER BY last_date DESC, last_order_ref DESC
+                        LIMIT 1)
+          ORDER BY product_id
+        """, {'partner_ids': self._partner_ids(partner)})
+        return self.env.cr.fetchall()
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    def action_confirm(self):
+        res = super().action_confirm()
+        self.env['chatbot.partner.affinity'].sudo().refresh_partners(self.partner_id)
+        return res
+
+    def _action_cancel(self):
+        partners = self.filtered(lambda order: order.state == 'sale').partner_id
+        res = super()._action_cancel()
+        self.env['chatbot.partner.affinity'].sudo().refresh_partners(partners)
+        return res
+
+
+class PosOrder(models.Model):
+    _inherit = 'pos.order'
+
+    def action_pos_order_paid(self):
+        res = super().action_pos_order_paid()
+        self.env['chatbot.partner.affinity'].sudo().refresh_partners(self.partner_id)
+        return res
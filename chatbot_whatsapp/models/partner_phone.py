@@ -0,0 +1,117 @@
+from odoo import models, fields, api
+import logging
+
+from ..utils.utils import phone_variants, sanitize_for_search
+
+_logger = logging.getLogger(__name__)
+
+# Campos del contacto que cambian sus números indexados.
+PHONE_FIELDS = {'phone', 'mobile', 'country_id', 'active'}
+
+
+class ChatbotPartnerPhone(models.Model):
+    _name = 'chatbot.partner.phone'
+    _description = 'Índice de teléfonos normalizados de contactos'
+    _order = 'number, partner_id'
+
+    number = fields.Char(string="Número Sanitizado", required=True)
+    partner_id = fields.Many2one('res.partner', string="Contacto", required=True, ondelete='cascade', index=True)
+
+    _sql_constraints = [
+        ('number_partner_unique', 'unique(number, partner_id)', 'El número ya está indexado para este contacto.')
+    ]
+
+    def init(self):
+        # El índice único (number, partner_id) es el que resuelve cada búsqueda por número.
+        self.env.cr.execute("SELECT 1 FROM chatbot_partner_phone LIMIT 1")
+        if not self.env.cr.fetchone():
+            self.rebuild_index()
+
+    @api.model
+    def _partner_numbers(self, partner):
+        numbers = set()
+        for value in (partner.phone, partner.mobile, partner.phone_sanitized):
+            numbers |= phone_variants(value)
+        return numbers
+
+    @api.model
+    def rebuild_index(self):
+        """Reconstruye el índice completo. Solo hace falta en la instalación o para reparar."""
+        self.env.cr.execute("DELETE FROM chatbot_partner_phone")
+        partners = self.env['res.partner'].sudo().search(['|', ('phone', '!=', False), ('mobile', '!=', False)])
+        for batch_start in range(0, len(partners), 1000):
+            self._sync_partners(partners[batch_start:batch_start + 1000])
+        _logger.info(f"📇 Índice de teléfonos reconstruido con {len(partners)} contactos.")
+
+    @api.model
+    def _sync_partners(self, partners):
+        """Reemplaza los números indexados de los contactos indicados."""
+        if not partners:
+            return
+        self._forget_partners(partners)
+        rows = [
+            (number, partner.id)
+            for partner in partners.exists().filtered('active')
+            for number in self._partner_numbers(partner)
+        ]
+        if not rows:
+            return
+        values = ', '.join(["(%s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')"] * len(rows))
+        params = [value for number, partner_id in rows for value in (number, partner_id, self.env.uid, self.env.uid)]
+        self.env.cr.execute(f"""
+            INSERT INTO chatbot_partner_phone (number, partner_id, create_uid, write_uid, create_date, write_date)
+            VALUES {values}
+       ON CONFLICT (number, partner_id) DO NOTHING
+        """, params)
+
+    @api.model
+    def _forget_partners(self, partners):
+        self.env.cr.execute("DELETE FROM chatbot_partner_phone WHERE partner_id IN %s", (tuple(partners.ids),))
+
+    @api.model
+    def find_partner(self, phone):
+        """
+        Devuelve el contacto activo asociado al número (en cualquiera de sus
+        variantes), o un recordset vacío. Si varios comparten el número, el más antiguo.
+        """
+        Partner = self.env['res.partner'].sudo()
+        number = sanitize_for_search(phone)
+        if len(number) <= 1:
+            return Partner
+
+        # Una sola lectura por el índice único (number, partner_id), siempre contra
+        # la base: un contacto archivado o un número cambiado se ven enseguida.
+        self.env.cr.execute("""
+            SELECT phone.partner_id FROM chatbot_partner_phone phone
+              JOIN res_partner partner ON partner.id = phone.partner_id
+             WHERE phone.number = %s AND partner.active
+          ORDER BY phone.partner_id
+             LIMIT 1
+        """, (number,))
+        row = self.env.cr.fetchone()
+        if not row:
+            return Partner
+        return Partner.browse(row[0])
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        partners = super().create(vals_list)
+        self.env['chatbot.partner.phone'].sudo()._sync_partners(
+            partners.filtered(lambda p: p.phone or p.mobile)
+        )
+        return partners
+
+    def write(self, vals):
+        res = super().write(vals)
+        if PHONE_FIELDS.intersection(vals):
+            self.env['chatbot.partner.phone'].sudo()._sync_partners(self.with_context(active_test=False))
+        return res
+
+    def unlink(self):
+        if self:
+            self.env['chatbot.partner.phone'].sudo()._forget_partners(self)
+        return super().unlink()
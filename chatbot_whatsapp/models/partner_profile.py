@@ -0,0 +1,228 @@
+from odoo import models, fields, api
+import logging
+
+from ..config.config import general_config
+
+_logger = logging.getLogger(__name__)
+
+PROFILE_CONFIG = general_config.get('partner_profile', {})
+
+CUSTOMER_TYPE_CATEGORY = "Tipo de Cliente"
+B2C_TAG = "Consumidor Final"
+
+# Estados de sale.order que cuentan como cotización previa del cliente.
+QUOTE_STATES = ('draft', 'sent', 'sale', 'cancel')
+
+# Campos del contacto que cambian su perfil.
+PROFILE_FIELDS = {'category_id', 'property_product_pricelist', 'country_id'}
+
+PROFILE_COLUMNS = ('customer_type', 'is_b2c', 'has_quote', 'pricelist_id', 'website_url')
+
+
+class ChatbotPartnerProfile(models.Model):
+    _name = 'chatbot.partner.profile'
+    _description = 'Perfil de ruteo del contacto para el chatbot'
+
+    partner_id = fields.Many2one('res.partner', string="Contacto", required=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string="Compañía", required=True, ondelete='cascade')
+    customer_type = fields.Char(string="Tipo de Cliente", index=True)
+    is_b2c = fields.Boolean(string="Consumidor Final")
+    has_quote = fields.Boolean(string="Cotizado")
+    pricelist_id = fields.Many2one('product.pricelist', string="Lista de Precios", ondelete='set null')
+    website_url = fields.Char(string="Tienda Online")
+
+    _sql_constraints = [
+        ('partner_company_unique', 'unique(partner_id, company_id)',
+         'El contacto ya tiene un perfil para esta compañía.')
+    ]
+
+    @api.model
+    def get_profile(self, partner):
+        """
+        Datos de ruteo del contacto en la compañía actual, como dict con
+        customer_type, is_b2c, has_quote, pricelist_id y website_url. Es una
+        sola lectura; si el perfil todavía no existe se calcula y se guarda.
+        """
+        self.env.cr.execute(f"""
+            SELECT {', '.join(PROFILE_COLUMNS)} FROM chatbot_partner_profile
+             WHERE partner_id = %s AND company_id = %s
+        """, (partner.id, self.env.company.id))
+        row = self.env.cr.fetchone()
+        if row:
+            return dict(zip(PROFILE_COLUMNS, row))
+        return self._refresh(partner)[partner.id]
+
+    @api.model
+    def _website_url(self, customer_type):
+        urls = PROFILE_CONFIG.get('website_urls', {})
+        return urls.get(customer_type) or PROFILE_CONFIG.get('default_website_url', 'https://www.quimicacristal.com.ar')
+
+    @api.model
+    def _quoted_partner_ids(self, partners):
+        """Contactos con alguna cotización u orden de punto de venta, en dos consultas agrupadas."""
+        quoted = {
+            partner.id for partner, in self.env['sale.order'].sudo()._read_group(
+                [('partner_id', 'in', partners.ids), ('state', 'in', QUOTE_STATES)], ['partner_id'],
+            )
+        }
+        quoted |= {
+            partner.id for partner, in self.env['pos.order'].sudo()._read_group(
+                [('partner_id', 'in', partners.ids)], ['partner_id'],
+            )
+        }
+        return quoted
+
+    @api.model
+    def _refresh(self, partners):
+        """Recalcula y guarda el perfil de los contactos en la compañía actual. Devuelve {partner_id: perfil}."""
+        partners = partners.exists().sudo().with_company(self.env.company)
+        if not partners:
+            return {}
+        quoted = self._quoted_partner_ids(partners)
+        profiles = {}
+        for partner in partners:
+            customer_types = partner.category_id.filtered(
+                lambda tag: tag.parent_id.name == CUSTOMER_TYPE_CATEGORY
+            ).mapped('name')
+            customer_type = customer_types[0] if customer_types else None
+            profiles[partner.id] = {
+                'customer_type': customer_type,
+                'is_b2c': B2C_TAG in customer_types,
+                'has_quote': partner.id in quoted,
+                'pricelist_id': partner.property_product_pricelist.id or None,
+                'website_url': self._website_url(customer_type),
+            }
+
+        values = ', '.join(
+            ["(%s, %s, %s, %s, %s, %s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')"] * len(profiles)
+        )
+        params = [
+            value
+            for partner_id, profile in profiles.items()
+            for value in (partner_id, self.env.company.id, *(profile[column] for column in PROFILE_COLUMNS),
+                          self.env.uid, self.env.uid)
+        ]
+        self.env.cr.execute(f"""
+            INSERT INTO chatbot_partner_profile
+                   (partner_id, company_id, {', '.join(PROFILE_COLUMNS)}, create_uid, write_uid, create_date, write_date)
+            VALUES {values}
+       ON CONFLICT (partner_id, company_id) DO UPDATE
+               SET customer_type = EXCLUDED.customer_type,
+                   is_b2c = EXCLUDED.is_b2c,
+                   has_quote = EXCLUDED.has_quote,
+                   pricelist_id = EXCLUDED.pricelist_id,
+                   website_url = EXCLUDED.website_url,
+                   write_date = EXCLUDED.write_date
+        """, params)
+        self.invalidate_model()
+        return profiles
+
+    @api.model
+    def refresh_partners(self, partners):
+        """Recalcula los perfiles ya guardados de los contactos, en todas las compañías."""
+        if not partners:
+            return
+        self.env.cr.execute(
+            "SELECT DISTINCT company_id FROM chatbot_partner_profile WHERE partner_id IN %s", (tuple(partners.ids),)
+        )
+        for (company_id,) in self.env.cr.fetchall():
+            self.with_company(company_id)._refresh(partners)
+
+    @api.model
+    def mark_quoted(self, partners):
+        """Una cotización u orden de punto de venta nueva alcanza para marcar al contacto como cotizado."""
+        if partners:
+            self.env.cr.execute(
+                "UPDATE chatbot_partner_profile SET has_quote = true WHERE partner_id IN %s AND NOT has_quote",
+                (tuple(partners.ids),),
+            )
+            self.invalidate_model(['has_quote'])
+
+    @api.model
+    def invalidate_all(self):
+        # Las listas de precios por defecto y los nombres de las etiquetas afectan a
+        # cualquier contacto: ante un cambio se descartan todos los perfiles.
+        self.env.cr.execute("DELETE FROM chatbot_partner_profile")
+        self.invalidate_model()
+
+
+class ResPartner(models.Model):
+    _inherit = 'res.partner'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if PROFILE_FIELDS.intersection(vals):
+            self.env['chatbot.partner.profile'].sudo().refresh_partners(self)
+        return res
+
+
+class ResPartnerCategory(models.Model):
+    _inherit = 'res.partner.category'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'name', 'parent_id'}.intersection(vals):
+            self.env['chatbot.partner.profile'].sudo().invalidate_all()
+        return res
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        self.env['chatbot.partner.profile'].sudo().mark_quoted(orders.partner_id)
+        return orders
+
+    def write(self, vals):
+        previous_partners = self.partner_id if 'partner_id' in vals else None
+        res = super().write(vals)
+        if previous_partners is not None:
+            Profile = self.env['chatbot.partner.profile'].sudo()
+            Profile.refresh_partners(previous_partners - self.partner_id)
+            Profile.mark_quoted(self.partner_id)
+        return res
+
+    def unlink(self):
+        partners = self.partner_id
+        res = super().unlink()
+        self.env['chatbot.partner.profile'].sudo().refresh_partners(partners)
+        return res
+
+
+class PosOrder(models.Model):
+    _inherit = 'pos.order'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        self.env['chatbot.partner.profile'].sudo().mark_quoted(orders.partner_id)
+        return orders
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'partner_id' in vals:
+            self.env['chatbot.partner.profile'].sudo().mark_quoted(self.partner_id)
+        return res
+
+
+class ProductPricelist(models.Model):
+    _inherit = 'product.pricelist'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        pricelists = super().create(vals_list)
+        self.env['chatbot.partner.profile'].sudo().invalidate_all()
+        return pricelists
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'active', 'sequence', 'company_id', 'country_group_ids'}.intersection(vals):
+            self.env['chatbot.partner.profile'].sudo().invalidate_all()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['chatbot.partner.profile'].sudo().invalidate_all()
+        return res
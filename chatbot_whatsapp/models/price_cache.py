@@ -0,0 +1,253 @@
+from odoo import models, fields, api
+from collections import Counter
+import logging
+import threading
+import time
+
+from ..config.config import general_config
+
+_logger = logging.getLogger(__name__)
+
+PRICE_CACHE_CONFIG = general_config.get('price_cache', {})
+
+# Campos del producto que cambian el resultado de las reglas de precio.
+PRICE_FIELDS = {'list_price', 'lst_price', 'standard_price', 'price_extra', 'product_template_attribute_value_ids'}
+
+# Aciertos del cache contados en memoria de cada proceso: (lista, variante, cantidad, fecha) -> aciertos.
+# Se suman a la tabla cada price_cache.hits_flush_seconds, en una transacción aparte.
+_pending_hits = Counter()
+_hits_lock = threading.Lock()
+_last_hits_flush = [time.monotonic()]
+
+
+class ChatbotPriceCache(models.Model):
+    _name = 'chatbot.price.cache'
+    _description = 'Cache de precios por lista de precios para el chatbot'
+
+    pricelist_id = fields.Many2one('product.pricelist', string="Lista de Precios", required=True, ondelete='cascade')
+    product_id = fields.Many2one('product.product', string="Variante", required=True, ondelete='cascade', index=True)
+    min_qty = fields.Float(string="Cantidad", required=True, default=0.0)
+    date = fields.Date(string="Fecha", required=True, index=True)
+    price = fields.Float(string="Precio", digits='Product Price')
+    hits = fields.Integer(string="Aciertos", default=0)
+
+    _sql_constraints = [
+        ('price_key_unique', 'unique(pricelist_id, product_id, min_qty, date)',
+         'El precio cacheado de una variante debe ser único por lista, cantidad y fecha.')
+    ]
+
+    @api.model
+    def get_prices(self, pricelist, products, quantity=1.0):
+        """
+        Devuelve {product_id: precio} de `products` en `pricelist` para `quantity`.
+        Solo se evalúan las reglas de precio de las variantes que no están en el
+        cache para esa cantidad y la fecha de hoy, todas juntas. Se cachea la
+        cantidad exacta: los tramos pueden venir de listas encadenadas (base
+        'pricelist') o de los proveedores de cada producto.
+        """
+        if not products:
+            return {}
+        if not PRICE_CACHE_CONFIG.get('enabled', True):
+            prices = pricelist._compute_price_rule(products, quantity)
+            return {pid: result[0] for pid, result in prices.items()}
+
+        today = fields.Date.context_today(self)
+        # Lectura sin bloqueos: el turno del chatbot no retiene filas del cache
+        # mientras espera a OpenAI, ni frena una edición de la lista de precios.
+        self.env.cr.execute("""
+            SELECT product_id, price FROM chatbot_price_cache
+             WHERE pricelist_id = %s AND product_id IN %s AND min_qty = %s AND date = %s
+        """, (pricelist.id, tuple(products.ids), quantity, today))
+        prices = dict(self.env.cr.fetchall())
+        self._count_hits(pricelist, prices, quantity, today)
+
+        missing = products.filtered(lambda p: p.id not in prices)
+        if missing:
+            prices.update(self._compute_and_store(pricelist, missing, today, quantity))
+        return prices
+
+    @api.model
+    def _compute_and_store(self, pricelist, products, date, quantity):
+        """
+        Calcula los precios y los guarda en una transacción corta propia, que se
+        confirma enseguida: las filas nuevas no quedan bloqueadas por el turno.
+        Si no se pueden guardar, los precios se devuelven igual.
+        """
+        computed = pricelist._compute_price_rule(products, quantity, date=date)
+        prices = {product.id: computed.get(product.id, (product.list_price, False))[0] for product in products}
+        values = ', '.join(["(%s, %s, %s, %s, %s, 0, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')"] * len(prices))
+        params = [
+            value
+            for product_id, price in sorted(prices.items())
+            for value in (pricelist.id, product_id, quantity, date, price, self.env.uid, self.env.uid)
+        ]
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute(f"""
+                    INSERT INTO chatbot_price_cache
+                           (pricelist_id, product_id, min_qty, date, price, hits,
+                            create_uid, write_uid, create_date, write_date)
+                    VALUES {values}
+               ON CONFLICT (pricelist_id, product_id, min_qty, date) DO UPDATE
+                       SET price = EXCLUDED.price,
+                           write_date = EXCLUDED.write_date
+                """, params)
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudieron guardar {len(prices)} precios en el cache: {e}")
+            return prices
+        _logger.info(f"💲 Cache de precios: {len(prices)} precios calculados para la lista '{pricelist.name}'.")
+        return prices
+
+    @api.model
+    def _count_hits(self, pricelist, prices, quantity, date):
+        with _hits_lock:
+            for product_id in prices:
+                _pending_hits[(pricelist.id, product_id, quantity, date)] += 1
+            due = time.monotonic() - _last_hits_flush[0] >= PRICE_CACHE_CONFIG.get('hits_flush_seconds', 60)
+        if due:
+            self.flush_hits()
+
+    @api.model
+    def flush_hits(self):
+        """
+        Suma a la tabla los aciertos contados en memoria, en una transacción
+        corta aparte. Las filas bloqueadas por otra transacción se saltean
+        (SKIP LOCKED): los aciertos son aproximados y solo ordenan el precalentado.
+        """
+        with _hits_lock:
+            pending = sorted(_pending_hits.items())
+            _pending_hits.clear()
+            _last_hits_flush[0] = time.monotonic()
+        if not pending:
+            return
+        values = ', '.join(["(%s::int, %s::int, %s::float, %s::date, %s::int)"] * len(pending))
+        params = [value for key, hits in pending for value in (*key, hits)]
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute(f"""
+                    WITH counted(pricelist_id, product_id, min_qty, date, hits) AS (VALUES {values}),
+                    locked AS (
+                        SELECT cache.id, counted.hits
+                          FROM chatbot_price_cache cache
+                          JOIN counted USING (pricelist_id, product_id, min_qty, date)
+                      ORDER BY cache.id
+                           FOR UPDATE OF cache SKIP LOCKED
+                    )
+                    UPDATE chatbot_price_cache cache
+                       SET hits = cache.hits + locked.hits
+                      FROM locked
+                     WHERE cache.id = locked.id
+                """, params)
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudieron registrar los aciertos del cache de precios: {e}")
+
+    @api.model
+    def invalidate_products(self, products):
+        """Descarta los precios cacheados de las variantes indicadas."""
+        if products:
+            self.env.cr.execute("DELETE FROM chatbot_price_cache WHERE product_id IN %s", (tuple(products.ids),))
+
+    @api.model
+    def invalidate_all(self):
+        # Una regla puede depender de otra lista (base 'pricelist') o aplicar a
+        # todos los productos: ante cualquier cambio se descarta el cache entero.
+        self.env.cr.execute("DELETE FROM chatbot_price_cache")
+
+    @api.model
+    def warm_cache(self):
+        """
+        Precalcula los precios del día para las variantes más consultadas (según
+        los aciertos acumulados) y borra los precios de días anteriores. Lo llama un cron.
+        """
+        today = fields.Date.context_today(self)
+        limit = PRICE_CACHE_CONFIG.get('warm_top_products', 200)
+        self.flush_hits()
+        self.env.cr.execute("""
+            SELECT pricelist_id, min_qty, array_agg(product_id)
+              FROM (SELECT pricelist_id, min_qty, product_id, SUM(hits) AS hits
+                      FROM chatbot_price_cache
+                     WHERE min_qty > 0
+                  GROUP BY pricelist_id, min_qty, product_id
+                  ORDER BY hits DESC
+                     LIMIT %s) top
+          GROUP BY pricelist_id, min_qty
+        """, (limit,))
+        warm_groups = self.env.cr.fetchall()
+        self.env.cr.execute("DELETE FROM chatbot_price_cache WHERE date < %s", (today,))
+
+        Pricelist = self.env['product.pricelist'].sudo()
+        Product = self.env['product.product'].sudo()
+        warmed = 0
+        for pricelist_id, min_qty, product_ids in warm_groups:
+            pricelist = Pricelist.browse(pricelist_id).exists()
+            products = Product.browse(product_ids).exists()
+            if pricelist and products:
+                self._compute_and_store(pricelist, products, today, min_qty)
+                warmed += len(products)
+        _logger.info(f"🔥 Cache de precios precalentado con {warmed} precios para {today}.")
+
+
+class ProductPricelistItem(models.Model):
+    _inherit = 'product.pricelist.item'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        items = super().create(vals_list)
+        self.env['chatbot.price.cache'].sudo().invalidate_all()
+        return items
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env['chatbot.price.cache'].sudo().invalidate_all()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['chatbot.price.cache'].sudo().invalidate_all()
+        return res
+
+
+class ProductSupplierinfo(models.Model):
+    _inherit = 'product.supplierinfo'
+
+    def _chatbot_affected_products(self):
+        return self.product_id | self.with_context(active_test=False).product_tmpl_id.product_variant_ids
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        sellers = super().create(vals_list)
+        self.env['chatbot.price.cache'].sudo().invalidate_products(sellers._chatbot_affected_products())
+        return sellers
+
+    def write(self, vals):
+        products = self._chatbot_affected_products()
+        res = super().write(vals)
+        self.env['chatbot.price.cache'].sudo().invalidate_products(products | self._chatbot_affected_products())
+        return res
+
+    def unlink(self):
+        products = self._chatbot_affected_products()
+        res = super().unlink()
+        self.env['chatbot.price.cache'].sudo().invalidate_products(products)
+        return res
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if PRICE_FIELDS.intersection(vals):
+            self.env['chatbot.price.cache'].sudo().invalidate_products(self)
+        return res
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if PRICE_FIELDS.intersection(vals):
+            variants = self.with_context(active_test=False).product_variant_ids
+            self.env['chatbot.price.cache'].sudo().invalidate_products(variants)
+        return res
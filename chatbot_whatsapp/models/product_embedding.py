@@ -0,0 +1,209 @@
+from odoo import models, fields, api, tools
+import hashlib
+import logging
+import os
+import time
+
+from ..config.config import general_config
+from ..utils import embeddings
+from ..utils.cache import LRUCache
+from ..utils.vector_index import get_store
+
+_logger = logging.getLogger(__name__)
+
+SEMANTIC_CONFIG = general_config.get('semantic_search', {})
+
+# Campos que cambian el texto embebido o si una variante se puede vender.
+PRODUCT_EMBEDDED_FIELDS = {'name', 'default_code', 'description_sale', 'active', 'sale_ok', 'product_tmpl_id', 'product_template_attribute_value_ids'}
+TEMPLATE_EMBEDDED_FIELDS = {'name', 'default_code', 'description_sale', 'active', 'sale_ok', 'attribute_line_ids'}
+
+# (key del proveedor, consulta) -> vector, en memoria de cada proceso.
+_query_cache = LRUCache(max_size=SEMANTIC_CONFIG.get('query_cache_size', 2000))
+
+
+class ChatbotProductEmbedding(models.Model):
+    _name = 'chatbot.product.embedding'
+    _description = 'Estado de los embeddings de productos del chatbot'
+
+    product_id = fields.Many2one('product.product', string="Variante", required=True, ondelete='cascade', index=True)
+    text_hash = fields.Char(string="Hash del Texto", required=True)
+    embedded_hash = fields.Char(string="Hash Embebido")
+
+    _sql_constraints = [
+        ('product_id_unique', 'unique(product_id)', 'Cada variante se embebe una sola vez.')
+    ]
+
+    def init(self):
+        # Solo se registran las variantes; los vectores los calcula el cron.
+        self.env.cr.execute("SELECT 1 FROM chatbot_product_embedding LIMIT 1")
+        if not self.env.cr.fetchone():
+            self._sync_products(self.env['product.product'].sudo().search([('sale_ok', '=', True)]))
+
+    @api.model
+    def is_enabled(self):
+        return SEMANTIC_CONFIG.get('enabled', True) and embeddings.is_available()
+
+    @api.model
+    def _store_directory(self):
+        return SEMANTIC_CONFIG.get('directory') or os.path.join(
+            tools.config.filestore(self.env.cr.dbname), 'chatbot_whatsapp', 'product_vectors'
+        )
+
+    @api.model
+    def _store(self):
+        return get_store(self._store_directory())
+
+    @api.model
+    def _embedding_text(self, product):
+        """Texto embebido: nombre completo (con código y atributos) y descripción de venta."""
+        return '\n'.join(filter(None, [product.display_name, product.description_sale]))
+
+    @api.model
+    def _text_hash(self, text):
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    @api.model
+    def _sync_products(self, products):
+        """
+        Marca para re-embeber las variantes cuyo texto cambió y olvida las que
+        ya no se venden. No llama al proveedor: eso lo hace refresh_embeddings().
+        """
+        products = products.exists().with_context(active_test=False)
+        if not products:
+            return
+        sellable = products.filtered(lambda p: p.active and p.sale_ok)
+        gone = products - sellable
+        if gone:
+            self.env.cr.execute("DELETE FROM chatbot_product_embedding WHERE product_id IN %s", (tuple(gone.ids),))
+        if not sellable:
+            return
+        rows = [(product.id, self._text_hash(self._embedding_text(product))) for product in sellable]
+        values = ', '.join(["(%s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')"] * len(rows))
+        params = [value for product_id, text_hash in rows for value in (product_id, text_hash, self.env.uid, self.env.uid)]
+        self.env.cr.execute(f"""
+            INSERT INTO chatbot_product_embedding (product_id, text_hash, create_uid, write_uid, create_date, write_date)
+            VALUES {values}
+       ON CONFLICT (product_id) DO UPDATE
+               SET text_hash = EXCLUDED.text_hash,
+                   write_date = EXCLUDED.write_date
+             WHERE chatbot_product_embedding.text_hash <> EXCLUDED.text_hash
+        """, params)
+        self.invalidate_model()
+
+    @api.model
+    def refresh_embeddings(self):
+        """
+        Calcula los embeddings de las variantes nuevas o modificadas (hasta
+        semantic_search.max_per_run por ejecución) y saca del índice las que ya
+        no se venden. Si cambió el proveedor o la dimensión se re-embebe todo.
+        Lo llama un cron.
+        """
+        if not self.is_enabled():
+            return
+        provider = embeddings.get_provider()
+        store = self._store()
+        if store.key != provider.key:
+            self.env.cr.execute("UPDATE chatbot_product_embedding SET embedded_hash = NULL")
+
+        self.env.cr.execute("""
+            SELECT product_id FROM chatbot_product_embedding
+             WHERE embedded_hash IS DISTINCT FROM text_hash
+          ORDER BY product_id
+             LIMIT %s
+        """, (SEMANTIC_CONFIG.get('max_per_run', 5000),))
+        products = self.env['product.product'].sudo().browse([row[0] for row in self.env.cr.fetchall()])
+
+        if products:
+            start = time.monotonic()
+            texts = [self._embedding_text(product) for product in products]
+            vectors = provider.embed(self.env, texts)
+            store.upsert(provider.key, products.ids, vectors)
+            for product, text in zip(products, texts):
+                text_hash = self._text_hash(text)
+                self.env.cr.execute("""
+                    UPDATE chatbot_product_embedding
+                       SET text_hash = %s, embedded_hash = %s, write_date = now() at time zone 'UTC'
+                     WHERE product_id = %s
+                """, (text_hash, text_hash, product.id))
+            self.invalidate_model()
+            _logger.info(
+                f"🧮 Embeddings de {len(products)} variantes actualizados con '{provider.key}' "
+                f"en {(time.monotonic() - start) * 1000:.0f}ms."
+            )
+
+        self.env.cr.execute("SELECT product_id FROM chatbot_product_embedding")
+        registered = {row[0] for row in self.env.cr.fetchall()}
+        store.remove(store.product_ids() - registered)
+
+    @api.model
+    def _query_vectors(self, provider, queries):
+        """Vectores de las consultas; solo se piden al proveedor las que no están en memoria."""
+        vectors = {query: _query_cache.get((provider.key, query)) for query in queries}
+        missing = [query for query, vector in vectors.items() if vector is None]
+        if missing:
+            for query, vector in zip(missing, provider.embed(self.env, missing)):
+                _query_cache.set((provider.key, query), vector)
+                vectors[query] = vector
+        return [vectors[query] for query in queries]
+
+    @api.model
+    def search_products_batch(self, queries, limit=10):
+        """
+        Variantes vendibles más parecidas en significado a cada consulta (p. ej.
+        "algo para limpiar vidrios"), por similitud coseno de sus embeddings.
+        Devuelve una lista de recordsets, en el orden de `queries`.
+        """
+        Product = self.env['product.product'].sudo()
+        if not queries or not self.is_enabled():
+            return [Product for _query in queries]
+
+        start = time.monotonic()
+        provider = embeddings.get_provider()
+        store = self._store()
+        if store.key != provider.key:
+            _logger.warning("🧮 El índice de vectores no corresponde al proveedor configurado; se omite la búsqueda semántica.")
+            return [Product for _query in queries]
+
+        normalized = [' '.join((query or '').split()).lower() for query in queries]
+        try:
+            query_vectors = self._query_vectors(provider, normalized)
+        except Exception as e:
+            _logger.error(f"❌ Error calculando embeddings de consultas: {e}", exc_info=True)
+            return [Product for _query in queries]
+        matches = store.search(query_vectors, limit=limit, min_score=SEMANTIC_CONFIG.get('min_score', 0.35))
+        # El índice puede tener variantes borradas o que ya no se venden hasta la próxima pasada del cron.
+        candidate_ids = {product_id for found in matches for product_id, _score in found}
+        valid = set(Product.search([('id', 'in', list(candidate_ids)), ('sale_ok', '=', True)]).ids)
+        results = [Product.browse([pid for pid, _score in found if pid in valid]) for found in matches]
+        _logger.info(
+            f"🧮 Búsqueda semántica de {len(queries)} consultas: {[len(r) for r in results]} resultados "
+            f"en {(time.monotonic() - start) * 1000:.1f}ms"
+        )
+        return results
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        self.env['chatbot.product.embedding'].sudo()._sync_products(products)
+        return products
+
+    def write(self, vals):
+        res = super().write(vals)
+        if PRODUCT_EMBEDDED_FIELDS.intersection(vals):
+            self.env['chatbot.product.embedding'].sudo()._sync_products(self)
+        return res
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if TEMPLATE_EMBEDDED_FIELDS.intersection(vals):
+            variants = self.with_context(active_test=False).product_variant_ids
+            self.env['chatbot.product.embedding'].sudo()._sync_products(variants)
+        return res
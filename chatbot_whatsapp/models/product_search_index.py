@@ -0,0 +1,198 @@
+from odoo import models, fields, api
+import logging
+import time
+
+from ..utils import product_search
+
+_logger = logging.getLogger(__name__)
+
+# Campos que cambian el texto indexado o si una variante se puede vender.
+PRODUCT_INDEXED_FIELDS = {'name', 'default_code', 'active', 'sale_ok', 'product_tmpl_id', 'product_template_attribute_value_ids'}
+TEMPLATE_INDEXED_FIELDS = {'name', 'default_code', 'active', 'sale_ok', 'attribute_line_ids'}
+
+
+class ChatbotProductSearchIndex(models.Model):
+    _name = 'chatbot.product.search.index'
+    _description = 'Índice de búsqueda de productos del chatbot'
+
+    product_id = fields.Many2one('product.product', string="Variante", required=True, ondelete='cascade', index=True)
+    search_text = fields.Char(string="Texto Normalizado", required=True, index='trigram')
+
+    _sql_constraints = [
+        ('product_id_unique', 'unique(product_id)', 'Cada variante se indexa una sola vez.')
+    ]
+
+    def init(self):
+        self.env.cr.execute("SELECT 1 FROM chatbot_product_search_index LIMIT 1")
+        if not self.env.cr.fetchone():
+            self.rebuild_index()
+
+    @api.model
+    def _index_text(self, product):
+        """Texto indexado: nombre completo (con código y atributos) normalizado y en singular."""
+        return ' '.join(product_search.terms(product.display_name))
+
+    @api.model
+    def rebuild_index(self):
+        """Reconstruye el índice completo. Solo hace falta en la instalación o para reparar."""
+        self.env.cr.execute("DELETE FROM chatbot_product_search_index")
+        products = self.env['product.product'].sudo().search([('sale_ok', '=', True)])
+        self._refresh_products(products)
+        _logger.info(f"🔎 Índice de búsqueda reconstruido con {len(products)} variantes.")
+
+    @api.model
+    def _refresh_products(self, products):
+        """Actualiza de forma incremental las filas de las variantes indicadas."""
+        products = products.exists().with_context(active_test=False)
+        existing = {row.product_id.id: row for row in self.sudo().search([('product_id', 'in', products.ids)])}
+        to_create = []
+        stale = self.browse()
+        for product in products:
+            row = existing.get(product.id)
+            if not (product.active and product.sale_ok):
+                stale |= row or self.browse()
+                continue
+            text = self._index_text(product)
+            if row:
+                if row.search_text != text:
+                    row.write({'search_text': text})
+            elif text:
+                to_create.append({'product_id': product.id, 'search_text': text})
+        if stale:
+            stale.unlink()
+        if to_create:
+            self.sudo().create(to_create)
+
+    @api.model
+    def search_products(self, query, limit=10):
+        """
+        Devuelve las variantes vendibles que contienen todas las palabras de la
+        consulta (o sus sinónimos), en cualquier orden, ordenadas por relevancia.
+        Si ninguna las contiene a todas, devuelve las que más palabras comparten.
+        """
+        start = time.monotonic()
+        query_terms = list(dict.fromkeys(product_search.terms(query)))
+        if not query_terms:
+            return self.env['product.product']
+
+        product_ids = self._search_ids(query_terms, limit, match_all=True)
+        if not product_ids and len(query_terms) > 1:
+            product_ids = self._search_ids(query_terms, limit, match_all=False)
+
+        products = self.env['product.product'].sudo().browse(product_ids)
+        _logger.info(
+            f"🔎 Búsqueda indexada '{query}' -> {query_terms}: {len(products)} resultados "
+            f"en {(time.monotonic() - start) * 1000:.1f}ms"
+        )
+        return products
+
+    @api.model
+    def search_products_batch(self, queries, limit=10):
+        """
+        Como search_products pero para varias consultas a la vez (p. ej. los
+        productos de un pedido): una sola lectura del índice para todas y otra
+        solo para las que no encontraron variantes con todas sus palabras.
+        Devuelve una lista de recordsets, en el orden de `queries`.
+        """
+        start = time.monotonic()
+        Product = self.env['product.product'].sudo()
+        query_terms = [list(dict.fromkeys(product_search.terms(query or ''))) for query in queries]
+        found = self._search_ids_batch(
+            {index: words for index, words in enumerate(query_terms) if words}, limit, match_all=True
+        )
+        retry = {
+            index: words for index, words in enumerate(query_terms)
+            if len(words) > 1 and not found.get(index)
+        }
+        if retry:
+            found.update(self._search_ids_batch(retry, limit, match_all=False))
+
+        results = [Product.browse(found.get(index, [])) for index in range(len(queries))]
+        _logger.info(
+            f"🔎 Búsqueda indexada de {len(queries)} consultas: {[len(r) for r in results]} resultados "
+            f"en {(time.monotonic() - start) * 1000:.1f}ms"
+        )
+        return results
+
+    def _search_sql(self, query_terms, limit, match_all):
+        """SELECT de las variantes que coinciden con `query_terms`, con su posición (rank) en el orden de relevancia."""
+        conditions, params = [], []
+        for term in query_terms:
+            alternatives = product_search.expand(term)
+            conditions.append('(' + ' OR '.join(['search_text LIKE %s'] * len(alternatives)) + ')')
+            params.extend(f'%{alt}%' for alt in alternatives)
+
+        if match_all:
+            where = ' AND '.join(conditions)
+            order_by = ''
+            order_params = []
+        else:
+            # Se priorizan las variantes que comparten más palabras con la consulta.
+            where = ' OR '.join(conditions)
+            order_by = ' + '.join(f'({cond})::int' for cond in conditions) + ' DESC, '
+            order_params = list(params)
+
+        # Con pg_trgm se ordena por similitud; sin la extensión, los nombres más cortos primero.
+        if self.env.registry.has_trigram:
+            order_by += 'similarity(search_text, %s) DESC'
+            order_params.append(' '.join(query_terms))
+        else:
+            order_by += 'length(search_text) ASC'
+
+        sql = f"""
+            SELECT product_id, row_number() OVER (ORDER BY {order_by}, product_id) AS rank
+              FROM chatbot_product_search_index
+             WHERE {where}
+          ORDER BY rank
+             LIMIT %s
+        """
+        return sql, order_params + params + [limit]
+
+    def _search_ids(self, query_terms, limit, match_all):
+        sql, params = self._search_sql(query_terms, limit, match_all)
+        self.env.cr.execute(sql, params)
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _search_ids_batch(self, terms_by_index, limit, match_all):
+        """{índice: ids} para varias consultas en un único UNION ALL."""
+        if not terms_by_index:
+            return {}
+        parts, params = [], []
+        for index, query_terms in terms_by_index.items():
+            sql, query_params = self._search_sql(query_terms, limit, match_all)
+            parts.append(f"SELECT %s AS query_index, product_id, rank FROM ({sql}) q")
+            params += [index] + query_params
+        self.env.cr.execute(
+            " UNION ALL ".join(parts) + " ORDER BY query_index, rank", params
+        )
+        found = {}
+        for index, product_id, _rank in self.env.cr.fetchall():
+            found.setdefault(index, []).append(product_id)
+        return found
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        self.env['chatbot.product.search.index']._refresh_products(products)
+        return products
+
+    def write(self, vals):
+        res = super().write(vals)
+        if PRODUCT_INDEXED_FIELDS.intersection(vals):
+            self.env['chatbot.product.search.index']._refresh_products(self)
+        return res
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if TEMPLATE_INDEXED_FIELDS.intersection(vals):
+            variants = self.with_context(active_test=False).product_variant_ids
+            self.env['chatbot.product.search.index']._refresh_products(variants)
+        return res
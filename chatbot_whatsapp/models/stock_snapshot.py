@@ -0,0 +1,130 @@
+from odoo import models, fields, api
+from odoo.tools.sql import create_unique_index
+from datetime import timedelta
+import logging
+
+from ..config.config import general_config
+
+_logger = logging.getLogger(__name__)
+
+STOCK_CONFIG = general_config.get('stock_snapshot', {})
+
+
+class ChatbotStockSnapshot(models.Model):
+    _name = 'chatbot.stock.snapshot'
+    _description = 'Snapshot de stock disponible para el chatbot'
+
+    product_id = fields.Many2one('product.product', string="Variante", required=True, ondelete='cascade', index=True)
+    warehouse_id = fields.Many2one('stock.warehouse', string="Almacén", ondelete='cascade')
+    qty_available = fields.Float(string="Disponible", digits='Product Unit of Measure')
+    refreshed_at = fields.Datetime(string="Actualizado", required=True)
+
+    def init(self):
+        # warehouse_id vacío = todos los almacenes; COALESCE para que la unicidad lo contemple.
+        create_unique_index(
+            self.env.cr, 'chatbot_stock_snapshot_product_warehouse_uniq', self._table,
+            ['product_id', 'COALESCE(warehouse_id, 0)'],
+        )
+
+    @api.model
+    def _get_warehouse_id(self):
+        return STOCK_CONFIG.get('warehouse_id') or None
+
+    @api.model
+    def get_available_qty(self, products):
+        """
+        Devuelve {product_id: cantidad disponible} leyendo el snapshot. Solo se
+        recalcula el stock de las variantes sin snapshot o con uno más viejo que
+        stock_snapshot.max_staleness_seconds, todas juntas en una sola lectura.
+        """
+        if not products:
+            return {}
+        warehouse_id = self._get_warehouse_id()
+        max_age = STOCK_CONFIG.get('max_staleness_seconds', 60)
+        self.env.cr.execute("""
+            SELECT product_id, qty_available FROM chatbot_stock_snapshot
+             WHERE product_id IN %s
+               AND COALESCE(warehouse_id, 0) = %s
+               AND refreshed_at > (now() at time zone 'UTC') - make_interval(secs => %s)
+        """, (tuple(products.ids), warehouse_id or 0, max_age))
+        quantities = dict(self.env.cr.fetchall())
+
+        missing = products.filtered(lambda p: p.id not in quantities)
+        if missing:
+            quantities.update(self._refresh(missing, warehouse_id))
+        return quantities
+
+    @api.model
+    def _refresh(self, products, warehouse_id):
+        """
+        Recalcula el stock de las variantes y guarda el snapshot en una
+        transacción corta propia, que se confirma enseguida. Así las filas no
+        quedan bloqueadas hasta el final del turno del chatbot, y una venta de
+        punto de venta o una transferencia que invalida el snapshot no espera a OpenAI.
+        Si no se puede guardar, las cantidades se devuelven igual.
+        """
+        context = {'warehouse_id': warehouse_id} if warehouse_id else {}
+        fresh = {
+            product.id: product.qty_available or 0.0
+            for product in products.sudo().with_context(**context)
+        }
+        now = fields.Datetime.now()
+        values = ', '.join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(fresh))
+        params = [
+            value
+            for product_id, qty in sorted(fresh.items())
+            for value in (product_id, warehouse_id, qty, now, self.env.uid, self.env.uid, now, now)
+        ]
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute(f"""
+                    INSERT INTO chatbot_stock_snapshot
+                           (product_id, warehouse_id, qty_available, refreshed_at,
+                            create_uid, write_uid, create_date, write_date)
+                    VALUES {values}
+               ON CONFLICT (product_id, COALESCE(warehouse_id, 0)) DO UPDATE
+                       SET qty_available = EXCLUDED.qty_available,
+                           refreshed_at = EXCLUDED.refreshed_at,
+                           write_date = EXCLUDED.write_date
+                """, params)
+        except Exception as e:
+            _logger.warning(f"⚠️ No se pudo guardar el snapshot de stock de {len(fresh)} variantes: {e}")
+            return fresh
+        _logger.info(f"📦 Snapshot de stock actualizado para {len(fresh)} variantes.")
+        return fresh
+
+    @api.model
+    def invalidate_products(self, products):
+        """Descarta el snapshot de variantes cuyo stock cambió."""
+        if products:
+            self.env.cr.execute(
+                "DELETE FROM chatbot_stock_snapshot WHERE product_id IN %s", (tuple(products.ids),)
+            )
+
+    @api.model
+    def purge_stale_snapshots(self):
+        """Borra snapshots que ya no se van a usar. Lo llama un cron."""
+        max_age = STOCK_CONFIG.get('max_staleness_seconds', 60)
+        self.search([('refreshed_at', '<', fields.Datetime.now() - timedelta(seconds=max_age))]).unlink()
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        self.env['chatbot.stock.snapshot'].sudo().invalidate_products(quants.product_id)
+        return quants
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'quantity', 'reserved_quantity', 'location_id', 'product_id'}.intersection(vals):
+            self.env['chatbot.stock.snapshot'].sudo().invalidate_products(self.product_id)
+        return res
+
+    def unlink(self):
+        products = self.product_id
+        res = super().unlink()
+        self.env['chatbot.stock.snapshot'].sudo().invalidate_products(products)
+        return res
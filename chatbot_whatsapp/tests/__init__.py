@@ -0,0 +1,16 @@
+from . import test_inbound_queue
+from . import test_openai_client
+from . import test_intent_cache
+from . import test_conversation_context
+from . import test_memory_lifecycle
+from . import test_outbound_queue
+from . import test_product_resolution
+from . import test_price_cache
+from . import test_stock_snapshot
+from . import test_metrics
+from . import test_llm_ledger
+from . import test_partner_profile
+from . import test_partner_phone
+from . import test_semantic_search
+from . import test_partner_affinity
+from . import test_benchmark
\ No newline at end of file
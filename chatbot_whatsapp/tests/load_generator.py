@@ -0,0 +1,326 @@
+# load_generator.py
+"""
+Generador de carga para la entrada de mensajes de WhatsApp.
+
+Simula N teléfonos distintos conversando a la vez: cada mensaje entra por
+whatsapp.account._process_messages(), lo mismo que llama el webhook de
+WhatsApp, y lo procesan consumidores de la cola como los del cron (cada uno con
+queue.pool_size hilos). OpenAI y la Graph API se reemplazan por los stubs de
+tests/, así se mide solo el costo del lado de Odoo.
+
+Por cada nivel de concurrencia reporta:
+- latencia de punta a punta (webhook -> respuesta recibida por la Graph API);
+- fallas de serialización y deadlocks (los conflictos sobre
+  chatbot.whatsapp.memory aparecen acá) y jobs reintentados;
+- esperas por locks de PostgreSQL (pg_stat_activity) y conversaciones
+  ocupadas por el advisory lock del teléfono;
+- saturación de los workers (jobs en proceso / hilos disponibles) y la
+  profundidad y el lag de la cola.
+
+Hace commits: usarlo solo sobre una copia de staging. Desde `odoo-bin shell`:
+
+    from odoo.addons.chatbot_whatsapp.tests.load_generator import run_load
+    run_load(env, levels=(10, 100, 500), cron_workers=2)
+"""
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+from odoo import api
+
+from ..config.config import general_config
+from ..utils import openai_client
+from .replay_harness import create_customer, load_scripts, percentile, prepare_fixtures, start_openai_stub
+from .stub_graph_api import StubGraphAPIServer
+
+_logger = logging.getLogger(__name__)
+
+QUEUE_CONFIG = general_config.get('queue', {})
+
+SERIALIZATION_ERRORS = ('could not serialize', 'deadlock detected', 'concurrent update')
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+
+class LoadRun:
+    """Un nivel de carga: `conversations` teléfonos en paralelo, cada uno con un guion."""
+
+    def __init__(self, env, account, tags, scripts, graph_stub, conversations, cron_workers=2,
+                 max_connections=16, think_time=1.0, reply_timeout=60, sample_interval=0.5):
+        self.env = env
+        self.dbname = env.cr.dbname
+        self.account = account
+        self.tags = tags
+        self.scripts = scripts
+        self.graph_stub = graph_stub
+        self.conversations = conversations
+        self.cron_workers = cron_workers
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.sample_interval = sample_interval
+        # Los productores comparten pocas conexiones: solo las usan para entregar cada mensaje.
+        self._connections = threading.BoundedSemaphore(max_connections)
+        self._stop = threading.Event()
+        self.counters = _Counters()
+        self.latencies = []
+        self.samples = []
+
+    def _new_env(self, cr):
+        return api.Environment(cr, self.env.uid, self.env.context)
+
+    # --- Conversaciones ---
+
+    def _prepare_phones(self):
+        run_id = uuid.uuid4().int % 10000
+        phones = []
+        for index in range(self.conversations):
+            phone = f"+549358{run_id:04d}{index:04d}"
+            create_customer(self.env, self.tags, self.scripts[index % len(self.scripts)], phone)
+            phones.append(phone)
+        self.env.cr.commit()
+        return phones
+
+    def _webhook_value(self, phone, text):
+        return {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': '5493580000000', 'phone_number_id': self.account.phone_uid},
+            'contacts': [{'profile': {'name': f"Load {phone[-4:]}"}, 'wa_id': phone.lstrip('+')}],
+            'messages': [{
+                'from': phone.lstrip('+'),
+                'id': f"wamid.load-{uuid.uuid4().hex}",
+                'timestamp': str(int(time.time())),
+                'type': 'text',
+                'text': {'body': text},
+            }],
+        }
+
+    def _converse(self, phone, script):
+        threading.current_thread().dbname = self.dbname
+        # Las conversaciones no arrancan todas en el mismo instante.
+        time.sleep(random.uniform(0, self.think_time))
+        for text in script['messages']:
+            start = time.monotonic()
+            with self._connections, self.env.registry.cursor() as cr:
+                self._new_env(cr)['whatsapp.account'].browse(self.account.id)._process_messages(
+                    self._webhook_value(phone, text)
+                )
+            self.counters.add('messages')
+            replied_at = self.graph_stub.wait_for_reply(phone, start, self.reply_timeout)
+            if replied_at is None:
+                self.counters.add('timeouts')
+                _logger.warning(f"⏱️ Carga: {phone} sin respuesta a '{text}' en {self.reply_timeout}s.")
+                return
+            self.latencies.append((replied_at - start) * 1000)
+            time.sleep(random.uniform(0, self.think_time))
+
+    # --- Consumidores y monitor ---
+
+    def _cron_worker(self):
+        """Como un hilo de cron que corre el consumidor de la cola una y otra vez."""
+        threading.current_thread().dbname = self.dbname
+        while not self._stop.is_set():
+            with self.env.registry.cursor() as cr:
+                processed = self._new_env(cr)['chatbot.whatsapp.inbound.job'].process_pending_jobs()
+            if not processed:
+                time.sleep(0.05)
+
+    def _dispatcher(self):
+        threading.current_thread().dbname = self.dbname
+        while not self._stop.is_set():
+            with self.env.registry.cursor() as cr:
+                sent = self._new_env(cr)['chatbot.whatsapp.outbound'].dispatch_pending()
+            if not sent:
+                time.sleep(0.05)
+
+    def _monitor(self):
+        threading.current_thread().dbname = self.dbname
+        capacity = self.cron_workers * max(1, QUEUE_CONFIG.get('pool_size', 4))
+        with self.env.registry.cursor() as cr:
+            env = self._new_env(cr)
+            while not self._stop.is_set():
+                cr.execute("""
+                    SELECT count(*) FILTER (WHERE wait_event_type = 'Lock'),
+                           count(*) FILTER (WHERE state = 'active')
+                      FROM pg_stat_activity
+                     WHERE datname = current_database() AND pid <> pg_backend_pid()
+                """)
+                lock_waits, active = cr.fetchone()
+                queue = env['chatbot.whatsapp.inbound.job'].get_queue_metrics()
+                self.samples.append({
+                    'lock_waits': lock_waits,
+                    'active_sessions': active,
+                    'saturation': min(1.0, queue['processing'] / capacity),
+                    'depth': queue['depth'],
+                    'lag_seconds': queue['lag_seconds'],
+                })
+                # Cada muestra en su propia transacción, para ver lo confirmado por los demás.
+                cr.rollback()
+                time.sleep(self.sample_interval)
+
+    def _deadlocks(self):
+        self.env.cr.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        return self.env.cr.fetchone()[0]
+
+    def _instrument(self):
+        """Cuenta los jobs fallidos (y por qué) y las conversaciones ocupadas, sin tocar el código del módulo."""
+        Job = type(self.env['chatbot.whatsapp.inbound.job'])
+        mark_failed, acquire_lock = Job._mark_failed, Job._acquire_phone_lock
+        counters = self.counters
+
+        def _mark_failed(job, error, start):
+            counters.add('failed_jobs')
+            if any(marker in (error or '').lower() for marker in SERIALIZATION_ERRORS):
+                counters.add('serialization_failures')
+            return mark_failed(job, error, start)
+
+        def _acquire_phone_lock(job):
+            acquired = acquire_lock(job)
+            if not acquired:
+                counters.add('phone_lock_busy')
+            return acquired
+
+        return [
+            patch.object(Job, '_mark_failed', _mark_failed),
+            patch.object(Job, '_acquire_phone_lock', _acquire_phone_lock),
+        ]
+
+    def run(self):
+        phones = self._prepare_phones()
+        deadlocks_before = self._deadlocks()
+        self.env.cr.commit()
+
+        patchers = self._instrument()
+        for patcher in patchers:
+            patcher.start()
+        background = [threading.Thread(target=self._cron_worker, name=f'load-cron-{i}') for i in range(self.cron_workers)]
+        background += [
+            threading.Thread(target=self._dispatcher, name='load-dispatcher'),
+            threading.Thread(target=self._monitor, name='load-monitor'),
+        ]
+        conversations = [
+            threading.Thread(
+                target=self._converse, args=(phone, self.scripts[index % len(self.scripts)]),
+                name=f'load-phone-{index}',
+            )
+            for index, phone in enumerate(phones)
+        ]
+        start = time.monotonic()
+        try:
+            for thread in background + conversations:
+                thread.start()
+            for thread in conversations:
+                thread.join()
+        finally:
+            elapsed = time.monotonic() - start
+            self._stop.set()
+            for thread in background:
+                thread.join()
+            for patcher in patchers:
+                patcher.stop()
+
+        deadlocks = self._deadlocks() - deadlocks_before
+        self.env.cr.commit()
+        return self._report(elapsed, deadlocks)
+
+    def _report(self, elapsed, deadlocks):
+        counters = self.counters.values
+        samples = self.samples or [{'lock_waits': 0, 'active_sessions': 0, 'saturation': 0.0, 'depth': 0, 'lag_seconds': 0.0}]
+        return {
+            'conversations': self.conversations,
+            'cron_workers': self.cron_workers,
+            'messages': counters.get('messages', 0),
+            'timeouts': counters.get('timeouts', 0),
+            'elapsed_seconds': elapsed,
+            'messages_per_second': counters.get('messages', 0) / elapsed if elapsed else 0.0,
+            'reply_latency_ms': {
+                'p50': percentile(self.latencies, 0.5),
+                'p95': percentile(self.latencies, 0.95),
+                'p99': percentile(self.latencies, 0.99),
+                'max': max(self.latencies, default=0.0),
+            },
+            'failed_jobs': counters.get('failed_jobs', 0),
+            'serialization_failures': counters.get('serialization_failures', 0),
+            'deadlocks': deadlocks,
+            'phone_lock_busy': counters.get('phone_lock_busy', 0),
+            'lock_waits': {
+                'max': max(s['lock_waits'] for s in samples),
+                'avg': sum(s['lock_waits'] for s in samples) / len(samples),
+                'samples_waiting': sum(1 for s in samples if s['lock_waits']) / len(samples),
+            },
+            'worker_saturation': {
+                'avg': sum(s['saturation'] for s in samples) / len(samples),
+                'max': max(s['saturation'] for s in samples),
+            },
+            'max_active_sessions': max(s['active_sessions'] for s in samples),
+            'max_queue_depth': max(s['depth'] for s in samples),
+            'max_queue_lag_seconds': max(s['lag_seconds'] for s in samples),
+        }
+
+
+def format_load_report(results):
+    lines = ["📈 Carga sobre la entrada de WhatsApp:"]
+    for r in results:
+        latency, locks, saturation = r['reply_latency_ms'], r['lock_waits'], r['worker_saturation']
+        lines.append(
+            f"  {r['conversations']:>4} conv. | {r['messages']} msgs en {r['elapsed_seconds']:.1f}s "
+            f"({r['messages_per_second']:.1f} msg/s) | respuesta p50={latency['p50']:.0f}ms "
+            f"p95={latency['p95']:.0f}ms p99={latency['p99']:.0f}ms | sin respuesta={r['timeouts']} | "
+            f"serialización={r['serialization_failures']} deadlocks={r['deadlocks']} fallidos={r['failed_jobs']} | "
+            f"esperas de lock máx={locks['max']} ({locks['samples_waiting']:.0%} del tiempo) "
+            f"teléfono ocupado={r['phone_lock_busy']} | saturación prom={saturation['avg']:.0%} "
+            f"máx={saturation['max']:.0%} | cola máx={r['max_queue_depth']} lag máx={r['max_queue_lag_seconds']:.1f}s"
+        )
+    return "\n".join(lines)
+
+
+def run_load(env, levels=(10, 100, 500), cron_workers=2, scripts_path=None, report_path=None, **options):
+    """
+    Corre un nivel de carga por cada cantidad de conversaciones en `levels` y
+    devuelve sus reportes. `options` se pasan a LoadRun (max_connections,
+    think_time, reply_timeout, sample_interval).
+    """
+    data = load_scripts(scripts_path)
+    openai_stub = start_openai_stub(data)
+    graph_stub = StubGraphAPIServer().start()
+    params = env['ir.config_parameter'].sudo()
+    saved_params = {key: params.get_param(key) for key in ('openai.api_key', 'openai.api_base')}
+    params.set_param('openai.api_key', 'sk-load-test')
+    params.set_param('openai.api_base', openai_stub.url)
+    account, tags = prepare_fixtures(env)
+    env.cr.commit()
+    openai_client.clear_credentials_cache()
+
+    results = []
+    try:
+        with graph_stub.patch():
+            for conversations in levels:
+                _logger.info(f"🚦 Carga: {conversations} conversaciones en paralelo...")
+                run = LoadRun(env, account, tags, data['scripts'], graph_stub, conversations,
+                              cron_workers=cron_workers, **options)
+                results.append(run.run())
+                _logger.info(format_load_report(results[-1:]))
+    finally:
+        for key, value in saved_params.items():
+            params.set_param(key, value or False)
+        env.cr.commit()
+        openai_client.clear_credentials_cache()
+        openai_stub.stop()
+        graph_stub.stop()
+
+    _logger.info(format_load_report(results))
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    return results
\ No newline at end of file
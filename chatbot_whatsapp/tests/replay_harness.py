@@ -0,0 +1,278 @@
+# replay_harness.py
+"""
+Reproduce conversaciones (grabadas o sintéticas) contra el chatbot completo y
+mide su rendimiento: cada mensaje entra por whatsapp.message.create(), lo
+procesa el consumidor de la cola (ChatbotProcessor) y sus respuestas salen por
+el despachador de la cola de salida, con OpenAI y la Graph API reemplazadas
+por los servidores stub de tests/.
+
+Formato de los guiones (YAML):
+
+    stub:
+      latency_ms: 50             # Latencia de cada llamada al stub de OpenAI
+      rules:                     # Respuestas enlatadas (ver StubOpenAIServer.add_rule)
+        - system: clasificador de intenciones
+          user: hola
+          content: saludo
+    rounds: 3                    # Veces que se reproduce cada guion
+    scripts:
+      - name: faq
+        customer: b2b            # b2b | b2c
+        messages: ["hola", "¿a qué hora abren?"]
+    thresholds:                  # Ver check_thresholds()
+      min_messages_per_second: 2
+
+CHATBOT_BENCHMARK_SCRIPTS permite reemplazar los guiones por otro archivo con
+el mismo formato (p. ej. conversaciones reales exportadas) y
+CHATBOT_BENCHMARK_REPORT indica dónde guardar el reporte en JSON.
+"""
+import json
+import logging
+import os
+import time
+
+import yaml
+
+from ..utils.utils import clean_html
+from .stub_openai_server import StubOpenAIServer
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_conversations.yml')
+
+
+def load_scripts(path=None):
+    """Guiones del benchmark: `path`, CHATBOT_BENCHMARK_SCRIPTS o los sintéticos del módulo."""
+    path = path or os.environ.get('CHATBOT_BENCHMARK_SCRIPTS') or DEFAULT_SCRIPTS
+    with open(path, 'r', encoding='utf-8') as file:
+        data = yaml.safe_load(file) or {}
+    if path != DEFAULT_SCRIPTS:
+        # Los archivos grabados pueden traer solo los guiones: el resto sale de los sintéticos.
+        with open(DEFAULT_SCRIPTS, 'r', encoding='utf-8') as file:
+            data = dict(yaml.safe_load(file), **data)
+    return data
+
+
+def start_openai_stub(data):
+    """Inicia el stub de OpenAI con la latencia y las respuestas enlatadas de los guiones."""
+    stub_config = data.get('stub', {})
+    stub = StubOpenAIServer(
+        latency=stub_config.get('latency_ms', 0) / 1000,
+        default_content=stub_config.get('default_content', 'otro'),
+    )
+    for rule in stub_config.get('rules', []):
+        stub.add_rule(rule['system'], rule.get('content'), rule.get('function_call'), user_contains=rule.get('user'))
+    return stub.start()
+
+
+def prepare_fixtures(env):
+    """
+    Cuenta de WhatsApp, etiquetas de tipo de cliente y productos con stock que
+    usan los guiones sintéticos (los reutiliza si ya existen). Devuelve
+    (cuenta, {customer: etiqueta}).
+    """
+    account = env['whatsapp.account'].search([('account_uid', '=', 'account-bench')], limit=1) \
+        or env['whatsapp.account'].create({
+            'name': 'Cuenta Benchmark',
+            'app_uid': 'app-bench',
+            'app_secret': 'secret-bench',
+            'account_uid': 'account-bench',
+            'phone_uid': 'phone-bench',
+            'token': 'token-bench',
+        })
+    Category = env['res.partner.category']
+    customer_type = Category.search([('name', '=', 'Tipo de Cliente'), ('parent_id', '=', False)], limit=1) \
+        or Category.create({'name': 'Tipo de Cliente'})
+    tags = {}
+    for customer, tag_name in (('b2b', 'EMPRESA'), ('b2c', 'Consumidor Final')):
+        tags[customer] = Category.search([('name', '=', tag_name), ('parent_id', '=', customer_type.id)], limit=1) \
+            or Category.create({'name': tag_name, 'parent_id': customer_type.id})
+
+    Product = env['product.product']
+    stock = env.ref('stock.stock_location_stock')
+    for name, price in (('Lavandina Bench Clásica', 900), ('Lavandina Bench Perfumada', 1100),
+                        ('Detergente Bench', 1500)):
+        product = Product.search([('name', '=', name)], limit=1) \
+            or Product.create({'name': name, 'is_storable': True, 'list_price': price, 'sale_ok': True})
+        if product.qty_available < 1000:
+            env['stock.quant']._update_available_quantity(product, stock, 100000)
+    return account, tags
+
+
+def create_customer(env, tags, script, phone):
+    """Contacto de una conversación, ya registrado y con su tipo de cliente."""
+    partner = env['res.partner'].create({
+        'name': f"Cliente {script['name']} {phone[-5:]}",
+        'email': 'cliente@example.com',
+        'mobile': phone,
+        'category_id': [(4, tags[script['customer']].id)],
+    })
+    if script['customer'] == 'b2b':
+        # Con una cotización previa el cliente B2B no queda esperando a un asesor.
+        env['sale.order'].create({'partner_id': partner.id})
+    return partner
+
+
+def percentile(values, q):
+    """Percentil `q` (0-1) por rango más cercano."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+def _summary(turns, elapsed):
+    latencies = [turn['latency_ms'] for turn in turns]
+    queries = [turn['queries'] for turn in turns]
+    return {
+        'turns': len(turns),
+        'failed_turns': sum(1 for turn in turns if turn['error']),
+        'messages_per_second': len(turns) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies, default=0.0),
+        },
+        'queries_per_turn': {
+            'avg': sum(queries) / len(queries) if queries else 0.0,
+            'max': max(queries, default=0),
+        },
+        'llm_calls_per_turn': sum(turn['llm_calls'] for turn in turns) / len(turns) if turns else 0.0,
+    }
+
+
+def check_thresholds(report, thresholds):
+    """Devuelve la lista de umbrales que el reporte no cumple (vacía si está todo bien)."""
+    checks = [
+        ('min_messages_per_second', report['messages_per_second'], min),
+        ('max_latency_p50_ms', report['latency_ms']['p50'], max),
+        ('max_latency_p95_ms', report['latency_ms']['p95'], max),
+        ('max_latency_p99_ms', report['latency_ms']['p99'], max),
+        ('max_queries_per_turn', report['queries_per_turn']['max'], max),
+        ('max_avg_queries_per_turn', report['queries_per_turn']['avg'], max),
+        ('max_avg_llm_calls_per_turn', report['llm_calls_per_turn'], max),
+        ('max_failed_turns', report['failed_turns'], max),
+    ]
+    failures = []
+    for key, value, bound in checks:
+        limit = (thresholds or {}).get(key)
+        if limit is None:
+            continue
+        if (bound is min and value < limit) or (bound is max and value > limit):
+            failures.append(f"{key}: {value:.2f} (umbral {limit})")
+    return failures
+
+
+def format_report(report):
+    lines = [
+        f"📊 Benchmark del chatbot: {report['turns']} mensajes en {report['elapsed_seconds']:.2f}s "
+        f"({report['messages_per_second']:.2f} msg/s), {report['failed_turns']} con error",
+    ]
+    for name, stats in [('total', report)] + sorted(report['scripts'].items()):
+        latency, queries = stats['latency_ms'], stats['queries_per_turn']
+        lines.append(
+            f"  {name:<24} p50={latency['p50']:.0f}ms p95={latency['p95']:.0f}ms p99={latency['p99']:.0f}ms "
+            f"max={latency['max']:.0f}ms | SQL/turno prom={queries['avg']:.1f} max={queries['max']} "
+            f"| OpenAI/turno={stats['llm_calls_per_turn']:.2f}"
+        )
+    return "\n".join(lines)
+
+
+class ConversationReplayer:
+    """
+    Uso:
+        replayer = ConversationReplayer(env, account, openai_stub, graph_stub, partner_factory)
+        report = replayer.replay(data['scripts'], rounds=3)
+
+    `partner_factory(script, phone)` crea el contacto de cada conversación con
+    el teléfono indicado. Los stubs ya tienen que estar iniciados y la Graph API parcheada.
+    """
+
+    def __init__(self, env, account, openai_stub, graph_stub, partner_factory):
+        self.env = env
+        self.account = account
+        self.openai_stub = openai_stub
+        self.graph_stub = graph_stub
+        self.partner_factory = partner_factory
+        self.replies = {}
+
+    def replay(self, scripts, rounds=1):
+        """Reproduce cada guion `rounds` veces, cada vez con un contacto nuevo, y devuelve el reporte."""
+        turns = []
+        start = time.perf_counter()
+        for round_number in range(rounds):
+            for index, script in enumerate(scripts):
+                phone = f"+54935800{round_number:03d}{index:02d}"
+                self.partner_factory(script, phone)
+                for text in script['messages']:
+                    turn = self._replay_message(phone, text)
+                    turn['script'] = script['name']
+                    turns.append(turn)
+                    self.replies.setdefault(script['name'], []).append((text, turn['replies']))
+        elapsed = time.perf_counter() - start
+
+        report = _summary(turns, elapsed)
+        report['elapsed_seconds'] = elapsed
+        report['scripts'] = {
+            script['name']: _summary(
+                [turn for turn in turns if turn['script'] == script['name']],
+                sum(turn['latency_ms'] for turn in turns if turn['script'] == script['name']) / 1000,
+            )
+            for script in scripts
+        }
+        report_path = os.environ.get('CHATBOT_BENCHMARK_REPORT')
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as file:
+                json.dump(report, file, indent=2)
+        return report
+
+    def _replay_message(self, phone, text):
+        cr = self.env.cr
+        queries_before = cr.sql_log_count
+        llm_calls_before = len(self.openai_stub.requests)
+        sent_before = len(self.graph_stub.requests)
+        error = None
+
+        start = time.perf_counter()
+        message = self.env['whatsapp.message'].create({
+            'body': text,
+            'mobile_number': phone,
+            'wa_account_id': self.account.id,
+            'message_type': 'inbound',
+            'state': 'received',
+        })
+        jobs = self.env['chatbot.whatsapp.inbound.job'].sudo().search([('message_id', '=', message.id)])
+        for job in jobs:
+            error = self._run_job(job) or error
+        self.env['chatbot.whatsapp.outbound'].sudo().dispatch_pending(auto_commit=False)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        return {
+            'latency_ms': latency_ms,
+            'queries': cr.sql_log_count - queries_before,
+            'llm_calls': len(self.openai_stub.requests) - llm_calls_before,
+            'replies': [
+                request['payload'].get('text', {}).get('body')
+                for request in self.graph_stub.requests[sent_before:]
+            ],
+            'error': error,
+        }
+
+    def _run_job(self, job):
+        """
+        Lo mismo que hace el consumidor de la cola con cada job (_run), pero sin
+        commits ni advisory locks: todo el benchmark corre en la transacción del test.
+        """
+        job.write({'state': 'processing', 'attempts': job.attempts + 1})
+        try:
+            with self.env.cr.savepoint():
+                messages = job._get_turn_messages()
+                plain_text = "\n".join(clean_html(msg.body or "").strip() for msg in messages).strip()
+                messages[-1]._chatbot_process_inbound(plain_text=plain_text)
+        except Exception as e:
+            _logger.error(f"❌ Benchmark: error procesando '{job.message_id.body}': {e}", exc_info=True)
+            job.write({'state': 'dead', 'last_error': str(e)})
+            return str(e)
+        job.write({'state': 'done'})
+        return None
\ No newline at end of file
@@ -0,0 +1,154 @@
+# stub_graph_api.py
+"""
+Servidor HTTP local que imita el endpoint de mensajes de la Graph API de
+WhatsApp (POST /<phone_uid>/messages), para tests y benchmarks.
+
+El módulo whatsapp bloquea sus llamadas a la API durante los tests; patch()
+redirige el envío de WhatsAppApi a este servidor por HTTP real.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import requests
+
+
+def _number_key(number):
+    # El módulo whatsapp puede reformatear el número: se comparan los últimos 10 dígitos.
+    return re.sub(r'\D', '', number or '')[-10:]
+
+
+class StubGraphAPIServer:
+    """
+    Uso:
+        server = StubGraphAPIServer().start()
+        with server.patch():
+            ... whatsapp.message._send_message() ...
+        server.stop()
+    """
+
+    def __init__(self):
+        self.fail_next = 0
+        self.fail_status = 500
+        self.requests = []
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._received = threading.Condition(self._lock)
+        self._sent_at = {}
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v17.0"
+
+    def fail(self, times, status=500):
+        """Hace fallar los próximos `times` envíos con el status indicado."""
+        self.fail_next = times
+        self.fail_status = status
+
+    def wait_for_reply(self, number, since, timeout):
+        """
+        Espera el primer envío exitoso a `number` recibido después de `since`
+        (time.monotonic()) y devuelve cuándo llegó, o None si vence `timeout`.
+        """
+        key = _number_key(number)
+        deadline = time.monotonic() + timeout
+        with self._received:
+            while True:
+                received_at = next((at for at in self._sent_at.get(key, ()) if at > since), None)
+                remaining = deadline - time.monotonic()
+                if received_at is not None or remaining <= 0:
+                    return received_at
+                self._received.wait(remaining)
+
+    def sent_bodies(self):
+        return [
+            request['payload'].get('text', {}).get('body')
+            for request in self.requests if request['status'] == 200
+        ]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                with server._lock:
+                    failing = server.fail_next > 0
+                    if failing:
+                        server.fail_next -= 1
+                    status = server.fail_status if failing else 200
+                    server._counter += 1
+                    server.requests.append({
+                        'path': self.path, 'payload': payload, 'status': status, 'received_at': time.monotonic(),
+                    })
+                    message_id = f"wamid.stub-{server._counter}"
+                    if not failing:
+                        server._sent_at.setdefault(_number_key(payload.get('to')), []).append(time.monotonic())
+                        server._received.notify_all()
+                if failing:
+                    return self._reply(status, {'error': {'message': 'stub failure', 'code': 131000}})
+                if self.path.endswith('/messages'):
+                    return self._reply(200, {
+                        'messaging_product': 'whatsapp',
+                        'contacts': [{'input': payload.get('to'), 'wa_id': payload.get('to')}],
+                        'messages': [{'id': message_id}],
+                    })
+                return self._reply(404, {'error': {'message': f'Ruta no soportada: {self.path}'}})
+
+        return Handler
+
+    def patch(self):
+        """Redirige WhatsAppApi._send_whatsapp a este servidor."""
+        from odoo.addons.whatsapp.tools.whatsapp_api import WhatsAppApi
+        from odoo.addons.whatsapp.tools.whatsapp_exception import WhatsAppError
+        server = self
+
+        def _send_whatsapp(api, number, message_type, send_vals, parent_message_id=False):
+            data = {
+                'messaging_product': 'whatsapp',
+                'recipient_type': 'individual',
+                'to': number,
+                'type': message_type,
+                message_type: send_vals,
+            }
+            if parent_message_id:
+                data['context'] = {'message_id': parent_message_id}
+            response = requests.post(f"{server.url}/{api.phone_uid}/messages", json=data, timeout=5)
+            if not response.ok:
+                raise WhatsAppError(response.json()['error']['message'])
+            return response.json()['messages'][0]['id']
+
+        return patch.object(WhatsAppApi, '_send_whatsapp', _send_whatsapp)
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
\ No newline at end of file
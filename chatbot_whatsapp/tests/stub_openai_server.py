@@ -0,0 +1,133 @@
+# stub_openai_server.py
+"""
+Servidor HTTP local compatible con la API de OpenAI, para tests y benchmarks.
+
+Responde /chat/completions con respuestas enlatadas elegidas según el prompt
+de sistema, con latencia configurable y la posibilidad de inyectar errores.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOpenAIServer:
+    """
+    Uso:
+        server = StubOpenAIServer(latency=0.05)
+        server.add_rule('clasificador de intenciones', 'saludo')
+        server.start()
+        ... openai.api_base = server.url ...
+        server.stop()
+    """
+
+    def __init__(self, latency=0.0, default_content="otro"):
+        self.latency = latency
+        self.default_content = default_content
+        self.rules = []
+        self.fail_next = 0
+        self.fail_status = 503
+        self.requests = []
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def add_rule(self, system_contains, content=None, function_call=None, user_contains=None):
+        """
+        Si el prompt de sistema contiene `system_contains` (y el último mensaje del
+        usuario contiene `user_contains`, sin distinguir mayúsculas), responde
+        `content` o `function_call`. Gana la primera regla que coincide.
+        """
+        self.rules.append((system_contains, user_contains and user_contains.lower(), content, function_call))
+
+    def fail(self, times, status=503):
+        """Hace fallar las próximas `times` llamadas con el status indicado."""
+        self.fail_next = times
+        self.fail_status = status
+
+    def _build_completion(self, payload):
+        messages = payload.get('messages', [])
+        system = next((m['content'] for m in messages if m.get('role') == 'system'), '')
+        user = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '').lower()
+        content, function_call = self.default_content, None
+        for needle, user_needle, rule_content, rule_function_call in self.rules:
+            if needle in system and (not user_needle or user_needle in user):
+                content, function_call = rule_content, rule_function_call
+                break
+        message = {'role': 'assistant', 'content': content}
+        if function_call:
+            message = {
+                'role': 'assistant',
+                'content': None,
+                'function_call': {
+                    'name': function_call['name'],
+                    'arguments': json.dumps(function_call['arguments']),
+                },
+            }
+        prompt_tokens = sum(len((m.get('content') or '').split()) for m in payload.get('messages', []))
+        completion_tokens = len((content or '').split())
+        return {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                with server._lock:
+                    server.requests.append({'path': self.path, 'payload': payload})
+                    failing = server.fail_next > 0
+                    if failing:
+                        server.fail_next -= 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if failing:
+                    return self._reply(server.fail_status, {'error': {'message': 'stub failure', 'type': 'server_error'}})
+                if self.path.endswith('/chat/completions'):
+                    return self._reply(200, server._build_completion(payload))
+                return self._reply(404, {'error': {'message': f'Ruta no soportada: {self.path}'}})
+
+        return Handler
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
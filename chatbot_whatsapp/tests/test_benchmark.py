@@ -0,0 +1,52 @@
+import logging
+
+from odoo.tests import TransactionCase, tagged
+
+from ..utils import openai_client
+from .replay_harness import (
+    ConversationReplayer, check_thresholds, create_customer, format_report, load_scripts, prepare_fixtures,
+    start_openai_stub,
+)
+from .stub_graph_api import StubGraphAPIServer
+
+_logger = logging.getLogger(__name__)
+
+
+# Fuera de la corrida normal: --test-tags chatbot_whatsapp_benchmark
+@tagged('-standard', 'post_install', '-at_install', 'chatbot_whatsapp_benchmark')
+class TestConversationBenchmark(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.data = load_scripts()
+        cls.openai_stub = start_openai_stub(cls.data)
+        cls.addClassCleanup(cls.openai_stub.stop)
+        cls.graph_stub = StubGraphAPIServer().start()
+        cls.addClassCleanup(cls.graph_stub.stop)
+
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('openai.api_key', 'sk-benchmark')
+        params.set_param('openai.api_base', cls.openai_stub.url)
+        openai_client.clear_credentials_cache()
+        cls.addClassCleanup(openai_client.clear_credentials_cache)
+
+        cls.account, cls.tags = prepare_fixtures(cls.env)
+
+    def _create_partner(self, script, phone):
+        return create_customer(self.env, self.tags, script, phone)
+
+    def test_replay_conversations(self):
+        with self.graph_stub.patch():
+            replayer = ConversationReplayer(
+                self.env, self.account, self.openai_stub, self.graph_stub, self._create_partner,
+            )
+            report = replayer.replay(self.data['scripts'], rounds=self.data.get('rounds', 3))
+
+        _logger.info(format_report(report))
+        for name, exchanges in replayer.replies.items():
+            for text, replies in exchanges:
+                self.assertTrue(replies, f"[{name}] '{text}' quedó sin respuesta.")
+
+        failures = check_thresholds(report, self.data.get('thresholds'))
+        self.assertFalse(failures, "El benchmark no cumple los umbrales:\n" + "\n".join(failures))
\ No newline at end of file
@@ -0,0 +1,143 @@
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models.conversation_context import ConversationContext
+from ..utils import prompt_builder
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestConversationContext(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente Test', 'phone': '+5493581234567'})
+        cls.product = cls.env['product.product'].create({'name': 'Lavandina Test'})
+        cls.other_product = cls.env['product.product'].create({'name': 'Detergente Test'})
+
+    def test_turn_is_flushed_with_a_single_write(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        self.assertEqual((ctx.cart, ctx.queue, ctx.candidates('product')), ([], [], []))
+        self.env.flush_all()
+
+        # Varias modificaciones en el turno: un UPDATE de la memoria y un INSERT por cada tabla hija.
+        with self.assertQueryCount(3):
+            ctx.update(last_intent_detected='crear_pedido')
+            ctx.add_to_cart(self.product.id, 2)
+            ctx.add_to_cart(self.product.id, 1)
+            ctx.add_to_cart(self.other_product.id, 4)
+            ctx.set_queue([{'query': 'escoba', 'quantity': 1}])
+            ctx.update(flow_state='esperando_confirmacion_pedido', last_variant_id=self.product.id)
+            ctx.flush()
+            self.env.flush_all()
+
+        memory = ctx.memory
+        self.assertEqual(memory.last_intent_detected, 'crear_pedido')
+        self.assertEqual(memory.flow_state, 'esperando_confirmacion_pedido')
+        self.assertEqual(memory.last_variant_id, self.product)
+        self.assertEqual(
+            [(line.product_id, line.quantity) for line in memory.cart_line_ids],
+            [(self.product, 3), (self.other_product, 4)],
+        )
+        self.assertEqual(memory.pending_product_ids.mapped('query'), ['escoba'])
+
+    def test_pending_values_are_visible_before_flush(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        ctx.update(flow_state='esperando_cantidad_producto', last_variant_id=self.product.id)
+        self.assertEqual(ctx.flow_state, 'esperando_cantidad_producto')
+        self.assertEqual(ctx.last_variant, self.product)
+        self.assertFalse(ctx.memory.flow_state)
+
+        ctx.flush()
+        self.assertEqual(ctx.memory.flow_state, 'esperando_cantidad_producto')
+
+    def test_untouched_turn_does_not_write(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        self.env.flush_all()
+        self.assertEqual(ctx.cart, [])
+        with self.assertQueryCount(0):
+            ctx.flush()
+            self.env.flush_all()
+
+    def test_cart_changes_only_touch_modified_lines(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        ctx.add_to_cart(self.product.id, 1)
+        ctx.add_to_cart(self.other_product.id, 1)
+        ctx.flush()
+        first_line = ctx.memory.cart_line_ids[0]
+
+        ctx = ConversationContext.load(self.env, self.partner)
+        ctx.set_cart([item for item in ctx.cart if item['product_id'] == self.product.id])
+        ctx.flush()
+
+        self.assertEqual(ctx.memory.cart_line_ids, first_line)
+
+    def test_candidates_round_trip(self):
+        variants = [
+            {'id': self.product.id, 'name': 'Lavandina Test', 'price': 10.0, 'stock': 5.0},
+            {'id': self.other_product.id, 'name': 'Detergente Test', 'price': 20.0, 'stock': 1.0},
+        ]
+        ctx = ConversationContext.load(self.env, self.partner)
+        ctx.set_candidates('product', variants)
+        ctx.flush()
+
+        ctx = ConversationContext.load(self.env, self.partner)
+        self.assertEqual(ctx.candidates('product'), variants)
+        ctx.clear_flow_data()
+        ctx.flush()
+        self.assertFalse(ctx.memory.candidate_ids)
+
+    def test_active_conversations_report(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        ctx.add_to_cart(self.product.id, 2)
+        ctx.update(flow_state='esperando_confirmacion_pedido')
+        ctx.flush()
+        self.env.flush_all()
+
+        report = self.env['chatbot.whatsapp.memory'].get_active_conversations_report(product_id=self.product.id)
+        state = report['by_state']['esperando_confirmacion_pedido']
+        self.assertGreaterEqual(state['open_carts'], 1)
+        self.assertGreaterEqual(report['units'], 2)
+
+    def test_recent_turns_window(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        for i in range(15):
+            ctx.append_turn('user' if i % 2 == 0 else 'assistant', f"mensaje {i}")
+        ctx.flush()
+
+        ctx = ConversationContext.load(self.env, self.partner)
+        self.assertEqual(len(ctx.turns), 10)
+        self.assertEqual(ctx.history('general_intent'), [
+            {'role': 'user', 'content': 'mensaje 12'},
+            {'role': 'assistant', 'content': 'mensaje 13'},
+            {'role': 'user', 'content': 'mensaje 14'},
+        ])
+        # Los turnos que salen de la ventana quedan resumidos en la sesión.
+        self.assertIn('Cliente: mensaje 0', ctx.summary)
+        self.assertIn('Bot: mensaje 4', ctx.summary)
+        self.assertNotIn('mensaje 5', ctx.summary)
+
+    def test_prompt_respects_token_budget(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        for i in range(6):
+            ctx.append_turn('user' if i % 2 == 0 else 'assistant', f"mensaje {i} " + "palabra " * 40)
+
+        with patch.dict(prompt_builder.BUDGET_CONFIG['tasks'], {'test': 250}):
+            messages = ctx.prompt('test', "Sos un asistente de ventas.", handler='default')
+
+        self.assertLessEqual(prompt_builder.count_message_tokens(messages), 250)
+        # Primero el prompt estable, después el resumen de lo descartado y los turnos más nuevos.
+        self.assertEqual(messages[0], {'role': 'system', 'content': "Sos un asistente de ventas."})
+        self.assertTrue(messages[1]['content'].startswith(prompt_builder.SUMMARY_HEADER))
+        self.assertTrue(messages[-1]['content'].startswith('mensaje 5'))
+
+    def test_user_message_is_not_cut_when_system_prompt_exceeds_budget(self):
+        messages = [
+            {'role': 'system', 'content': "instrucción " * 200},
+            {'role': 'user', 'content': "Quiero 3 lavandinas"},
+        ]
+        with patch.dict(prompt_builder.BUDGET_CONFIG['tasks'], {'test': 100}):
+            fitted = prompt_builder.fit_to_budget(messages, 'test')
+
+        self.assertEqual(fitted[-1]['content'], "Quiero 3 lavandinas")
\ No newline at end of file
@@ -0,0 +1,171 @@
+from datetime import timedelta
+import time
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from ..models.inbound_job import QUEUE_CONFIG
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestInboundQueue(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.account = cls.env['whatsapp.account'].create({
+            'name': 'Cuenta Test',
+            'app_uid': 'app-test',
+            'app_secret': 'secret-test',
+            'account_uid': 'account-test',
+            'phone_uid': 'phone-test',
+            'token': 'token-test',
+        })
+        cls.Job = cls.env['chatbot.whatsapp.inbound.job'].sudo()
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.dict(QUEUE_CONFIG, {
+            'max_attempts': 3, 'retry_backoff_seconds': 30, 'debounce_seconds': 3, 'debounce_max_wait_seconds': 15,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _job(self, phone, seconds_ago=60):
+        """Job pendiente de `phone` encolado hace `seconds_ago` segundos (sin cuerpo: no se encola solo)."""
+        message = self.env['whatsapp.message'].create({
+            'mobile_number': phone,
+            'wa_account_id': self.account.id,
+            'message_type': 'inbound',
+            'state': 'received',
+        })
+        moment = fields.Datetime.now() - timedelta(seconds=seconds_ago)
+        job = self.Job.create({
+            'message_id': message.id,
+            'mobile_number': phone,
+            'enqueued_at': moment,
+            'next_attempt_at': moment,
+        })
+        job.flush_recordset()
+        return job
+
+    def _failing_turn(self):
+        """Hace fallar el procesamiento del mensaje, como un error de OpenAI."""
+        return patch.object(
+            type(self.env['whatsapp.message']), '_chatbot_process_inbound',
+            side_effect=Exception("OpenAI no responde"),
+        )
+
+    def test_claim_marks_the_job_as_processing(self):
+        job = self._job('+5493581111111')
+
+        claimed = self.Job._claim_next_job()
+
+        self.assertEqual(claimed, job)
+        self.assertEqual(job.state, 'processing')
+        self.assertEqual(job.attempts, 1)
+        self.assertTrue(job.started_at)
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_job_waiting_for_retry_is_not_claimed(self):
+        job = self._job('+5493581111111')
+        job.next_attempt_at = fields.Datetime.now() + timedelta(minutes=5)
+        job.flush_recordset()
+
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = self._job('+5493581111111')
+        claimed = self.Job._claim_next_job()
+
+        with self._failing_turn():
+            claimed._run()
+
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, "OpenAI no responde")
+        self.assertGreater(job.next_attempt_at, fields.Datetime.now() + timedelta(seconds=25))
+        # Hasta que vence el backoff no se vuelve a tomar.
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_job_is_dead_after_max_attempts(self):
+        job = self._job('+5493581111111')
+        job.attempts = QUEUE_CONFIG['max_attempts'] - 1
+        claimed = self.Job._claim_next_job()
+
+        with self._failing_turn():
+            claimed._run()
+
+        self.assertEqual(job.state, 'dead')
+        self.assertEqual(job.attempts, QUEUE_CONFIG['max_attempts'])
+        self.assertEqual(job.last_error, "OpenAI no responde")
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_stalled_job_is_retried_with_backoff(self):
+        job = self._job('+5493581111111')
+        self.Job._claim_next_job()
+        job.started_at = fields.Datetime.now() - timedelta(days=1)
+
+        self.Job._requeue_stalled_jobs()
+
+        self.assertEqual(job.state, 'pending')
+        self.assertTrue(job.last_error)
+        self.assertGreater(job.next_attempt_at, fields.Datetime.now())
+
+    def test_stalled_job_is_dead_after_max_attempts(self):
+        job = self._job('+5493581111111')
+        job.attempts = QUEUE_CONFIG['max_attempts'] - 1
+        self.Job._claim_next_job()
+        job.started_at = fields.Datetime.now() - timedelta(days=1)
+
+        self.Job._requeue_stalled_jobs()
+
+        self.assertEqual(job.state, 'dead')
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_messages_of_a_phone_are_claimed_in_order(self):
+        first = self._job('+5493581111111', seconds_ago=60)
+        second = self._job('+5493581111111', seconds_ago=50)
+        other = self._job('+5493582222222', seconds_ago=40)
+        # El segundo no se agrupa en el primero: simula un mensaje que llegó mientras se procesaba.
+        first.state = 'processing'
+        first.flush_recordset()
+
+        # Mientras el primero está en proceso, el segundo del mismo teléfono espera; otro teléfono no.
+        self.assertEqual(self.Job._claim_next_job(), other)
+        self.assertFalse(self.Job._claim_next_job())
+
+        first.state = 'done'
+        first.flush_recordset()
+        self.assertEqual(self.Job._claim_next_job(), second)
+
+    def test_burst_is_coalesced_into_one_turn(self):
+        first = self._job('+5493581111111', seconds_ago=10)
+        second = self._job('+5493581111111', seconds_ago=8)
+        third = self._job('+5493581111111', seconds_ago=6)
+
+        claimed = self.Job._claim_next_job()
+
+        self.assertEqual(claimed, first)
+        self.assertEqual((second | third).mapped('state'), ['merged', 'merged'])
+        self.assertEqual((second | third).merged_into_id, first)
+        self.assertEqual(first._get_turn_messages(), (first | second | third).message_id)
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_burst_still_arriving_waits_for_debounce(self):
+        self._job('+5493581111111', seconds_ago=5)
+        self._job('+5493581111111', seconds_ago=0)
+
+        self.assertFalse(self.Job._claim_next_job())
+
+    def test_dead_job_takes_its_merged_messages_with_it(self):
+        first = self._job('+5493581111111', seconds_ago=10)
+        second = self._job('+5493581111111', seconds_ago=8)
+        claimed = self.Job._claim_next_job()
+        claimed.attempts = QUEUE_CONFIG['max_attempts']
+
+        claimed._mark_failed("OpenAI no responde", time.monotonic())
+
+        self.assertEqual((first | second).mapped('state'), ['dead', 'dead'])
+        self.assertEqual(second.last_error, "OpenAI no responde")
\ No newline at end of file
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models import intent_cache
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestIntentCache(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.IntentCache = cls.env['chatbot.intent.cache']
+        cls.history = [{'role': 'user', 'content': 'Hola!'}]
+
+    def setUp(self):
+        super().setUp()
+        # store() escribe con un cursor propio: en modo test comparte la transacción del test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        intent_cache._local_cache.clear()
+        intent_cache._pending_hits.clear()
+        self.addCleanup(intent_cache._local_cache.clear)
+
+    def _entry(self, key):
+        return self.IntentCache.search([('key', '=', key)])
+
+    def test_store_then_lookup(self):
+        key = self.IntentCache.make_key("prompt de intenciones", self.history)
+        self.assertIsNone(self.IntentCache.lookup(key))
+
+        self.IntentCache.store(key, 'saludo', sample_text='hola', classifier='general')
+        # Sin el LRU del proceso la intención se lee de la tabla, compartida por los workers.
+        intent_cache._local_cache.clear()
+
+        self.assertEqual(self.IntentCache.lookup(key), 'saludo')
+        self.assertEqual(self.IntentCache.lookup(key), 'saludo')
+        self.IntentCache.flush_hits()
+        self.assertEqual(self._entry(key).hits, 1)
+        self.assertEqual(self._entry(key).classifier, 'general')
+
+    def test_key_ignores_case_and_punctuation_but_not_the_prompt(self):
+        key = self.IntentCache.make_key("prompt de intenciones", self.history)
+        self.assertEqual(key, self.IntentCache.make_key("prompt de intenciones", [{'role': 'user', 'content': '  hola '}]))
+        self.assertNotEqual(key, self.IntentCache.make_key("otro prompt", self.history))
+
+    def test_other_prompt_version_is_a_miss(self):
+        with patch.object(intent_cache, 'prompts_version', 'version-vieja'):
+            old_key = self.IntentCache.make_key("prompt de intenciones", self.history)
+            self.IntentCache.store(old_key, 'saludo')
+        intent_cache._local_cache.clear()
+
+        self.assertNotEqual(old_key, self.IntentCache.make_key("prompt de intenciones", self.history))
+        self.assertIsNone(self.IntentCache.lookup(old_key))
+
+    def test_purge_drops_expired_and_outdated_entries(self):
+        self.IntentCache.store('vigente', 'saludo')
+        self.IntentCache.store('vencida', 'saludo')
+        with patch.object(intent_cache, 'prompts_version', 'version-vieja'):
+            self.IntentCache.store('vieja', 'saludo')
+        self.env.cr.execute(
+            "UPDATE chatbot_intent_cache SET expires_at = (now() at time zone 'UTC') - interval '1 minute' WHERE key = 'vencida'"
+        )
+
+        self.IntentCache.purge_stale_entries()
+
+        self.assertEqual(self.IntentCache.search([('key', 'in', ['vigente', 'vencida', 'vieja'])]).mapped('key'), ['vigente'])
+
+    def test_failed_store_does_not_fail_the_turn(self):
+        with patch.object(self.registry, 'cursor', side_effect=Exception("pool de conexiones agotado")):
+            self.IntentCache.store('sin-conexion', 'saludo')
+
+        self.assertFalse(self._entry('sin-conexion'))
\ No newline at end of file
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import openai
+
+from odoo.tests import TransactionCase, tagged
+
+from ..utils import llm_ledger, metrics, openai_client
+from .stub_openai_server import StubOpenAIServer
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestLlmLedger(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubOpenAIServer().start()
+        cls.addClassCleanup(cls.stub.stop)
+        cls.stub.add_rule('clasificador', 'saludo')
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente Ledger'})
+
+    def setUp(self):
+        super().setUp()
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param('openai.api_key', 'sk-test')
+        params.set_param('openai.api_base', self.stub.url)
+        openai_client.clear_credentials_cache()
+        self.addCleanup(openai_client.clear_credentials_cache)
+        metrics.ledger_writer.flush(self.env)
+        self.env.cr.execute("DELETE FROM chatbot_llm_call")
+        self.env.cr.execute("DELETE FROM chatbot_llm_call_daily")
+
+    def _call(self, task):
+        return openai_client.chat_completion(
+            self.env,
+            [{"role": "system", "content": "Sos un clasificador"}, {"role": "user", "content": "hola"}],
+            task=task,
+        )
+
+    def test_turn_calls_are_recorded_with_intent_and_partner(self):
+        with metrics.collect(self.env):
+            metrics.set_labels(partner_id=self.partner.id, partner_name=self.partner.name)
+            self._call('detect_intention')
+            self.stub.fail(1, status=400)
+            with self.assertRaises(openai.error.InvalidRequestError):
+                self._call('greeting')
+            # La intención se conoce después de la primera llamada y aplica a todo el turno.
+            metrics.set_labels(intent='saludo')
+
+        metrics.ledger_writer.flush(self.env)
+        calls = self.env['chatbot.llm.call'].search([], order='task')
+        self.assertEqual(calls.mapped('task'), ['detect_intention', 'greeting'])
+        self.assertEqual(set(calls.mapped('intent')), {'saludo'})
+        self.assertEqual(set(calls.mapped('partner_ref')), {self.partner.id})
+
+        ok, failed = calls
+        self.assertEqual(ok.outcome, 'ok')
+        self.assertEqual((ok.prompt_tokens, ok.completion_tokens), (4, 1))
+        self.assertAlmostEqual(ok.cost, llm_ledger.call_cost(ok.model, 4, 1))
+        self.assertEqual(failed.outcome, 'error')
+        self.assertIn('InvalidRequestError', failed.error)
+
+    def test_calls_are_buffered(self):
+        self._call('faq')
+        self.assertFalse(self.env['chatbot.llm.call'].search([]))
+        metrics.ledger_writer.flush(self.env)
+        self.assertEqual(self.env['chatbot.llm.call'].search([]).task, 'faq')
+
+    def test_daily_rollup(self):
+        yesterday = datetime.utcnow().replace(hour=12) - timedelta(days=1)
+        Call = self.env['chatbot.llm.call']
+        for latency, outcome in ((100, 'ok'), (300, 'ok'), (900, 'error')):
+            Call.create({
+                'called_at': yesterday, 'task': 'faq', 'model': 'gpt-4o-mini', 'intent': 'pregunta_frecuente',
+                'outcome': outcome, 'latency_ms': latency, 'prompt_tokens': 100, 'completion_tokens': 10, 'cost': 0.5,
+            })
+        Call.create({'called_at': datetime.utcnow(), 'task': 'faq', 'model': 'gpt-4o-mini', 'outcome': 'ok'})
+
+        Call.rollup_daily()
+
+        daily = self.env['chatbot.llm.call.daily'].search([])
+        self.assertEqual(len(daily), 1, "Las llamadas de hoy se resumen recién mañana.")
+        self.assertEqual(daily.date, yesterday.date())
+        self.assertEqual((daily.call_count, daily.error_count), (3, 1))
+        self.assertEqual((daily.prompt_tokens, daily.completion_tokens), (300, 30))
+        self.assertAlmostEqual(daily.cost, 1.5)
+        self.assertAlmostEqual(daily.latency_avg_ms, 433.33, places=2)
+        self.assertGreater(daily.latency_p95_ms, 800)
\ No newline at end of file
@@ -0,0 +1,90 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import SUPERUSER_ID, api, fields
+from odoo.tests import TransactionCase, tagged
+
+from ..models.conversation_context import ConversationContext
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestMemoryLifecycle(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Memory = cls.env['chatbot.whatsapp.memory']
+        cls.Archive = cls.env['chatbot.whatsapp.cart.archive']
+        cls.product = cls.env['product.product'].create({'name': 'Lavandina Test'})
+        cls.idle_since = fields.Datetime.now() - timedelta(days=1)
+
+    def _session(self, name, idle=True, **vals):
+        partner = self.env['res.partner'].create({'name': name})
+        memory = self.Memory.create({'partner_id': partner.id, **vals})
+        if idle:
+            memory.write({'timestamp': self.idle_since})
+        return memory
+
+    def test_idle_session_is_removed_and_its_cart_archived(self):
+        with_cart = self._session('Cliente Carrito', flow_state='esperando_confirmacion_pedido', cart_line_ids=[
+            (0, 0, {'product_id': self.product.id, 'quantity': 3}),
+        ])
+        without_cart = self._session('Cliente Sin Carrito')
+        active = self._session('Cliente Activo', idle=False)
+        paused = self._session('Cliente Atendido', human_takeover=True)
+        partner = with_cart.partner_id
+        self.env.flush_all()
+
+        self.Memory.clean_old_memory()
+
+        self.assertFalse((with_cart | without_cart).exists())
+        self.assertEqual((active | paused).exists(), active | paused)
+        archive = self.Archive.search([('partner_id', '=', partner.id)])
+        self.assertEqual(len(archive), 1)
+        self.assertEqual(archive.lines, [[self.product.id, 3]])
+        self.assertEqual(archive.total_qty, 3)
+        self.assertEqual(archive.flow_state, 'esperando_confirmacion_pedido')
+        self.assertFalse(self.Archive.search([('partner_id', '=', without_cart.partner_id.id)]))
+
+    def test_session_in_use_is_skipped(self):
+        # Dos transacciones reales (el turno y el cron): la sesión tiene que estar confirmada.
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            partner_id = env['res.partner'].create({'name': 'Cliente En Curso'}).id
+            memory_id = env['chatbot.whatsapp.memory'].create({'partner_id': partner_id}).id
+            cr.execute(
+                "UPDATE chatbot_whatsapp_memory SET timestamp = %s WHERE id = %s", (self.idle_since, memory_id)
+            )
+        self.addCleanup(self._delete_committed, memory_id, partner_id)
+
+        with self.registry.cursor() as turn_cr, self.registry.cursor() as cron_cr:
+            turn_env = api.Environment(turn_cr, SUPERUSER_ID, {})
+            ConversationContext.load(turn_env, turn_env['res.partner'].browse(partner_id))
+
+            cron_env = api.Environment(cron_cr, SUPERUSER_ID, {})
+            cron_env['chatbot.whatsapp.memory'].clean_old_memory(auto_commit=False)
+            cron_cr.execute("SELECT 1 FROM chatbot_whatsapp_memory WHERE id = %s", (memory_id,))
+            still_there = cron_cr.fetchone()
+            cron_cr.rollback()
+            turn_cr.rollback()
+
+        self.assertTrue(still_there)
+
+    def _delete_committed(self, memory_id, partner_id):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['chatbot.whatsapp.memory'].browse(memory_id).exists().unlink()
+            env['res.partner'].browse(partner_id).exists().unlink()
+
+    def test_takeover_reactivation_is_scheduled_at_its_due_time(self):
+        cron = self.env.ref('chatbot_whatsapp.ir_cron_chatbot_reactivate_takeover')
+        until = fields.Datetime.now() + timedelta(hours=2)
+
+        with patch.object(type(cron), '_trigger', autospec=True) as trigger:
+            memory = self._session('Cliente Atendido', idle=False, human_takeover=True, takeover_until=until)
+        trigger.assert_called_once_with(cron, at=until)
+
+        later = until + timedelta(hours=1)
+        with patch.object(type(cron), '_trigger', autospec=True) as trigger:
+            memory.write({'takeover_until': later})
+        trigger.assert_called_once_with(cron, at=later)
\ No newline at end of file
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from odoo.tests import TransactionCase, tagged
+
+from ..utils import metrics
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestMetrics(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        # Spans que otros tests hayan dejado en el buffer del proceso.
+        metrics.span_writer.flush(self.env)
+        self.env.cr.execute("DELETE FROM chatbot_metric_span")
+
+    def _record(self, stage, intent, *durations_ms):
+        metrics.span_writer.add(self.env, [(stage, intent, ms, datetime.utcnow()) for ms in durations_ms])
+
+    def test_turn_spans_carry_the_detected_intent(self):
+        with metrics.collect(self.env, stage='turn'):
+            with metrics.span('partner_resolution'):
+                pass
+            with metrics.span('intent_detection'):
+                metrics.set_labels(intent='saludo')
+
+        rows = self.env['chatbot.metric.span'].get_stage_percentiles()
+        self.assertEqual(
+            {(row['stage'], row['intent']) for row in rows if row['intent']},
+            {('turn', 'saludo'), ('partner_resolution', 'saludo'), ('intent_detection', 'saludo')},
+        )
+
+    def test_stage_percentiles_by_intent(self):
+        self._record('product_lookup', 'crear_pedido', 10, 20, 30, 40, 1000)
+        self._record('product_lookup', 'consulta_producto', 5)
+
+        rows = self.env['chatbot.metric.span'].get_stage_percentiles()
+        lookup = {row['intent']: row for row in rows if row['stage'] == 'product_lookup'}
+
+        self.assertEqual(lookup[None]['count'], 6)
+        self.assertEqual(lookup['crear_pedido']['count'], 5)
+        self.assertEqual(lookup['crear_pedido']['quantiles'][0.5], 30)
+        self.assertGreater(lookup['crear_pedido']['quantiles'][0.99], 900)
+        self.assertEqual(lookup['consulta_producto']['sum_ms'], 5)
+
+    def test_prometheus_text(self):
+        self._record('product_lookup', 'saludo', 12)
+        text = self.env['chatbot.metric.span'].render_prometheus()
+        self.assertIn('# TYPE chatbot_stage_duration_seconds gauge', text)
+        self.assertIn('chatbot_stage_duration_seconds{stage="product_lookup",intent="saludo",quantile="0.5"} 0.012000', text)
+        self.assertIn('chatbot_stage_window_spans{stage="product_lookup",intent="all"} 1', text)
+        self.assertNotIn('_count{', text)
+        self.assertIn('chatbot_inbound_queue_depth ', text)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import time
+
+import openai
+
+from odoo.tests import TransactionCase, tagged
+
+from ..utils import llm_pool, openai_client
+from .stub_openai_server import StubOpenAIServer
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestOpenAIClient(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubOpenAIServer().start()
+        cls.addClassCleanup(cls.stub.stop)
+        cls.stub.add_rule('clasificador', 'saludo')
+
+    def setUp(self):
+        super().setUp()
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param('openai.api_key', 'sk-test')
+        params.set_param('openai.api_base', self.stub.url)
+        openai_client.clear_credentials_cache()
+        self.addCleanup(openai_client.clear_credentials_cache)
+        self.stub.requests.clear()
+        self.stub.latency = 0.0
+        self.stub.fail_next = 0
+
+    def _call(self, **kwargs):
+        return openai_client.chat_completion(
+            self.env,
+            [{"role": "system", "content": "Sos un clasificador"}, {"role": "user", "content": "hola"}],
+            task='test',
+            **kwargs
+        )
+
+    def test_completion_and_usage(self):
+        calls = []
+        openai_client.register_call_listener(calls.append)
+        self.addCleanup(openai_client._call_listeners.remove, calls.append)
+
+        resp = self._call()
+
+        self.assertEqual(resp.choices[0].message.content, 'saludo')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0]['task'], 'test')
+        self.assertEqual(calls[0]['outcome'], 'ok')
+        self.assertGreater(calls[0]['prompt_tokens'], 0)
+
+    def test_retries_transient_errors(self):
+        self.stub.fail(2, status=503)
+        resp = self._call()
+        self.assertEqual(resp.choices[0].message.content, 'saludo')
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_does_not_retry_client_errors(self):
+        self.stub.fail(1, status=400)
+        with self.assertRaises(openai.error.InvalidRequestError):
+            self._call()
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_timeout(self):
+        self.stub.latency = 0.5
+        with self.assertRaises(openai.error.Timeout):
+            self._call(timeout=0.1)
+
+    def test_api_key_is_cached(self):
+        self._call()
+        self.env['ir.config_parameter'].sudo().set_param('openai.api_key', False)
+        # Se sigue usando la key cacheada hasta que se limpie el cache.
+        self._call()
+        openai_client.clear_credentials_cache()
+        with self.assertRaises(openai.error.AuthenticationError):
+            self._call()
+
+    def test_parallel_calls_take_about_as_long_as_the_slowest(self):
+        self.stub.latency = 0.3
+        calls = [{
+            'messages': [{"role": "system", "content": "Sos un clasificador"}, {"role": "user", "content": f"item {i}"}],
+            'task': 'test',
+        } for i in range(4)]
+
+        start = time.monotonic()
+        results = llm_pool.parallel_chat_completions(self.env, calls)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual([r.choices[0].message.content for r in results], ['saludo'] * 4)
+        self.assertLess(elapsed, 0.3 * 2)
+
+    def test_parallel_call_errors_are_returned_in_place(self):
+        self.stub.fail(1, status=400)
+        results = llm_pool.parallel_chat_completions(self.env, [
+            {'messages': [{"role": "user", "content": "hola"}], 'task': 'test'},
+        ])
+        self.assertIsInstance(results[0], openai.error.InvalidRequestError)
\ No newline at end of file
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from .stub_graph_api import StubGraphAPIServer
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestOutboundQueue(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubGraphAPIServer().start()
+        cls.addClassCleanup(cls.stub.stop)
+        cls.account = cls.env['whatsapp.account'].create({
+            'name': 'Cuenta Test',
+            'app_uid': 'app-test',
+            'app_secret': 'secret-test',
+            'account_uid': 'account-test',
+            'phone_uid': 'phone-test',
+            'token': 'token-test',
+        })
+        # Mensaje entrante al que responde el bot (sin cuerpo, así no se encola para procesar).
+        cls.inbound = cls.env['whatsapp.message'].create({
+            'mobile_number': '+5493581234567',
+            'wa_account_id': cls.account.id,
+            'message_type': 'inbound',
+            'state': 'received',
+        })
+        cls.Outbound = cls.env['chatbot.whatsapp.outbound']
+
+    def setUp(self):
+        super().setUp()
+        self.stub.requests.clear()
+        self.stub.fail_next = 0
+        patcher = self.stub.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enqueue_does_not_call_the_api(self):
+        outbound = self.Outbound.enqueue(self.inbound, "Hola 👋")
+        self.assertEqual(outbound.state, 'pending')
+        self.assertFalse(outbound.message_id)
+        self.assertFalse(self.stub.requests)
+
+    def test_consecutive_messages_are_merged(self):
+        first = self.Outbound.enqueue(self.inbound, "Agregué 2 x Lavandina.")
+        second = self.Outbound.enqueue(self.inbound, "Agregué 1 x Detergente.")
+        third = self.Outbound.enqueue(self.inbound, "¿Confirmamos el pedido?")
+
+        self.Outbound.dispatch_pending(auto_commit=False)
+
+        self.assertEqual(self.stub.sent_bodies(), [
+            "Agregué 2 x Lavandina.\n\nAgregué 1 x Detergente.\n\n¿Confirmamos el pedido?"
+        ])
+        self.assertEqual(first.state, 'sent')
+        self.assertEqual((second | third).mapped('state'), ['merged', 'merged'])
+        self.assertEqual((second | third).merged_into_id, first)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        outbound = self.Outbound.enqueue(self.inbound, "Tu pedido fue creado.")
+        self.stub.fail(1)
+
+        self.Outbound.dispatch_pending(auto_commit=False)
+        self.assertEqual(outbound.state, 'pending')
+        self.assertEqual(outbound.attempts, 1)
+        self.assertTrue(outbound.last_error)
+        self.assertGreater(outbound.next_attempt_at, fields.Datetime.now())
+
+        # Hasta que vence el backoff no se reintenta.
+        self.Outbound.dispatch_pending(auto_commit=False)
+        self.assertEqual(outbound.attempts, 1)
+
+        outbound.next_attempt_at = fields.Datetime.now() - timedelta(seconds=1)
+        self.Outbound.dispatch_pending(auto_commit=False)
+        self.assertEqual(outbound.state, 'sent')
+        self.assertEqual(outbound.attempts, 2)
+        self.assertEqual(self.stub.sent_bodies(), ["Tu pedido fue creado."])
\ No newline at end of file
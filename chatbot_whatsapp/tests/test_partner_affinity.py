@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models.intent_handlers.create_order import resolve_product_queries
+from ..utils import intent_classifier
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestPartnerAffinity(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pricelist = cls.env['product.pricelist'].create({'name': 'Lista Historial'})
+        cls.partner = cls.env['res.partner'].create({
+            'name': 'Cliente Historial',
+            'property_product_pricelist': cls.pricelist.id,
+        })
+        Product = cls.env['product.product']
+        cls.strong = Product.create({'name': 'Escobillón Omega Fuerte', 'is_storable': True, 'list_price': 1500})
+        cls.soft = Product.create({'name': 'Escobillón Omega Suave', 'is_storable': True, 'list_price': 1400})
+        cls.bleach = Product.create({'name': 'Lavandina Omega', 'is_storable': True, 'list_price': 900})
+        stock = cls.env.ref('stock.stock_location_stock')
+        for product in (cls.strong, cls.soft, cls.bleach):
+            cls.env['stock.quant']._update_available_quantity(product, stock, 20)
+        cls.Affinity = cls.env['chatbot.partner.affinity'].sudo()
+
+    def _confirmed_order(self, lines, days_ago=0):
+        order = self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'order_line': [(0, 0, {'product_id': product.id, 'product_uom_qty': qty}) for product, qty in lines],
+        })
+        order.action_confirm()
+        if days_ago:
+            # La confirmación fija la fecha del pedido en ahora: se lleva al pasado y se recalcula.
+            order.date_order = datetime.now() - timedelta(days=days_ago)
+            self.env.flush_all()
+            self.Affinity.refresh_partners(self.partner)
+        return order
+
+    def test_confirmation_updates_history(self):
+        self._confirmed_order([(self.soft, 3)], days_ago=10)
+        self._confirmed_order([(self.soft, 5)])
+        row = self.Affinity.search([('partner_id', '=', self.partner.id)])
+        self.assertEqual(row.product_id, self.soft)
+        self.assertEqual(row.product_tmpl_id, self.soft.product_tmpl_id)
+        self.assertEqual((row.order_count, row.total_qty, row.last_qty), (2, 8, 5))
+
+    def test_cancelled_order_leaves_history(self):
+        order = self._confirmed_order([(self.strong, 1)])
+        self.assertTrue(self.Affinity.search([('partner_id', '=', self.partner.id)]))
+        order._action_cancel()
+        self.assertFalse(self.Affinity.search([('partner_id', '=', self.partner.id)]))
+
+    def test_generic_request_picks_purchased_variant(self):
+        [result] = resolve_product_queries(self.env, self.partner, [{'query': 'escobillon omega', 'quantity': 2}])
+        self.assertEqual(len(result['variants']), 2)
+        self.assertFalse(result['from_history'])
+
+        self._confirmed_order([(self.soft, 1)], days_ago=3)
+        [result] = resolve_product_queries(self.env, self.partner, [{'query': 'escobillon omega', 'quantity': 2}])
+        self.assertEqual([v['id'] for v in result['variants']], [self.soft.id])
+        self.assertTrue(result['from_history'])
+
+    def test_two_purchased_variants_need_repeated_orders(self):
+        self._confirmed_order([(self.strong, 1)], days_ago=20)
+        self._confirmed_order([(self.soft, 1)], days_ago=5)
+        candidates = [[self.strong.id, self.soft.id]]
+        self.assertEqual(self.Affinity.preferred_variants(self.partner, candidates), {})
+
+        self._confirmed_order([(self.soft, 1)])
+        self.assertEqual(self.Affinity.preferred_variants(self.partner, candidates), {0: self.soft.id})
+
+    def test_last_order_lines_in_one_query(self):
+        self._confirmed_order([(self.strong, 1), (self.bleach, 6)], days_ago=15)
+        self._confirmed_order([(self.soft, 2), (self.bleach, 4)])
+        self.env.flush_all()
+        with self.assertQueryCount(1):
+            lines = self.Affinity.last_order_lines(self.partner)
+        self.assertEqual(sorted(lines), sorted([(self.soft.id, 2), (self.bleach.id, 4)]))
+
+    def test_repeat_order_is_classified_locally(self):
+        intent, _confidence, source = intent_classifier.classify('general', 'Repetime el último pedido!')
+        self.assertEqual((intent, source), ('repetir_pedido', 'rule'))
\ No newline at end of file
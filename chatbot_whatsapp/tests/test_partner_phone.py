@@ -0,0 +1,42 @@
+from odoo.tests import TransactionCase, tagged
+
+from ..utils.utils import phone_variants
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestPartnerPhone(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.PartnerPhone = cls.env['chatbot.partner.phone']
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente Test', 'mobile': '+54 9 358 461-1111'})
+
+    def test_phone_variants_with_and_without_mobile_nine(self):
+        self.assertEqual(phone_variants('+54 9 358 461-1111'), {'+5493584611111', '+543584611111'})
+        self.assertEqual(phone_variants('+54 358 461-1111'), {'+5493584611111', '+543584611111'})
+        self.assertEqual(phone_variants('+1 (555) 010-9999'), {'+15550109999'})
+        self.assertEqual(phone_variants(''), set())
+
+    def test_find_partner_by_any_variant(self):
+        self.assertEqual(self.PartnerPhone.find_partner('+5493584611111'), self.partner)
+        self.assertEqual(self.PartnerPhone.find_partner('+543584611111'), self.partner)
+        self.assertFalse(self.PartnerPhone.find_partner('+5493580000000'))
+
+    def test_number_change_is_seen_immediately(self):
+        self.assertEqual(self.PartnerPhone.find_partner('+5493584611111'), self.partner)
+        self.partner.mobile = '+54 9 358 461-2222'
+
+        self.assertFalse(self.PartnerPhone.find_partner('+5493584611111'))
+        self.assertEqual(self.PartnerPhone.find_partner('+5493584612222'), self.partner)
+
+    def test_changes_from_other_processes_are_seen_immediately(self):
+        # Cambios escritos directo en la base, como los de otro worker.
+        self.assertEqual(self.PartnerPhone.find_partner('+5493584611111'), self.partner)
+        self.env.cr.execute("UPDATE res_partner SET active = false WHERE id = %s", (self.partner.id,))
+        self.assertFalse(self.PartnerPhone.find_partner('+5493584611111'))
+
+        self.env.cr.execute("UPDATE res_partner SET active = true WHERE id = %s", (self.partner.id,))
+        self.assertEqual(self.PartnerPhone.find_partner('+5493584611111'), self.partner)
+        self.env.cr.execute("DELETE FROM chatbot_partner_phone WHERE partner_id = %s", (self.partner.id,))
+        self.assertFalse(self.PartnerPhone.find_partner('+5493584611111'))
\ No newline at end of file
@@ -0,0 +1,51 @@
+from odoo.tests import TransactionCase, tagged
+
+from ..models.conversation_context import ConversationContext
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestPartnerProfile(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Tag = cls.env['res.partner.category']
+        parent = Tag.search([('name', '=', 'Tipo de Cliente'), ('parent_id', '=', False)], limit=1) \
+            or Tag.create({'name': 'Tipo de Cliente'})
+        cls.tag_b2c = Tag.create({'name': 'Consumidor Final', 'parent_id': parent.id})
+        cls.tag_company = Tag.create({'name': 'EMPRESA', 'parent_id': parent.id})
+        cls.partner = cls.env['res.partner'].create({'name': 'Cliente Perfil', 'category_id': [(6, 0, cls.tag_b2c.ids)]})
+        cls.Profile = cls.env['chatbot.partner.profile'].sudo()
+
+    def test_profile_is_computed_and_stored(self):
+        profile = self.Profile.get_profile(self.partner)
+        self.assertEqual(profile['customer_type'], 'Consumidor Final')
+        self.assertTrue(profile['is_b2c'])
+        self.assertFalse(profile['has_quote'])
+        self.assertEqual(profile['website_url'], 'https://www.quimicacristal.com.ar')
+        self.assertEqual(self.Profile.search_count([('partner_id', '=', self.partner.id)]), 1)
+
+        # Con el perfil guardado, la lectura de cada turno es una sola consulta.
+        self.env.flush_all()
+        with self.assertQueryCount(1):
+            self.assertEqual(self.Profile.get_profile(self.partner), profile)
+
+    def test_category_change_updates_profile(self):
+        self.Profile.get_profile(self.partner)
+        self.partner.write({'category_id': [(6, 0, self.tag_company.ids)]})
+        profile = self.Profile.get_profile(self.partner)
+        self.assertEqual(profile['customer_type'], 'EMPRESA')
+        self.assertFalse(profile['is_b2c'])
+        self.assertEqual(profile['website_url'], 'https://www.cristalempresas.com.ar')
+
+    def test_new_quotation_marks_partner_as_quoted(self):
+        ctx = ConversationContext.load(self.env, self.partner)
+        self.assertFalse(ctx.is_quoted)
+        self.env['sale.order'].create({'partner_id': self.partner.id})
+        self.assertTrue(self.Profile.get_profile(self.partner)['has_quote'])
+
+    def test_pricelist_change_updates_profile(self):
+        self.Profile.get_profile(self.partner)
+        pricelist = self.env['product.pricelist'].create({'name': 'Lista Perfil'})
+        self.partner.write({'property_product_pricelist': pricelist.id})
+        self.assertEqual(self.Profile.get_profile(self.partner)['pricelist_id'], pricelist.id)
\ No newline at end of file
@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models import price_cache
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestPriceCache(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Product = cls.env['product.product']
+        cls.escobillon = Product.create({'name': 'Escobillón Zeta', 'list_price': 1500})
+        cls.lavandina = Product.create({'name': 'Lavandina Zeta', 'list_price': 900})
+        cls.pricelist = cls.env['product.pricelist'].create({
+            'name': 'Lista Test',
+            'item_ids': [(0, 0, {
+                'applied_on': '0_product_variant',
+                'product_id': cls.escobillon.id,
+                'min_quantity': 10,
+                'compute_price': 'fixed',
+                'fixed_price': 1200,
+            })],
+        })
+        cls.PriceCache = cls.env['chatbot.price.cache']
+
+    def setUp(self):
+        super().setUp()
+        # El cache escribe con un cursor propio: en modo test comparte la transacción del test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        price_cache._pending_hits.clear()
+
+    def _cached(self, product):
+        return self.PriceCache.search([('product_id', '=', product.id)])
+
+    def _no_price_rules(self):
+        return patch.object(
+            type(self.pricelist), '_compute_price_rule',
+            side_effect=AssertionError("no debería evaluar las reglas de precio"),
+        )
+
+    def test_hit_skips_price_rules(self):
+        self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon), {self.escobillon.id: 1500})
+
+        with self._no_price_rules():
+            prices = self.PriceCache.get_prices(self.pricelist, self.escobillon)
+
+        self.assertEqual(prices, {self.escobillon.id: 1500})
+
+    def test_price_is_cached_per_quantity(self):
+        self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon, 1)[self.escobillon.id], 1500)
+        self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon, 12)[self.escobillon.id], 1200)
+
+        with self._no_price_rules():
+            self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon, 1)[self.escobillon.id], 1500)
+            self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon, 12)[self.escobillon.id], 1200)
+        self.assertEqual(sorted(self._cached(self.escobillon).mapped('min_qty')), [1, 12])
+
+    def test_pricelist_item_change_drops_the_cache(self):
+        self.PriceCache.get_prices(self.pricelist, self.escobillon | self.lavandina)
+
+        self.pricelist.item_ids.fixed_price = 1100
+
+        self.assertFalse(self._cached(self.escobillon) | self._cached(self.lavandina))
+        self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon, 12)[self.escobillon.id], 1100)
+
+    def test_supplierinfo_change_drops_the_product_prices(self):
+        self.PriceCache.get_prices(self.pricelist, self.escobillon | self.lavandina)
+
+        self.env['product.supplierinfo'].create({
+            'partner_id': self.env['res.partner'].create({'name': 'Proveedor Test'}).id,
+            'product_tmpl_id': self.escobillon.product_tmpl_id.id,
+            'price': 700,
+        })
+
+        self.assertFalse(self._cached(self.escobillon))
+        self.assertTrue(self._cached(self.lavandina))
+
+    def test_list_price_change_drops_the_product_prices(self):
+        self.PriceCache.get_prices(self.pricelist, self.escobillon | self.lavandina)
+
+        self.escobillon.list_price = 1600
+
+        self.assertFalse(self._cached(self.escobillon))
+        self.assertTrue(self._cached(self.lavandina))
+        self.assertEqual(self.PriceCache.get_prices(self.pricelist, self.escobillon)[self.escobillon.id], 1600)
+
+    def test_warm_cache_refreshes_the_most_requested_prices(self):
+        products = self.escobillon | self.lavandina
+        for _i in range(3):
+            self.PriceCache.get_prices(self.pricelist, self.escobillon, 12)
+        self.PriceCache.get_prices(self.pricelist, self.lavandina, 12)
+        self.PriceCache.flush_hits()
+        # Los precios cacheados pasan a ser de ayer.
+        self.env.cr.execute("UPDATE chatbot_price_cache SET date = date - 1 WHERE product_id IN %s", (tuple(products.ids),))
+
+        with patch.dict(price_cache.PRICE_CACHE_CONFIG, {'warm_top_products': 1}):
+            self.PriceCache.warm_cache()
+
+        today = self.PriceCache.search([('product_id', 'in', products.ids)])
+        self.assertEqual(today.product_id, self.escobillon)
+        self.assertEqual(today.min_qty, 12)
+        self.assertEqual(today.price, 1200)
\ No newline at end of file
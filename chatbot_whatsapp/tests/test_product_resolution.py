@@ -0,0 +1,44 @@
+from odoo.tests import TransactionCase, tagged
+
+from ..models.intent_handlers.create_order import resolve_product_queries
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestProductResolution(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pricelist = cls.env['product.pricelist'].create({'name': 'Lista Test'})
+        cls.partner = cls.env['res.partner'].create({
+            'name': 'Cliente Test',
+            'property_product_pricelist': cls.pricelist.id,
+        })
+        Product = cls.env['product.product']
+        cls.escobillon = Product.create({'name': 'Escobillón Zeta', 'is_storable': True, 'list_price': 1500})
+        cls.blem = Product.create({'name': 'Blem Lustramuebles Zeta', 'is_storable': True, 'list_price': 2300})
+        cls.lavandina = Product.create({'name': 'Lavandina Zeta', 'is_storable': True, 'list_price': 900})
+        stock = cls.env.ref('stock.stock_location_stock')
+        Quant = cls.env['stock.quant']
+        Quant._update_available_quantity(cls.escobillon, stock, 10)
+        Quant._update_available_quantity(cls.blem, stock, 1)
+
+    def test_resolves_every_query(self):
+        items = [
+            {'query': 'escobillones zeta', 'quantity': 3},
+            {'query': 'blem zeta', 'quantity': 2},
+            {'query': 'lavandina zeta', 'quantity': 1},
+            {'query': 'zzz inexistente', 'quantity': 1},
+        ]
+        results = resolve_product_queries(self.env, self.partner, items)
+
+        self.assertEqual([r['status'] for r in results], ['found', 'found', 'no_stock', 'not_found'])
+        self.assertEqual([v['id'] for v in results[0]['variants']], [self.escobillon.id])
+        self.assertEqual(results[0]['variants'][0]['price'], 1500)
+        self.assertEqual(results[1]['variants'][0]['stock'], 1)
+
+    def test_batch_search_matches_single_search(self):
+        Index = self.env['chatbot.product.search.index']
+        queries = ['escobillones zeta', 'lustramuebles', 'zeta', 'zzz inexistente']
+        batch = Index.search_products_batch(queries)
+        self.assertEqual(batch, [Index.search_products(query) for query in queries])
\ No newline at end of file
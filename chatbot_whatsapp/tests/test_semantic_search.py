@@ -0,0 +1,116 @@
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models.product_embedding import SEMANTIC_CONFIG
+from ..utils import embeddings
+from ..utils.vector_index import VectorStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SemanticSearchCase(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        if np is None:
+            self.skipTest("numpy no está instalado")
+        self.directory = tempfile.mkdtemp(prefix='chatbot_vectors_')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestSemanticSearch(SemanticSearchCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Product = cls.env['product.product']
+        cls.glass_cleaner = Product.create({
+            'name': 'Limpia Vidrios Cristal 500ml',
+            'description_sale': 'Líquido para limpiar vidrios y espejos',
+        })
+        cls.floor_cleaner = Product.create({
+            'name': 'Limpiador de Pisos Azul 900ml',
+            'description_sale': 'Líquido azul para pisos',
+        })
+        cls.bleach = Product.create({'name': 'Lavandina Clásica 1L'})
+        cls.Embedding = cls.env['chatbot.product.embedding'].sudo()
+
+    def setUp(self):
+        super().setUp()
+        self.startPatch(patch.dict(SEMANTIC_CONFIG, {'enabled': True, 'provider': 'hashing', 'dimensions': 256}))
+        self.startPatch(patch.object(type(self.Embedding), '_store_directory', return_value=self.directory))
+        self.Embedding.refresh_embeddings()
+
+    def _embedded_texts(self):
+        calls = []
+        original = embeddings.HashingEmbeddingProvider.embed
+
+        def spy(provider, env, texts):
+            calls.extend(texts)
+            return original(provider, env, texts)
+        return calls, patch.object(embeddings.HashingEmbeddingProvider, 'embed', spy)
+
+    def test_loose_descriptions_find_products(self):
+        glass, floor = self.Embedding.search_products_batch(
+            ['algo para limpiar vidrios', 'el líquido azul para pisos'], limit=3,
+        )
+        self.assertEqual(glass[:1], self.glass_cleaner)
+        self.assertEqual(floor[:1], self.floor_cleaner)
+
+    def test_only_changed_products_are_reembedded(self):
+        calls, spy = self._embedded_texts()
+        with spy:
+            self.Embedding.refresh_embeddings()
+            self.assertEqual(calls, [])
+
+            self.bleach.write({'description_sale': 'Lavandina concentrada para desinfectar'})
+            self.glass_cleaner.write({'list_price': 1234})
+            self.Embedding.refresh_embeddings()
+        self.assertEqual(len(calls), 1)
+        self.assertIn('desinfectar', calls[0])
+
+    def test_unsellable_products_leave_the_index(self):
+        store = self.Embedding._store()
+        self.assertIn(self.bleach.id, store.product_ids())
+        self.bleach.write({'sale_ok': False})
+        self.assertFalse(self.Embedding.search_products_batch(['lavandina clasica'])[0] & self.bleach)
+        self.Embedding.refresh_embeddings()
+        self.assertNotIn(self.bleach.id, store.product_ids())
+
+    def test_provider_change_rebuilds_the_index(self):
+        with patch.dict(SEMANTIC_CONFIG, {'dimensions': 64}):
+            self.assertFalse(self.Embedding.search_products_batch(['algo para limpiar vidrios'])[0])
+            self.Embedding.refresh_embeddings()
+            self.assertEqual(self.Embedding._store().key, 'hashing-64')
+            self.assertEqual(
+                self.Embedding.search_products_batch(['algo para limpiar vidrios'])[0][:1], self.glass_cleaner,
+            )
+
+
+# Fuera de la corrida normal: --test-tags chatbot_whatsapp_benchmark
+@tagged('-standard', 'post_install', '-at_install', 'chatbot_whatsapp_benchmark')
+class TestVectorSearchLatency(SemanticSearchCase):
+
+    def test_top_k_over_50k_variants(self):
+        rows, dimension = 50_000, SEMANTIC_CONFIG.get('dimensions', 256)
+        vectors = embeddings.normalize_rows(np.random.default_rng(0).standard_normal((rows, dimension)))
+        store = VectorStore(self.directory)
+        store.upsert('bench', list(range(1, rows + 1)), vectors)
+
+        store.search(vectors[:1], limit=10)
+        timings = []
+        for row in range(50):
+            start = time.perf_counter()
+            found = store.search(vectors[row:row + 1], limit=10)
+            timings.append((time.perf_counter() - start) * 1000)
+            self.assertEqual(found[0][0][0], row + 1)
+        timings.sort()
+        self.assertLess(timings[len(timings) // 2], 10, f"Búsqueda de vectores: p50 {timings[len(timings) // 2]:.1f}ms")
\ No newline at end of file
@@ -0,0 +1,84 @@
+from unittest.mock import patch
+
+from psycopg2 import IntegrityError
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import mute_logger
+
+
+@tagged('post_install', '-at_install', 'chatbot_whatsapp')
+class TestStockSnapshot(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Product = cls.env['product.product']
+        cls.escobillon = Product.create({'name': 'Escobillón Zeta', 'is_storable': True})
+        cls.lavandina = Product.create({'name': 'Lavandina Zeta', 'is_storable': True})
+        cls.stock = cls.env.ref('stock.stock_location_stock')
+        cls.Quant = cls.env['stock.quant']
+        cls.Quant._update_available_quantity(cls.escobillon, cls.stock, 10)
+        cls.Quant._update_available_quantity(cls.lavandina, cls.stock, 4)
+        cls.Snapshot = cls.env['chatbot.stock.snapshot']
+
+    def setUp(self):
+        super().setUp()
+        # El snapshot se escribe con un cursor propio: en modo test comparte la transacción del test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+    def _snapshots(self, product):
+        return self.Snapshot.search([('product_id', '=', product.id)])
+
+    def _watch_refresh(self):
+        return patch.object(type(self.Snapshot), '_refresh', autospec=True, side_effect=type(self.Snapshot)._refresh)
+
+    def test_only_missing_or_stale_rows_are_refreshed(self):
+        products = self.escobillon | self.lavandina
+        self.assertEqual(self.Snapshot.get_available_qty(products), {self.escobillon.id: 10, self.lavandina.id: 4})
+
+        with self._watch_refresh() as refresh:
+            self.assertEqual(self.Snapshot.get_available_qty(products), {self.escobillon.id: 10, self.lavandina.id: 4})
+        refresh.assert_not_called()
+
+        self.env.cr.execute(
+            "UPDATE chatbot_stock_snapshot SET refreshed_at = refreshed_at - interval '1 hour' WHERE product_id = %s",
+            (self.escobillon.id,),
+        )
+        with self._watch_refresh() as refresh:
+            self.Snapshot.get_available_qty(products)
+        refresh.assert_called_once()
+        self.assertEqual(refresh.call_args.args[1], self.escobillon)
+
+    def test_quant_changes_invalidate_the_snapshot(self):
+        self.Snapshot.get_available_qty(self.escobillon)
+        # Alta de un quant en otra ubicación.
+        shelf = self.env['stock.location'].create({'name': 'Estante Test', 'location_id': self.stock.id})
+        self.Quant._update_available_quantity(self.escobillon, shelf, 5)
+        self.assertFalse(self._snapshots(self.escobillon))
+        self.assertEqual(self.Snapshot.get_available_qty(self.escobillon)[self.escobillon.id], 15)
+
+        # Cambio de cantidad de un quant existente.
+        self.Quant._update_available_quantity(self.escobillon, shelf, -2)
+        self.assertFalse(self._snapshots(self.escobillon))
+        self.assertEqual(self.Snapshot.get_available_qty(self.escobillon)[self.escobillon.id], 13)
+
+        # Baja del quant.
+        self.Quant.search([('product_id', '=', self.escobillon.id), ('location_id', '=', shelf.id)]).unlink()
+        self.assertFalse(self._snapshots(self.escobillon))
+        self.assertEqual(self.Snapshot.get_available_qty(self.escobillon)[self.escobillon.id], 10)
+
+    def test_one_row_per_product_and_warehouse(self):
+        warehouse = self.env.ref('stock.warehouse0')
+        self.Snapshot._refresh(self.escobillon, None)
+        self.Snapshot._refresh(self.escobillon, None)
+        self.Snapshot._refresh(self.escobillon, warehouse.id)
+
+        snapshots = self._snapshots(self.escobillon)
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(sorted(snapshots.mapped('warehouse_id.id')), [warehouse.id])
+
+        # Sin almacén también es único: el índice usa COALESCE(warehouse_id, 0).
+        with self.assertRaises(IntegrityError), mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+            self.Snapshot.create({'product_id': self.escobillon.id, 'refreshed_at': fields.Datetime.now()}).flush_recordset()
\ No newline at end of file
@@ -0,0 +1,114 @@
+# embeddings.py
+"""
+Proveedores de embeddings para la búsqueda semántica de productos.
+
+Un proveedor convierte textos en vectores float32 de norma 1, así la similitud
+coseno es un producto punto. Se elige con semantic_search.provider:
+
+- 'openai': embeddings de OpenAI (openai.embedding_model) vía openai_client.
+- 'hashing': local y determinístico, sin red: términos normalizados (con sus
+  sinónimos) y trigramas de caracteres hasheados. Sirve para los tests y para
+  usar la búsqueda semántica sin API.
+
+Se pueden agregar otros con register_provider(). Requiere numpy; sin numpy
+is_available() devuelve False y la búsqueda semántica queda desactivada.
+"""
+import hashlib
+import logging
+
+from ..config.config import general_config
+from . import product_search
+from .openai_client import embed_texts
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_logger = logging.getLogger(__name__)
+
+SEMANTIC_CONFIG = general_config.get('semantic_search', {})
+
+_providers = {}
+
+
+if np is None:
+    _logger.warning("numpy no está instalado: la búsqueda semántica de productos está desactivada.")
+
+
+def is_available():
+    return np is not None
+
+
+def register_provider(name, provider_class):
+    """Registra una clase de proveedor (con key, dimension y embed(env, texts))."""
+    _providers[name] = provider_class
+
+
+def get_provider(name=None):
+    name = name or SEMANTIC_CONFIG.get('provider', 'openai')
+    if name not in _providers:
+        raise ValueError(f"Proveedor de embeddings desconocido: {name}")
+    return _providers[name](dimension=SEMANTIC_CONFIG.get('dimensions', 256))
+
+
+def normalize_rows(matrix):
+    """Lleva cada fila a norma 1 (las filas nulas quedan en cero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HashingEmbeddingProvider:
+    """Embeddings locales por feature hashing. Mismo texto, mismo vector, en cualquier proceso."""
+
+    WORD_WEIGHT = 1.0
+    TRIGRAM_WEIGHT = 0.5
+
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+        self.key = f"hashing-{dimension}"
+
+    def _features(self, text):
+        for term in product_search.terms(text):
+            for alternative in product_search.expand(term):
+                yield alternative, self.WORD_WEIGHT
+            padded = f"#{term}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], self.TRIGRAM_WEIGHT
+
+    def embed(self, env, texts):
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text or ''):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                sign = 1.0 if value & 1 else -1.0
+                matrix[row, (value >> 1) % self.dimension] += sign * weight
+        return normalize_rows(matrix)
+
+
+class OpenAIEmbeddingProvider:
+    """Embeddings de OpenAI, pedidos de a semantic_search.batch_size textos por llamada."""
+
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+        self.model = general_config.get('openai', {}).get('embedding_model', 'text-embedding-3-small')
+        self.key = f"openai-{self.model}-{dimension}"
+
+    def embed(self, env, texts):
+        batch_size = SEMANTIC_CONFIG.get('batch_size', 100)
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors += embed_texts(
+                env, [text or ' ' for text in texts[start:start + batch_size]],
+                task='product_embedding', model=self.model, dimensions=self.dimension,
+            )
+        if not vectors:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return normalize_rows(vectors)
+
+
+register_provider('hashing', HashingEmbeddingProvider)
+register_provider('openai', OpenAIEmbeddingProvider)
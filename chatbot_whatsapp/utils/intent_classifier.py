@@ -0,0 +1,219 @@
+# intent_classifier.py
+"""
+Clasificador local de intenciones, previo a la llamada a OpenAI.
+
+Primero se prueban reglas de alta confianza (saludos, agradecimientos, números,
+"si"/"no"/"cancelar", facturas...). Si ninguna aplica y hay un modelo entrenado
+para ese clasificador, se usa un TF-IDF + regresión logística entrenado con las
+intenciones que ya clasificó OpenAI (ver chatbot.intent.cache). La inferencia
+es Python puro a partir de un modelo serializado en JSON; scikit-learn solo
+hace falta para entrenar.
+
+Solo se devuelve una intención si la confianza supera el umbral configurado;
+el resto de los mensajes sigue su camino hacia OpenAI.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from ..config.config import general_config
+from .utils import normalize_text
+
+_logger = logging.getLogger(__name__)
+
+CLASSIFIER_CONFIG = general_config.get('local_classifier', {})
+
+GENERAL = 'general'
+ORDER_CONFIRMATION = 'order_confirmation'
+PRODUCT_SELECTION = 'product_selection'
+
+# Reglas: (clasificador, regex sobre el texto normalizado, intención, confianza).
+# Se evalúan con fullmatch, así no pisan mensajes con más contenido ("hola, quiero 3 blem").
+RULES = [
+    (GENERAL, r'(hola+|holis|buenas+|buen dia|buenos dias|buenas (tardes|noches)|hey|que tal)( que tal| como (andas|estas|va))?', 'saludo', 0.97),
+    (GENERAL, r'((muchas|mil) )?gracias( (por todo|igual|genio|crack))?|(ok|dale|listo|genial|perfecto|buenisimo),? (muchas )?gracias|chau|adios|hasta (luego|manana)|nos vemos', 'agradecimiento_cierre', 0.95),
+    (GENERAL, r'((quiero|necesito|me (pasas|mandas|envias)|pasame|mandame|enviame) )?(la |mi |mis |las |una )?(ultima )?facturas?( por favor)?', 'solicitar_factura', 0.95),
+    (GENERAL, r'((quiero|necesito) )?(repetir|repetime|repeti|repite)( (el|mi))?( ultimo)? (pedido|compra)( por favor)?|(quiero |mandame )?lo mismo (que|de) (la ultima vez|la otra vez|siempre)', 'repetir_pedido', 0.95),
+    (GENERAL, r'(cual es (el|su|tu) )?(horario|direccion|ubicacion)( de atencion)?|a que hora (abren|cierran)|donde (estan|quedan|queda el local)', 'consulta_horario_direccion', 0.95),
+
+    (ORDER_CONFIRMATION, r'no+|nop|nada( mas)?|no,? (gracias|nada( mas)?)|listo|eso es todo|eso( nomas)?|asi esta bien|esta bien asi|finalizar( pedido)?|terminar', 'finalizar_pedido', 0.95),
+    (ORDER_CONFIRMATION, r'(quiero )?(sacar|quitar|eliminar|borrar|cambiar|modificar|ver)( (el|mi) (pedido|carrito)| algo)?', 'modificar_pedido', 0.92),
+
+    (PRODUCT_SELECTION, r'(el |la )?\d{1,2}', 'seleccionar_producto', 0.99),
+    (PRODUCT_SELECTION, r'(el |la )?(primero|primera|segundo|segunda|tercero|tercera|ultimo|ultima)', 'seleccionar_producto', 0.95),
+    (PRODUCT_SELECTION, r'ninguno|ninguna|no,? gracias|por ahora no|cancelar|no quiero ninguno', 'cancelar_seleccion', 0.97),
+]
+_COMPILED_RULES = [(name, re.compile(pattern), intent, conf) for name, pattern, intent, conf in RULES]
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {
+    'rule_hits': 0, 'model_hits': 0, 'fallthrough': 0,
+    'shadow_checked': 0, 'shadow_agreed': 0, 'latency_ms_total': 0.0, 'calls': 0,
+})
+
+
+def tokenize(text):
+    return re.findall(r'\w+', normalize_text(text))
+
+
+def extract_features(text):
+    """Unigramas y bigramas, con el mismo formato que usa TfidfVectorizer(ngram_range=(1, 2))."""
+    tokens = tokenize(text)
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class LocalIntentModel:
+    """Inferencia de un TF-IDF + regresión logística exportado a JSON por train()."""
+
+    def __init__(self, data):
+        self.classes = data['classes']
+        self.vocabulary = data['vocabulary']
+        self.idf = data['idf']
+        self.coef = data['coef']
+        self.intercept = data['intercept']
+        self.metrics = data.get('metrics', {})
+
+    def predict(self, text):
+        counts = Counter(f for f in extract_features(text) if f in self.vocabulary)
+        if not counts:
+            return None, 0.0
+        vector = {self.vocabulary[f]: tf * self.idf[self.vocabulary[f]] for f, tf in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        scores = [
+            sum(row[i] * v / norm for i, v in vector.items()) + intercept
+            for row, intercept in zip(self.coef, self.intercept)
+        ]
+        if len(self.classes) == 2:
+            p = 1.0 / (1.0 + math.exp(-scores[0]))
+            probs = [1.0 - p, p]
+        else:
+            top = max(scores)
+            exps = [math.exp(s - top) for s in scores]
+            total = sum(exps)
+            probs = [e / total for e in exps]
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.classes[best], probs[best]
+
+
+def train(samples):
+    """
+    Entrena el modelo a partir de pares (texto, intención) y lo devuelve como
+    dict serializable a JSON, junto con la precisión medida sobre un holdout.
+    Requiere scikit-learn; devuelve None si no está instalado.
+    """
+    try:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.model_selection import train_test_split
+    except ImportError:
+        _logger.warning("scikit-learn no está instalado: el clasificador local solo usará reglas.")
+        return None
+
+    texts = [text for text, _intent in samples]
+    labels = [intent for _text, intent in samples]
+    if len(set(labels)) < 2:
+        return None
+
+    def fit(train_texts, train_labels):
+        vectorizer = TfidfVectorizer(analyzer=extract_features, min_df=2)
+        matrix = vectorizer.fit_transform(train_texts)
+        classifier = LogisticRegression(max_iter=1000, C=4.0)
+        classifier.fit(matrix, train_labels)
+        return vectorizer, classifier
+
+    threshold = CLASSIFIER_CONFIG.get('threshold', 0.85)
+    metrics = {'samples': len(samples)}
+    try:
+        train_texts, test_texts, train_labels, test_labels = train_test_split(
+            texts, labels, test_size=0.2, random_state=42, stratify=labels
+        )
+        vectorizer, classifier = fit(train_texts, train_labels)
+        probabilities = classifier.predict_proba(vectorizer.transform(test_texts))
+        confident = [
+            (classifier.classes_[row.argmax()], expected)
+            for row, expected in zip(probabilities, test_labels)
+            if row.max() >= threshold
+        ]
+        metrics.update({
+            'holdout_coverage': len(confident) / len(test_labels),
+            'holdout_precision': (
+                sum(1 for predicted, expected in confident if predicted == expected) / len(confident)
+                if confident else 0.0
+            ),
+        })
+    except ValueError:
+        # Muy pocos ejemplos de alguna clase para estratificar: se entrena sin holdout.
+        pass
+
+    vectorizer, classifier = fit(texts, labels)
+    vocabulary = {feature: int(index) for feature, index in vectorizer.vocabulary_.items()}
+    return {
+        'classes': [str(c) for c in classifier.classes_],
+        'vocabulary': vocabulary,
+        'idf': [float(v) for v in vectorizer.idf_],
+        'coef': [[float(v) for v in row] for row in classifier.coef_],
+        'intercept': [float(v) for v in classifier.intercept_],
+        'metrics': metrics,
+    }
+
+
+def classify(classifier_name, text, model=None):
+    """
+    Devuelve (intención, confianza, origen) si el mensaje se puede clasificar
+    localmente por encima del umbral, o (None, confianza, None) si no.
+    """
+    start = time.monotonic()
+    normalized = normalize_text(text).strip('.!¡¿?,; ')
+    intent, confidence, source = None, 0.0, None
+
+    for name, pattern, rule_intent, rule_confidence in _COMPILED_RULES:
+        if name == classifier_name and pattern.fullmatch(normalized):
+            intent, confidence, source = rule_intent, rule_confidence, 'rule'
+            break
+
+    if not intent and model is not None:
+        intent, confidence = model.predict(normalized)
+        source = 'model'
+
+    threshold = CLASSIFIER_CONFIG.get('threshold', 0.85)
+    if confidence < threshold:
+        intent, source = None, None
+
+    with _stats_lock:
+        stats = _stats[classifier_name]
+        stats['calls'] += 1
+        stats['latency_ms_total'] += (time.monotonic() - start) * 1000
+        if source == 'rule':
+            stats['rule_hits'] += 1
+        elif source == 'model':
+            stats['model_hits'] += 1
+        else:
+            stats['fallthrough'] += 1
+    return intent, confidence, source
+
+
+def record_shadow_check(classifier_name, local_intent, llm_intent):
+    """Registra si la clasificación local coincidió con la de OpenAI (muestreo de precisión)."""
+    with _stats_lock:
+        stats = _stats[classifier_name]
+        stats['shadow_checked'] += 1
+        if local_intent == llm_intent:
+            stats['shadow_agreed'] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        result = {}
+        for name, stats in _stats.items():
+            result[name] = dict(
+                stats,
+                avg_latency_ms=stats['latency_ms_total'] / stats['calls'] if stats['calls'] else 0.0,
+                local_ratio=(stats['rule_hits'] + stats['model_hits']) / stats['calls'] if stats['calls'] else 0.0,
+                shadow_precision=(
+                    stats['shadow_agreed'] / stats['shadow_checked'] if stats['shadow_checked'] else None
+                ),
+            )
+        return result
@@ -0,0 +1,56 @@
+# llm_ledger.py
+"""
+Registro de cada llamada a OpenAI en chatbot.llm.call: modelo, tokens,
+latencia, resultado, costo estimado, intención y contacto del turno.
+
+Las filas se acumulan en memoria y se escriben por lotes (llm_ledger.flush_size
+filas o cada llm_ledger.flush_interval_seconds) con el BufferedWriter de
+metrics: el registro no suma un INSERT sincrónico por llamada. Las llamadas
+hechas dentro de un turno (metrics.collect) se registran al cerrarlo, ya con
+la intención detectada.
+"""
+from datetime import datetime
+
+from ..config.config import general_config
+
+LEDGER_CONFIG = general_config.get('llm_ledger', {})
+
+LEDGER_COLUMNS = [
+    'called_at', 'task', 'model', 'intent', 'partner_ref', 'partner_name', 'outcome', 'error',
+    'attempts', 'latency_ms', 'estimated_prompt_tokens', 'prompt_tokens', 'completion_tokens', 'cost',
+]
+
+
+def is_enabled():
+    return LEDGER_CONFIG.get('enabled', True)
+
+
+def call_cost(model, prompt_tokens, completion_tokens):
+    """Costo estimado de una llamada según llm_ledger.pricing (precio por millón de tokens)."""
+    pricing = LEDGER_CONFIG.get('pricing', {})
+    prices = pricing.get(model) or pricing.get('default') or {}
+    return (
+        prompt_tokens * prices.get('prompt', 0.0)
+        + completion_tokens * prices.get('completion', 0.0)
+    ) / 1_000_000
+
+
+def ledger_row(stats, intent=None, partner_id=None, partner_name=None):
+    """Fila de chatbot_llm_call a partir de las estadísticas de chat_completion()."""
+    error = stats.get('error')
+    return (
+        stats.get('called_at') or datetime.utcnow(),
+        stats['task'],
+        stats['model'],
+        intent or None,
+        partner_id or None,
+        partner_name or None,
+        stats['outcome'],
+        error[:500] if error else None,
+        stats['attempts'],
+        stats['latency_ms'],
+        stats['estimated_prompt_tokens'],
+        stats['prompt_tokens'],
+        stats['completion_tokens'],
+        call_cost(stats['model'], stats['prompt_tokens'], stats['completion_tokens']),
+    )
\ No newline at end of file
@@ -0,0 +1,83 @@
+# llm_pool.py
+"""
+Ejecución concurrente de llamadas independientes a OpenAI.
+
+Un único pool de hilos por proceso (openai.max_concurrency) acota cuántas
+llamadas hay en vuelo sumando todas las conversaciones; además cada fan-out
+envía como mucho openai.fanout_max_parallel llamadas a la vez, para que un
+mensaje no acapare el pool y deje esperando al resto.
+
+Solo sirve para llamadas que no dependen entre sí. Las consultas por producto
+de un pedido no lo son: cada una se resuelve con la respuesta del cliente a la
+anterior, así que se hacen de a una.
+
+Los hilos del pool no tienen cursor ni entorno: las credenciales se leen antes
+en el hilo que llama y se pasan explícitamente a chat_completion().
+"""
+import contextvars
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .openai_client import OPENAI_CONFIG, chat_completion, get_credentials
+
+_logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, OPENAI_CONFIG.get('max_concurrency', 8)),
+                thread_name_prefix='chatbot-openai',
+            )
+        return _executor
+
+
+def parallel_chat_completions(env, calls):
+    """
+    Ejecuta en paralelo varias llamadas a chat_completion y devuelve sus
+    respuestas en el mismo orden. Cada elemento de `calls` son los argumentos
+    de chat_completion (messages, task, temperature...). Si una llamada falla,
+    en su lugar se devuelve la excepción, así el resto no se pierde.
+    """
+    if not calls:
+        return []
+    api_key, api_base = get_credentials(env)
+
+    def _call(kwargs):
+        try:
+            return chat_completion(None, api_key=api_key, api_base=api_base, **kwargs)
+        except Exception as e:
+            return e
+
+    if len(calls) == 1:
+        return [_call(calls[0])]
+
+    start = time.monotonic()
+    window = threading.BoundedSemaphore(max(1, OPENAI_CONFIG.get('fanout_max_parallel', 4)))
+
+    def _run(kwargs):
+        try:
+            return _call(kwargs)
+        finally:
+            window.release()
+
+    executor = _get_executor()
+    futures = []
+    for kwargs in calls:
+        window.acquire()
+        # Cada hilo corre con una copia del contexto, así sus llamadas se miden dentro del turno.
+        futures.append(executor.submit(contextvars.copy_context().run, _run, kwargs))
+    results = [future.result() for future in futures]
+    _logger.info(
+        f"🧵 {len(calls)} llamadas a OpenAI en paralelo ({calls[0].get('task')}) "
+        f"en {int((time.monotonic() - start) * 1000)}ms"
+    )
+    return results
\ No newline at end of file
@@ -0,0 +1,175 @@
+# metrics.py
+"""
+Spans de latencia por etapa del pipeline del chatbot.
+
+- collect(env, ...) abre la medición de un turno (o de un envío) y span(stage)
+  o @timed(stage) miden cada etapa dentro de él. El turno viaja en un
+  contextvar, así también se ven las etapas de los hilos de llm_pool.
+- Cada llamada a OpenAI se registra sola como etapa 'openai:<task>' a partir
+  de las estadísticas de chat_completion(), y en el registro de llamadas
+  (chatbot.llm.call, ver llm_ledger) con la intención y el contacto del turno.
+- Al cerrar el turno, sus spans pasan a un buffer en memoria del proceso que se
+  escribe por lotes (metrics.flush_size filas o cada metrics.flush_interval_seconds)
+  con un cursor propio: no suma un INSERT por etapa ni se pierde si el turno
+  hace rollback. Los crons de las colas llaman a flush_all() al terminar, para
+  que lo medido no quede esperando en el buffer a la próxima ejecución.
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from ..config.config import general_config
+from . import llm_ledger
+from .openai_client import register_call_listener
+
+_logger = logging.getLogger(__name__)
+
+METRICS_CONFIG = general_config.get('metrics', {})
+
+_current_turn = contextvars.ContextVar('chatbot_metrics_turn', default=None)
+
+
+class BufferedWriter:
+    """
+    Filas pendientes de insertar en `table`, por base de datos. flush() las
+    escribe con un único INSERT multi-fila en un cursor propio.
+    """
+
+    def __init__(self, table, columns, flush_size=200, flush_interval=30):
+        self.table = table
+        self.columns = columns
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._rows = {}
+        self._last_flush = {}
+        self._lock = threading.Lock()
+
+    def add(self, env, rows):
+        """Agrega filas al buffer y lo escribe si ya se llenó o pasó el intervalo."""
+        if not rows:
+            return
+        dbname = env.cr.dbname
+        with self._lock:
+            pending = self._rows.setdefault(dbname, [])
+            pending.extend(rows)
+            last_flush = self._last_flush.setdefault(dbname, time.monotonic())
+            due = len(pending) >= self.flush_size or time.monotonic() - last_flush >= self.flush_interval
+        if due:
+            self.flush(env)
+
+    def flush(self, env):
+        """Escribe las filas pendientes de la base de `env`. Devuelve cuántas se escribieron."""
+        dbname = env.cr.dbname
+        with self._lock:
+            rows = self._rows.pop(dbname, [])
+            self._last_flush[dbname] = time.monotonic()
+        if not rows:
+            return 0
+        placeholders = '(' + ', '.join(['%s'] * len(self.columns)) + ')'
+        try:
+            with env.registry.cursor() as cr:
+                cr.execute(
+                    f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES "
+                    + ', '.join([placeholders] * len(rows)),
+                    [value for row in rows for value in row],
+                )
+        except Exception as e:
+            _logger.error(f"❌ No se pudieron guardar {len(rows)} filas en {self.table}: {e}")
+            return 0
+        return len(rows)
+
+
+span_writer = BufferedWriter(
+    'chatbot_metric_span', ['stage', 'intent', 'duration_ms', 'recorded_at'],
+    flush_size=METRICS_CONFIG.get('flush_size', 200),
+    flush_interval=METRICS_CONFIG.get('flush_interval_seconds', 30),
+)
+
+ledger_writer = BufferedWriter(
+    'chatbot_llm_call', llm_ledger.LEDGER_COLUMNS,
+    flush_size=llm_ledger.LEDGER_CONFIG.get('flush_size', 100),
+    flush_interval=llm_ledger.LEDGER_CONFIG.get('flush_interval_seconds', 30),
+)
+
+
+def flush_all(env):
+    """Escribe todo lo pendiente de los buffers (spans y llamadas a OpenAI) de la base de `env`."""
+    span_writer.flush(env)
+    ledger_writer.flush(env)
+
+
+@contextmanager
+def collect(env, stage=None, **labels):
+    """
+    Mide un turno: las etapas medidas adentro se guardan al salir con las
+    etiquetas del turno (p. ej. intent). Si se indica `stage`, también la duración total.
+    """
+    turn = {'labels': dict(labels), 'spans': [], 'llm_calls': []}
+    token = _current_turn.set(turn)
+    start = time.monotonic()
+    try:
+        yield turn
+    finally:
+        _current_turn.reset(token)
+        if stage:
+            turn['spans'].append((stage, (time.monotonic() - start) * 1000, datetime.utcnow()))
+        labels = turn['labels']
+        intent = labels.get('intent') or None
+        if METRICS_CONFIG.get('enabled', True):
+            span_writer.add(env, [(name, intent, duration, at) for name, duration, at in turn['spans']])
+        if turn['llm_calls']:
+            ledger_writer.add(env, [
+                llm_ledger.ledger_row(stats, intent, labels.get('partner_id'), labels.get('partner_name'))
+                for stats in turn['llm_calls']
+            ])
+
+
+def set_labels(**labels):
+    """Etiquetas del turno en curso, p. ej. la intención detectada."""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn['labels'].update(labels)
+
+
+@contextmanager
+def span(stage):
+    """Mide una etapa del turno en curso. Fuera de un turno no hace nada."""
+    turn = _current_turn.get()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if turn is not None:
+            turn['spans'].append((stage, (time.monotonic() - start) * 1000, datetime.utcnow()))
+
+
+def timed(stage):
+    """Decorador equivalente a envolver la función en span(stage)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _record_openai_call(stats):
+    turn = _current_turn.get()
+    if turn is not None:
+        turn['spans'].append((f"openai:{stats['task']}", stats['latency_ms'], datetime.utcnow()))
+    if not llm_ledger.is_enabled():
+        return
+    stats = dict(stats, called_at=datetime.utcnow())
+    if turn is not None:
+        # Se escribe al cerrar el turno, cuando ya se conoce la intención.
+        turn['llm_calls'].append(stats)
+    elif stats.get('env') is not None:
+        ledger_writer.add(stats['env'], [llm_ledger.ledger_row(stats)])
+
+
+register_call_listener(_record_openai_call)
\ No newline at end of file
@@ -1,26 +1,64 @@
-import openai
-import logging
-from ..config.config import general_config
-
-_logger = logging.getLogger(__name__)
-
-def detect_intention(conversation_history, api_key, system_prompt):
-    """Clasifica la intención del último mensaje considerando el historial y un prompt de sistema específico."""
-    openai.api_key = api_key
-
-    system_message = {"role": "system", "content": system_prompt}
-    messages = [system_message] + conversation_history
-
-    _logger.info("🧠 Prompt de clasificación enviado a OpenAI:\n%s", messages)
-
-    try:
-        resp = openai.ChatCompletion.create(
-            model=general_config['openai']['model'],
-            messages=messages,
-            temperature=0,
-            max_tokens=20  # Aumentado ligeramente para nombres de intención más largos
-        )
-        return resp.choices[0].message.content.strip().lower().replace('"', '').replace("'", "")
-    except Exception as e:
-        _logger.error("❌ Error detectando intención: %s", e)
-        return "otro"
\ No newline at end of file
+import logging
+import random
+from .openai_client import chat_completion
+from .prompt_builder import build_messages
+from .intent_classifier import classify, record_shadow_check, CLASSIFIER_CONFIG
+from .metrics import timed
+
+_logger = logging.getLogger(__name__)
+
+@timed('intent_detection')
+def detect_intention(env, conversation_history, system_prompt, classifier=None):
+    """
+    Clasifica la intención del último mensaje considerando el historial y un prompt de sistema específico.
+
+    Si se indica `classifier` ('general', 'order_confirmation', 'product_selection'),
+    primero se intenta clasificar localmente; solo los mensajes ambiguos llegan a OpenAI.
+    """
+    last_user_text = next(
+        (turn.get('content') for turn in reversed(conversation_history) if turn.get('role') == 'user'), None
+    )
+
+    local_intent = None
+    if classifier and last_user_text and CLASSIFIER_CONFIG.get('enabled', True):
+        model = env['chatbot.intent.cache'].sudo().get_local_model(classifier)
+        local_intent, confidence, source = classify(classifier, last_user_text, model)
+        # Una pequeña muestra se verifica igual contra OpenAI para medir la precisión local.
+        if local_intent and random.random() >= CLASSIFIER_CONFIG.get('shadow_rate', 0.02):
+            _logger.info("⚡ Intención clasificada localmente (%s, %.2f): %s", source, confidence, local_intent)
+            return local_intent
+
+    intent = _detect_intention_remote(env, conversation_history, system_prompt, last_user_text, classifier)
+    if local_intent:
+        record_shadow_check(classifier, local_intent, intent)
+        return local_intent
+    return intent
+
+def _detect_intention_remote(env, conversation_history, system_prompt, last_user_text, classifier):
+    """Clasificación con OpenAI. Como es determinística (temperature=0), el resultado se cachea."""
+    IntentCache = env['chatbot.intent.cache'].sudo()
+    cache_key = IntentCache.make_key(system_prompt, conversation_history)
+    cached_intent = IntentCache.lookup(cache_key)
+    if cached_intent is not None:
+        _logger.info("⚡ Intención obtenida del cache: %s", cached_intent)
+        return cached_intent
+
+    messages = build_messages('detect_intention', system_prompt, conversation_history)
+
+    _logger.info("🧠 Prompt de clasificación enviado a OpenAI:\n%s", messages)
+
+    try:
+        resp = chat_completion(
+            env,
+            messages,
+            task='detect_intention',
+            temperature=0,
+            max_tokens=20  # Aumentado ligeramente para nombres de intención más largos
+        )
+        intent = resp.choices[0].message.content.strip().lower().replace('"', '').replace("'", "")
+    except Exception as e:
+        _logger.error("❌ Error detectando intención: %s", e)
+        return "otro"
+
+    IntentCache.store(cache_key, intent, sample_text=last_user_text, classifier=classifier)
+    return intent
\ No newline at end of file
@@ -0,0 +1,236 @@
+# openai_client.py
+"""
+Cliente compartido para todas las llamadas a OpenAI del chatbot.
+
+- Reutiliza una única sesión HTTP (keep-alive + pool de conexiones).
+- Cachea la API key (y la URL base) leídas de ir.config_parameter.
+- Aplica un timeout por llamada y reintenta los errores transitorios con
+  backoff exponencial y jitter.
+- Ajusta cada prompt al presupuesto de tokens de su tarea (ver prompt_builder).
+- También calcula embeddings (embed_texts) con los mismos reintentos y registro.
+- Registra latencia y tokens de cada llamada (estimados localmente y los que
+  informa OpenAI) y los publica a los listeners registrados con
+  register_call_listener().
+"""
+import logging
+import random
+import threading
+import time
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config.config import general_config
+from .prompt_builder import count_message_tokens, fit_to_budget
+
+_logger = logging.getLogger(__name__)
+
+OPENAI_CONFIG = general_config.get('openai', {})
+
+TRANSIENT_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+_lock = threading.Lock()
+_session = None
+_credentials_cache = {}
+_call_listeners = []
+
+
+def _get_session():
+    """Sesión HTTP única para todo el proceso, con pool de conexiones persistentes."""
+    global _session
+    with _lock:
+        if _session is None:
+            pool_size = OPENAI_CONFIG.get('pool_size', 10)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+# La librería de OpenAI usa esta sesión en lugar de crear una por hilo.
+openai.requestssession = _get_session
+
+
+def get_model():
+    return OPENAI_CONFIG.get('model', 'gpt-4o-mini').strip()
+
+
+def get_credentials(env):
+    """Devuelve (api_key, api_base), cacheados por base de datos durante unos minutos."""
+    dbname = env.cr.dbname
+    cached = _credentials_cache.get(dbname)
+    if cached and cached['expires_at'] > time.monotonic():
+        return cached['api_key'], cached['api_base']
+
+    params = env['ir.config_parameter'].sudo()
+    api_key = params.get_param('openai.api_key')
+    api_base = params.get_param('openai.api_base') or None
+    _credentials_cache[dbname] = {
+        'api_key': api_key,
+        'api_base': api_base,
+        'expires_at': time.monotonic() + OPENAI_CONFIG.get('api_key_cache_seconds', 300),
+    }
+    return api_key, api_base
+
+
+def clear_credentials_cache():
+    _credentials_cache.clear()
+
+
+def register_call_listener(listener):
+    """Registra un callable que recibe el dict de estadísticas de cada llamada."""
+    if listener not in _call_listeners:
+        _call_listeners.append(listener)
+
+
+def _notify_listeners(stats):
+    for listener in _call_listeners:
+        try:
+            listener(stats)
+        except Exception as e:
+            _logger.error(f"❌ Error en listener de llamadas a OpenAI: {e}", exc_info=True)
+
+
+def _is_transient(error):
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    # Los 5xx llegan como APIError genérico.
+    return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
+
+
+def _backoff_delay(attempt):
+    base = OPENAI_CONFIG.get('backoff_base_seconds', 0.5)
+    cap = OPENAI_CONFIG.get('backoff_max_seconds', 8)
+    # "Full jitter": espera aleatoria entre 0 y el backoff exponencial.
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def chat_completion(env, messages, task, temperature=0, max_tokens=None, functions=None,
+                    function_call=None, model=None, timeout=None, api_key=None, api_base=None):
+    """
+    Llama a ChatCompletion con timeout y reintentos. `task` identifica el uso
+    (ej: 'detect_intention') en los logs y estadísticas.
+
+    Devuelve la respuesta de OpenAI o lanza la última excepción si se agotaron
+    los reintentos. `api_key`/`api_base` permiten llamar sin `env` (ej: desde
+    otro hilo); si no se pasan, se leen de la configuración.
+    """
+    if api_key is None:
+        api_key, api_base = get_credentials(env)
+    if not api_key:
+        _logger.error("La API key de OpenAI no está configurada.")
+        raise openai.error.AuthenticationError("La API key de OpenAI no está configurada.")
+
+    messages = fit_to_budget(messages, task)
+    model = model or get_model()
+    timeout = timeout or OPENAI_CONFIG.get('timeout_seconds', 20)
+    max_retries = OPENAI_CONFIG.get('max_retries', 3)
+
+    kwargs = {
+        'model': model,
+        'messages': messages,
+        'temperature': temperature,
+        'api_key': api_key,
+        'request_timeout': timeout,
+    }
+    if api_base:
+        kwargs['api_base'] = api_base
+    if max_tokens:
+        kwargs['max_tokens'] = max_tokens
+    if functions:
+        kwargs['functions'] = functions
+    if function_call:
+        kwargs['function_call'] = function_call
+
+    stats = _new_stats(env, task, model, count_message_tokens(messages))
+    return _create_with_retries(openai.ChatCompletion, kwargs, stats, max_retries)
+
+
+def embed_texts(env, texts, task='embeddings', model=None, dimensions=None, timeout=None):
+    """
+    Devuelve los embeddings de `texts` (lista de listas de floats, en el mismo
+    orden) en una sola llamada, con el mismo timeout, reintentos y registro
+    de estadísticas que chat_completion().
+    """
+    api_key, api_base = get_credentials(env)
+    if not api_key:
+        _logger.error("La API key de OpenAI no está configurada.")
+        raise openai.error.AuthenticationError("La API key de OpenAI no está configurada.")
+
+    model = model or OPENAI_CONFIG.get('embedding_model', 'text-embedding-3-small')
+    kwargs = {
+        'model': model,
+        'input': list(texts),
+        'api_key': api_key,
+        'request_timeout': timeout or OPENAI_CONFIG.get('timeout_seconds', 20),
+    }
+    if api_base:
+        kwargs['api_base'] = api_base
+    if dimensions:
+        kwargs['dimensions'] = dimensions
+
+    estimated = sum(count_message_tokens([{'role': 'user', 'content': text}]) for text in texts)
+    stats = _new_stats(env, task, model, estimated)
+    resp = _create_with_retries(openai.Embedding, kwargs, stats, OPENAI_CONFIG.get('max_retries', 3))
+    return [item['embedding'] for item in sorted(resp['data'], key=lambda item: item['index'])]
+
+
+def _new_stats(env, task, model, estimated_prompt_tokens):
+    return {
+        'env': env,
+        'task': task,
+        'model': model,
+        'attempts': 0,
+        'outcome': 'ok',
+        'error': None,
+        'estimated_prompt_tokens': estimated_prompt_tokens,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'latency_ms': 0,
+    }
+
+
+def _create_with_retries(resource, kwargs, stats, max_retries):
+    """resource.create(**kwargs) reintentando los errores transitorios; completa `stats` y avisa a los listeners."""
+    task, model = stats['task'], stats['model']
+    start = time.monotonic()
+    try:
+        for attempt in range(max_retries + 1):
+            stats['attempts'] = attempt + 1
+            try:
+                resp = resource.create(**kwargs)
+                break
+            except Exception as e:
+                if attempt >= max_retries or not _is_transient(e):
+                    raise
+                delay = _backoff_delay(attempt)
+                _logger.warning(
+                    f"⏳ OpenAI [{task}] error transitorio ({e.__class__.__name__}: {e}). "
+                    f"Reintento {attempt + 1}/{max_retries} en {delay:.2f}s."
+                )
+                time.sleep(delay)
+    except Exception as e:
+        stats.update({'outcome': 'error', 'error': f"{e.__class__.__name__}: {e}"})
+        raise
+    else:
+        usage = resp.get('usage') or {}
+        stats['prompt_tokens'] = usage.get('prompt_tokens', 0)
+        stats['completion_tokens'] = usage.get('completion_tokens', 0)
+        return resp
+    finally:
+        stats['latency_ms'] = int((time.monotonic() - start) * 1000)
+        _logger.info(
+            f"🤖 OpenAI [{task}] {stats['outcome']} — modelo={model} latencia={stats['latency_ms']}ms "
+            f"tokens={stats['prompt_tokens']}+{stats['completion_tokens']} "
+            f"(estimados {stats['estimated_prompt_tokens']}) intentos={stats['attempts']}"
+        )
+        _notify_listeners(stats)
\ No newline at end of file
@@ -0,0 +1,60 @@
+# product_search.py
+"""
+Normalización de textos para el índice de búsqueda de productos.
+
+Los nombres de producto y las consultas pasan por el mismo proceso: minúsculas,
+sin acentos, sin palabras vacías y con cada palabra llevada al singular, para
+que "Escobillones", "escobillón" y "escobillon" coincidan.
+"""
+import re
+
+from ..config.config import general_config
+from .utils import normalize_text
+
+SEARCH_CONFIG = general_config.get('product_search', {})
+
+STOPWORDS = {
+    'de', 'del', 'la', 'las', 'el', 'los', 'un', 'una', 'unos', 'unas', 'y', 'o',
+    'para', 'con', 'sin', 'por', 'en', 'x', 'al',
+}
+
+_SYNONYMS = None
+
+
+def singularize(word):
+    """Singular aproximado en español. Solo necesita ser consistente entre índice y consulta."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith('ones'):
+        return word[:-2]          # escobillones -> escobillon
+    if word.endswith('ces'):
+        return word[:-3] + 'z'    # luces -> luz
+    if word.endswith(('res', 'les', 'nes', 'des')):
+        return word[:-2]          # papeles -> papel
+    if word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]          # escobas -> escoba
+    return word
+
+
+def terms(text):
+    """Palabras normalizadas y en singular de un texto, sin palabras vacías."""
+    words = re.findall(r'\w+', normalize_text(text))
+    return [singularize(w) for w in words if w not in STOPWORDS]
+
+
+def synonyms():
+    """Diccionario término -> conjunto de términos equivalentes, según product_search.synonyms."""
+    global _SYNONYMS
+    if _SYNONYMS is None:
+        mapping = {}
+        for group in SEARCH_CONFIG.get('synonyms', []):
+            group_terms = {' '.join(terms(word)) for word in group}
+            for term in group_terms:
+                mapping.setdefault(term, set()).update(group_terms)
+        _SYNONYMS = mapping
+    return _SYNONYMS
+
+
+def expand(term):
+    """El término más sus sinónimos configurados."""
+    return sorted(synonyms().get(term, {term}))
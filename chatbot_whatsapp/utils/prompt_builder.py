@@ -0,0 +1,184 @@
+# prompt_builder.py
+"""
+Armado de prompts con presupuesto de tokens.
+
+- Cuenta tokens localmente: con tiktoken si está instalado y su codificación
+  está disponible sin red; si no, con una estimación por caracteres y palabras.
+- Aplica un presupuesto de tokens por tarea (prompt_budget en general_config.yml).
+- Si el historial no entra, descarta los turnos más viejos y los resume en una
+  línea compacta que viaja como contexto (y que la sesión guarda en
+  conversation_summary).
+- Ordena los mensajes con el contenido estable primero (prompt de sistema fijo,
+  después resumen, historial y mensaje del cliente), así el proveedor puede
+  reutilizar el prefijo cacheado entre llamadas.
+"""
+import logging
+import math
+import re
+
+from ..config.config import general_config
+
+_logger = logging.getLogger(__name__)
+
+BUDGET_CONFIG = general_config.get('prompt_budget', {})
+
+# Tokens que agrega el formato de chat por cada mensaje y por la respuesta.
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+SUMMARY_HEADER = "Resumen de la conversación anterior:"
+ROLE_LABELS = {'user': 'Cliente', 'assistant': 'Bot'}
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Codificación de tiktoken, o None si la librería o su archivo BPE no están disponibles."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(BUDGET_CONFIG.get('encoding', 'o200k_base'))
+        except Exception as e:
+            _logger.info(f"🔢 tiktoken no disponible ({e.__class__.__name__}); se estiman los tokens localmente.")
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """Cantidad de tokens de un texto."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Estimación: ~4 caracteres por token en español, pero nunca menos que las palabras y signos.
+    return max(math.ceil(len(text) / 4), len(re.findall(r"\w+|[^\w\s]", text)) * 3 // 4)
+
+
+def count_message_tokens(messages):
+    """Tokens de una lista de mensajes de chat, incluyendo el formato de cada mensaje."""
+    total = REPLY_OVERHEAD
+    for message in messages:
+        total += MESSAGE_OVERHEAD + count_tokens(message.get('content') or '')
+        function_call = message.get('function_call')
+        if function_call:
+            total += count_tokens(str(function_call))
+    return total
+
+
+def get_budget(task):
+    """Presupuesto de tokens del prompt para `task` (o el default)."""
+    budgets = BUDGET_CONFIG.get('tasks', {})
+    return budgets.get(task, BUDGET_CONFIG.get('default', 2000))
+
+
+def truncate_to_tokens(text, max_tokens, keep='start'):
+    """Recorta `text` para que no supere `max_tokens`, conservando el inicio o el final."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ''
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        tokens = tokens[:max_tokens] if keep == 'start' else tokens[-max_tokens:]
+        return encoding.decode(tokens)
+    chars = max_tokens * 4
+    return text[:chars] if keep == 'start' else text[-chars:]
+
+
+def compact_turns(summary, turns):
+    """
+    Agrega turnos descartados al resumen de la conversación: una línea corta
+    por turno y, si se pasa de summary_max_tokens, se conserva lo más reciente.
+    """
+    chars = BUDGET_CONFIG.get('summary_chars_per_turn', 120)
+    lines = [line for line in (summary or '').splitlines() if line.strip()]
+    for turn in turns:
+        content = ' '.join((turn.get('content') or '').split())
+        if not content:
+            continue
+        if len(content) > chars:
+            content = content[:chars].rstrip() + '…'
+        lines.append(f"{ROLE_LABELS.get(turn.get('role'), turn.get('role'))}: {content}")
+    compacted = '\n'.join(lines)
+    max_tokens = BUDGET_CONFIG.get('summary_max_tokens', 150)
+    while lines and count_tokens(compacted) > max_tokens:
+        lines.pop(0)
+        compacted = '\n'.join(lines)
+    return compacted
+
+
+def build_messages(task, system_prompt, history=None, user_content=None, summary=None):
+    """
+    Arma los mensajes de `task` dentro de su presupuesto de tokens.
+
+    Orden: prompt de sistema (estable), resumen de la conversación, historial
+    y mensaje del cliente. Si no entra todo, se descartan primero los turnos
+    más viejos del historial (que pasan al resumen) y después el resumen.
+    """
+    budget = get_budget(task)
+    system_message = {"role": "system", "content": system_prompt}
+    user_message = {"role": "user", "content": user_content} if user_content else None
+    history = [dict(turn) for turn in history or []]
+
+    fixed = [system_message] + ([user_message] if user_message else [])
+    available = budget - count_message_tokens(fixed)
+
+    kept = []
+    for turn in reversed(history):
+        cost = MESSAGE_OVERHEAD + count_tokens(turn.get('content') or '')
+        if cost > available:
+            break
+        kept.insert(0, turn)
+        available -= cost
+    dropped = history[:len(history) - len(kept)]
+
+    summary = compact_turns(summary, dropped) if dropped else (summary or '')
+    summary_messages = []
+    if summary:
+        summary_message = {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"}
+        if MESSAGE_OVERHEAD + count_tokens(summary_message['content']) <= available:
+            summary_messages.append(summary_message)
+
+    if dropped:
+        _logger.info(f"✂️ Prompt [{task}]: {len(dropped)} turnos viejos resumidos para respetar {budget} tokens.")
+    messages = [system_message] + summary_messages + kept + ([user_message] if user_message else [])
+    return fit_to_budget(messages, task)
+
+
+def fit_to_budget(messages, task):
+    """
+    Red de seguridad para cualquier lista de mensajes: si supera el presupuesto
+    de `task`, descarta los mensajes intermedios más viejos (nunca el primer
+    prompt de sistema ni el último mensaje) y, como último recurso, recorta el
+    contenido del último mensaje. Si los mensajes fijos ya agotan el
+    presupuesto por sí solos, el último mensaje se envía entero: recortarlo no
+    alcanzaría y le quitaría al modelo lo que dijo el cliente.
+    """
+    budget = get_budget(task)
+    if count_message_tokens(messages) <= budget:
+        return messages
+
+    messages = list(messages)
+    while len(messages) > 2 and count_message_tokens(messages) > budget:
+        messages.pop(1)
+
+    excess = count_message_tokens(messages) - budget
+    if excess > 0 and len(messages) > 1:
+        room = budget - count_message_tokens(messages[:-1]) - MESSAGE_OVERHEAD
+        if room <= 0:
+            _logger.warning(
+                f"⚠️ Prompt [{task}]: el prompt de sistema ya supera el presupuesto de {budget} tokens; "
+                f"se envía el último mensaje sin recortar ({excess} tokens de más)."
+            )
+            return messages
+        last = dict(messages[-1])
+        content = last.get('content') or ''
+        last['content'] = truncate_to_tokens(content, count_tokens(content) - excess)
+        messages[-1] = last
+        _logger.warning(f"✂️ Prompt [{task}]: el último mensaje se recortó {excess} tokens para respetar {budget}.")
+    return messages
\ No newline at end of file
@@ -0,0 +1,208 @@
+# vector_index.py
+"""
+Índice de vectores en disco para la búsqueda semántica de productos.
+
+Los embeddings se guardan en un directorio como dos arrays de NumPy:
+
+- vectors.npy: matriz float32 (capacidad x dimensión), una fila por variante,
+  que los procesos abren memory-mapped (no se copia a la memoria de cada worker).
+- ids.npy: product_id de cada fila (0 = fila libre, se reutiliza).
+
+Más meta.json con el proveedor (key) y la dimensión de los vectores.
+
+Solo el cron escribe (upsert/remove, bajo un flock): las filas nuevas se
+escriben en su lugar y al final se reemplaza ids.npy de forma atómica. Cada
+proceso detecta el cambio de ids.npy y reabre el índice en la próxima búsqueda.
+La búsqueda es un producto matricial contra todas las filas y un top-k con
+argpartition, en el proceso.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_logger = logging.getLogger(__name__)
+
+VECTORS_FILE = 'vectors.npy'
+IDS_FILE = 'ids.npy'
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(directory):
+    """VectorStore del directorio, compartido por todos los hilos del proceso."""
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = VectorStore(directory)
+        return _stores[directory]
+
+
+class VectorStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._loaded = None  # (firma de ids.npy, ids, vectores, meta)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _signature(self):
+        try:
+            stat = os.stat(self._path(IDS_FILE))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_meta(self):
+        try:
+            with open(self._path(META_FILE)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def _load(self):
+        """(ids, vectores, meta) vigentes; se reabren solo si ids.npy cambió."""
+        signature = self._signature()
+        with self._lock:
+            if self._loaded is None or self._loaded[0] != signature:
+                if signature is None:
+                    self._loaded = (None, np.zeros(0, dtype=np.int64), None, {})
+                else:
+                    ids = np.load(self._path(IDS_FILE))
+                    vectors = np.load(self._path(VECTORS_FILE), mmap_mode='r')
+                    self._loaded = (signature, ids, vectors, self._read_meta())
+            return self._loaded[1:]
+
+    @property
+    def key(self):
+        return self._load()[2].get('key')
+
+    def __len__(self):
+        ids = self._load()[0]
+        return int(np.count_nonzero(ids))
+
+    def product_ids(self):
+        ids = self._load()[0]
+        return set(ids[ids != 0].tolist())
+
+    def search(self, query_vectors, limit=10, min_score=0.0):
+        """
+        Para cada vector de consulta (norma 1), las `limit` filas más similares
+        con similitud coseno >= min_score, como listas de (product_id, score).
+        """
+        ids, vectors, _meta = self._load()
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if not len(ids) or vectors is None:
+            return [[] for _query in query_vectors]
+
+        scores = query_vectors @ vectors[:len(ids)].T
+        scores[:, ids == 0] = -np.inf
+        k = min(limit, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            candidates = candidates[np.argsort(-scores[row, candidates])]
+            results.append([
+                (int(ids[i]), float(scores[row, i]))
+                for i in candidates if scores[row, i] >= min_score
+            ])
+        return results
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _current_for_write(self, key, dimension):
+        """(ids, vectores abiertos para escritura); vacíos si no hay índice o cambió el proveedor."""
+        meta = self._read_meta()
+        if meta.get('key') != key or meta.get('dimension') != dimension or self._signature() is None:
+            return np.zeros(0, dtype=np.int64), None
+        ids = np.load(self._path(IDS_FILE))
+        vectors = np.lib.format.open_memmap(self._path(VECTORS_FILE), mode='r+')
+        return ids, vectors
+
+    def _publish(self, ids, key, dimension):
+        tmp_path = self._path(IDS_FILE + '.tmp')
+        with open(tmp_path, 'wb') as file:
+            np.save(file, ids)
+        with open(self._path(META_FILE + '.tmp'), 'w') as file:
+            json.dump({'key': key, 'dimension': dimension}, file)
+        os.replace(self._path(META_FILE + '.tmp'), self._path(META_FILE))
+        os.replace(tmp_path, self._path(IDS_FILE))
+
+    def upsert(self, key, product_ids, vectors):
+        """
+        Guarda los vectores de `product_ids` (reemplaza los que ya estaban). Si
+        `key` no coincide con la del índice (otro proveedor o dimensión), el
+        índice se vacía primero.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dimension = int(vectors.shape[1])
+        with self._write_lock():
+            ids, stored = self._current_for_write(key, dimension)
+            slot_of = {int(pid): slot for slot, pid in enumerate(ids) if pid}
+            free = np.flatnonzero(ids == 0).tolist()[::-1]
+            size = len(ids)
+            slots = []
+            for product_id in product_ids:
+                slot = slot_of.get(product_id)
+                if slot is None:
+                    if free:
+                        slot = free.pop()
+                    else:
+                        slot, size = size, size + 1
+                    slot_of[product_id] = slot
+                slots.append(slot)
+
+            capacity = 0 if stored is None else stored.shape[0]
+            if size > capacity:
+                stored = self._grow(stored, len(ids), max(size, 2 * capacity), dimension)
+            stored[slots] = vectors
+            stored.flush()
+
+            new_ids = np.zeros(size, dtype=np.int64)
+            new_ids[:len(ids)] = ids
+            new_ids[slots] = product_ids
+            self._publish(new_ids, key, dimension)
+
+    def _grow(self, stored, used, capacity, dimension):
+        """Copia las filas en uso a un archivo con más capacidad y lo pone en lugar del anterior."""
+        tmp_path = self._path(VECTORS_FILE + '.tmp')
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(capacity, dimension))
+        if stored is not None and used:
+            grown[:used] = stored[:used]
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self._path(VECTORS_FILE))
+        _logger.info(f"🧮 Índice de vectores ampliado a {capacity} filas de dimensión {dimension}.")
+        return np.lib.format.open_memmap(self._path(VECTORS_FILE), mode='r+')
+
+    def remove(self, product_ids):
+        """Libera las filas de `product_ids`."""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        with self._write_lock():
+            meta = self._read_meta()
+            if self._signature() is None:
+                return
+            ids = np.load(self._path(IDS_FILE))
+            ids[np.isin(ids, list(product_ids))] = 0
+            self._publish(ids, meta.get('key'), meta.get('dimension'))